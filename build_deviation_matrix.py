@@ -0,0 +1,21 @@
+import argparse
+
+from functions.deviation_matrix import build_deviation_matrix
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
+
+
+### Body of the script ###
+
+parser = argparse.ArgumentParser(description='Write the alpha carbon deviations between every pair of structures of the voxel set for the grid in the config file to memory-mapped files')
+parser.add_argument('--memory-budget', type=int, default=256, help='the approximate memory used for each block of pairs, in MB')
+parser.add_argument('--whole-peptide-only', action='store_true', help='only write the whole-peptide deviations, not the deviations at each position')
+args = parser.parse_args()
+
+# find the voxel set for the grid described in the config file, the deviations are calculated from its voxel store
+voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(load_config())
+
+deviations_filepath = build_deviation_matrix(voxel_set_filepath, memory_budget=args.memory_budget * 1024 * 1024, per_position=not args.whole_peptide_only, verbose=True)
+
+print (f"The deviation matrix has been written to {deviations_filepath}")
@@ -4,6 +4,9 @@ from hdbscan import HDBSCAN
 
 import json
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 
 def tensorize(voxel_labels:List[str]) -> List[List[int]]:
     tensorized = [[int(value) for value in voxel_label.split('_')] for voxel_label in voxel_labels]
@@ -11,9 +14,9 @@ def tensorize(voxel_labels:List[str]) -> List[List[int]]:
 
 # Load the file containing the position of the used voxels for each structure
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 
-used_voxels = json.load(open(f"output/voxel_sets/{voxel_map_hash}/used_voxels.json", 'r'))
+used_voxels = json.load(open(f"{voxel_set_filepath}/used_voxels.json", 'r'))
 
 labels = list(used_voxels.keys())
 
@@ -0,0 +1,30 @@
+import argparse
+import json
+
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set, voxel_grid_from_config
+from functions.voxel_store import export_voxel_store_to_json, load_voxel_store, voxel_store_from_json, write_voxel_store
+
+
+
+### Body of the script ###
+
+parser = argparse.ArgumentParser(description='Convert the voxel set for the grid in the config file between the per-structure JSON files and the voxel store')
+parser.add_argument('--to-json', action='store_true', help='export the voxel store to the legacy per-structure JSON files, rather than building the store from them')
+args = parser.parse_args()
+
+config = load_config()
+
+# find the voxel set for the grid described in the config file
+voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(config)
+voxel_grid = voxel_grid_from_config(config)
+
+if args.to_json:
+    file_count = export_voxel_store_to_json(load_voxel_store(voxel_set_filepath), voxel_grid, voxel_set_filepath)
+    print (f"{file_count} voxel files for {voxel_grid_hash} have been written to {voxel_set_filepath}")
+else:
+    with open("output/structure_information/all.json", 'r') as filehandle:
+        structure_info = json.load(filehandle)
+
+    store_filepath = write_voxel_store(voxel_store_from_json(structure_info['structures'], voxel_grid, voxel_set_filepath), voxel_set_filepath)
+    print (f"The voxel store for {voxel_grid_hash} has been written to {store_filepath}")
@@ -3,6 +3,9 @@ from pymol import cmd
 import json
 import sys
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 print (sys.argv)
 
 cluster_numbers = []
@@ -20,7 +23,7 @@ def load_structure(pdb_code):
     print (f"{pdb_code}: {structure_info['structures'][pdb_code]['allele']} binding {structure_info['structures'][pdb_code]['peptide']} at {structure_info['structures'][pdb_code]['resolution']}Å resolution")
     cmd.load(f"structures/{pdb_code}_peptide.pdb")
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 min_cluster_size = 3
 
 #used_voxels = json.load(open(f"output/voxel_sets/{voxel_map_hash}/used_voxels.json", 'r'))
@@ -5,6 +5,9 @@ import sys
 
 from time import sleep
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 print (sys.argv)
 
 
@@ -14,7 +17,7 @@ def load_structure(pdb_code):
     print (f"{pdb_code}: {structure_info['structures'][pdb_code]['allele']} binding {structure_info['structures'][pdb_code]['peptide']} at {structure_info['structures'][pdb_code]['resolution']}Å resolution")
     cmd.load(f"structures/{pdb_code}_peptide.pdb")
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 min_cluster_size = 3
 
 
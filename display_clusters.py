@@ -3,13 +3,16 @@
 import json
 from functions.structures import load_pdb_file_to_pymol
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 structure_info = json.load(open('output/structure_information/all.json', 'r'))
 
 
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 
-used_voxels = json.load(open(f"output/voxel_sets/{voxel_map_hash}/used_voxels.json", 'r'))
+used_voxels = json.load(open(f"{voxel_set_filepath}/used_voxels.json", 'r'))
 
 clusters = json.load(open(f"output/clusters/{voxel_map_hash}__3__5_6.json", 'r'))
 
@@ -7,6 +7,9 @@ import constants
 
 import json
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 
 
 
@@ -67,9 +70,9 @@ def display_voxel_box(centre_of_mass:List[float], box_xyz:List[float], voxel_dic
     for axis in ['x', 'y', 'z']:
         cmd.set ('sphere_transparency', 1, f'voxel_grid_{axis}')
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 
-voxel_grid = json.load(open(f"output/voxel_sets/{voxel_map_hash}/voxel_set.json", 'r'))
+voxel_grid = json.load(open(f"{voxel_set_filepath}/voxel_set.json", 'r'))
 
 
 # Load the MHC and peptide
@@ -84,7 +87,7 @@ display_pseudoatom('centre_of_box', constants.centre_of_mass, color='white')
 display_voxel_box(constants.centre_of_mass, constants.box_xyz, voxel_grid)
 
 # Load the file containing the position of the used voxels and their frequency
-position_voxels = json.load(open(f"output/voxel_sets/{voxel_map_hash}/position_voxels.json", 'r'))
+position_voxels = json.load(open(f"{voxel_set_filepath}/position_voxels.json", 'r'))
 
 
 for position in position_voxels:
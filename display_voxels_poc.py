@@ -7,6 +7,9 @@ import constants
 
 import json
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 
 
 
@@ -78,7 +81,7 @@ display_voxel_box(constants.centre_of_mass, constants.box_xyz, voxel_grid)
 
 pdb_code = constants.canonical_pdb_code
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 
 for pdb_code in constants.test_pdb_codes:
 
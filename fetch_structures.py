@@ -1,11 +1,12 @@
 from typing import Dict
 
+import argparse
 import requests
 import json
-import os
 
 
 from constants import excluded_structures, base_url
+from functions.downloads import download_structures, refresh_structures
 
 
 def deslugify_allele(allele_slug:str) -> str:
@@ -56,6 +57,11 @@ def fetch_structure_info(sql_query:str) -> Dict:
     return structure_info
 
 
+parser = argparse.ArgumentParser(description='Fetch the structure information and download the structures')
+parser.add_argument('--refresh', action='store_true', help='check cached structures for upstream changes with conditional requests, and only transfer new or changed files')
+args = parser.parse_args()
+
+
 # Define the query variables, conditions and order_by clause for the SQL query
 # TODO this may be overkill for a simple script and may make it harder to maintain/reuse for other queries
 query_variables = ['pdb_code', 'locus', 'allele_slug', 'peptide_sequence', 'resolution']
@@ -91,41 +97,26 @@ structure_info['metadata']['loci'] = loci
 with open('output/structure_information/all.json', 'w') as filehandle:
     json.dump(structure_info, filehandle, indent=4)
 
-if not os.path.exists('structures'):
-    os.mkdir('structures')
-
-i = 0
-
-downloaded = []
-cached = []
-
-for pdb_code in structure_info['structures']:
-
-    print (pdb_code)
-    structure_filepath = f"structures/{pdb_code}_peptide.pdb"
-
+if args.refresh:
+    # refresh the structures against the manifest, only new or changed files are transferred
+    results = refresh_structures(structure_info['structures'], {'base_url': base_url}, concurrency=8)
+    print (f"{len(results['updated'])} structures updated, {len(results['unchanged'])} unchanged")
+    results['downloaded'] += results['updated']
+    results['cached'] = results['unchanged']
+else:
+    # download the structures concurrently, files which are already in the structures directory are not downloaded again
+    results = download_structures(structure_info['structures'], {'base_url': base_url}, concurrency=8)
+
+for pdb_code in results['downloaded']:
     allele = structure_info['structures'][pdb_code]['allele']
     peptide = structure_info['structures'][pdb_code]['peptide']
-    pmhc_key = structure_info['structures'][pdb_code]['pmhc_key']
     resolution = structure_info['structures'][pdb_code]['resolution']
-    
-    if not os.path.exists(structure_filepath):
-
-        url = f"{base_url}/{pdb_code}_1_peptide.pdb"
-
-        r = requests.get(url)
-        if r.status_code == 200:
-            structure_data = r.text
 
-            with open(structure_filepath, 'w') as filehandle:
-                filehandle.write(structure_data)
+    print(f"Downloaded {pdb_code.upper()} - {allele} binding {peptide} at {resolution}Å resolution")
 
-            
-            print(f"Downloaded {pdb_code.upper()} - {allele} binding {peptide} at {resolution}Å resolution")
+for pdb_code in results['errors']:
+    print (results['errors'][pdb_code])
 
-            downloaded.append(pdb_code)
-    else:
-        cached.append(pdb_code)
-    i += 1
+i = len(structure_info['structures'])
 
-print(f"{i} structures ready for analysis. {len(downloaded)} downloaded, {len(cached)} previously downloaded")
\ No newline at end of file
+print(f"{i} structures ready for analysis. {len(results['downloaded'])} downloaded, {len(results['cached'])} previously downloaded, {len(results['errors'])} errors")
\ No newline at end of file
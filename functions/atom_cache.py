@@ -0,0 +1,90 @@
+from typing import Dict, List, Tuple
+
+import hashlib
+import os
+import glob
+
+import numpy as np
+
+from functions.pdb import parse_pdb_atoms, select_atoms
+
+
+CACHE_DIRECTORY = 'structures/cache'
+
+
+def cache_key(filename:str, record_names:Tuple[str]=('ATOM',)) -> str:
+    """
+    Returns:
+        str: The part of the cache filename which identifies the source file and the record types read from it, e.g. 'structures_1hhk_peptide.pdb.ATOM'.
+    """
+    path_key = os.path.normpath(filename).replace(os.sep, '_')
+    return f"{path_key}.{'_'.join(record_names)}"
+
+
+def load_cached_pdb_atoms(filename:str, atom_names:List[str]=None, record_names:Tuple[str]=('ATOM',), cache_directory:str=CACHE_DIRECTORY) -> Dict[str, np.ndarray]:
+    """
+    Loads the atoms of a PDB file, using a binary cache of the parsed arrays so that the text is only parsed once.
+
+    Each cache file is a single .npy file holding a structured array with one record per atom, which loads without any parsing (and can be memory-mapped with np.load(..., mmap_mode='r')).
+
+    The cache file is keyed by the path of the PDB file and the SHA-256 checksum of its contents, so editing or re-downloading the file invalidates the cache automatically. All atoms are cached, and the atom name filter is applied after loading.
+
+    Args:
+        filename (str): The path of the PDB file.
+        atom_names (List[str]): If given, only atoms with these names (e.g. ['CA']) are returned.
+        record_names (Tuple[str]): The record types to read, e.g. ('ATOM',) or ('ATOM', 'HETATM').
+        cache_directory (str): The directory holding the cache files.
+
+    Returns:
+        Dict[str, np.ndarray]: The atom arrays (as returned by read_pdb_atoms).
+    """
+    with open(filename, 'rb') as filehandle:
+        contents = filehandle.read()
+
+    key = cache_key(filename, record_names)
+    checksum = hashlib.sha256(contents).hexdigest()
+    cache_filename = os.path.join(cache_directory, f"{key}.{checksum}.npy")
+
+    if os.path.exists(cache_filename):
+        records = np.load(cache_filename, allow_pickle=False)
+        atoms = {name: records[name] for name in records.dtype.names}
+    else:
+        atoms = parse_pdb_atoms(contents.decode('ascii', errors='replace'), record_names=record_names)
+        save_cached_atoms(atoms, cache_filename)
+        # entries for earlier versions of the same file are no longer needed
+        for stale_filename in glob.glob(os.path.join(cache_directory, f"{glob.escape(key)}.*.npy")):
+            if stale_filename != cache_filename:
+                os.remove(stale_filename)
+
+    if atom_names is not None:
+        atoms = select_atoms(atoms, np.isin(atoms['atom_name'], list(atom_names)))
+    return atoms
+
+
+def save_cached_atoms(atoms:Dict[str, np.ndarray], cache_filename:str):
+    """
+    Writes the atom arrays to a .npy file as a structured array with one record per atom, via a temporary file so that an interrupted write never leaves a partial cache entry.
+    """
+    # coordinates become a (3,) field of each record
+    records = np.empty(len(atoms['atom_name']), dtype=[(name, values.dtype, values.shape[1:]) for name, values in atoms.items()])
+    for name, values in atoms.items():
+        records[name] = values
+
+    os.makedirs(os.path.dirname(cache_filename) or '.', exist_ok=True)
+    temporary_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    with open(temporary_filename, 'wb') as filehandle:
+        np.save(filehandle, records, allow_pickle=False)
+    os.replace(temporary_filename, cache_filename)
+
+
+def clear_atom_cache(cache_directory:str=CACHE_DIRECTORY) -> int:
+    """
+    Removes all of the cache files.
+
+    Returns:
+        int: The number of files removed.
+    """
+    cache_filenames = glob.glob(os.path.join(cache_directory, '*.npy'))
+    for cache_filename in cache_filenames:
+        os.remove(cache_filename)
+    return len(cache_filenames)
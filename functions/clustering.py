@@ -0,0 +1,355 @@
+from typing import Dict, Iterator, List, Tuple
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import json
+import os
+
+import numpy as np
+
+try:
+    from hdbscan import HDBSCAN
+except ImportError:
+    print ("hdbscan not installed")
+
+from functions.deviation_matrix import DEFAULT_MEMORY_BUDGET, condensed_indices, pair_count
+from functions.rmsd import cluster_max_rmsds
+from functions.shared import SharedDataset, attach_shared_dataset, detach_shared_dataset, share_voxel_store
+
+
+CLUSTERS_DIRECTORY = 'output/clusters'
+
+# the features of each dataset attached in a worker process, keyed by the name of the voxel_indices array, so they are only built once per worker
+_worker_features = {}
+
+
+def voxel_xyz_features(voxel_indices:np.ndarray, shape:Tuple[int, int, int]) -> np.ndarray:
+    """
+    Converts a (structures, positions) voxel index matrix into the integer x, y and z of each voxel, which are the features clustered on (as given by tensorize for the voxel labels).
+
+    Returns:
+        np.ndarray: A (structures, positions, 3) integer array. Positions outside the grid are -1.
+    """
+    voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+    nx, ny, nz = shape
+    xyz = np.stack([voxel_indices % nx, (voxel_indices // nx) % ny, voxel_indices // (nx * ny)], axis=-1)
+    return np.where(voxel_indices[..., np.newaxis] >= 0, xyz, -1)
+
+
+def position_set_features(features:np.ndarray, clustering_positions:List[int]) -> np.ndarray:
+    """
+    Selects the features for a set of positions (starting at 1) as a (structures, 3 * positions) matrix, in the same column order as the notebook's clustering_data.
+    """
+    columns = [position - 1 for position in clustering_positions]
+    return features[:, columns, :].reshape(features.shape[0], -1)
+
+
+def position_distance_cache(features:np.ndarray, cache:np.ndarray=None, memory_budget:int=DEFAULT_MEMORY_BUDGET) -> np.ndarray:
+    """
+    Builds the pairwise squared distances between the voxels of every pair of structures, separately for each position.
+
+    Squared Euclidean distance is additive across positions, so the distances for any set of positions are the sum of the rows for those positions (see position_set_distances). The voxel features are integers, so the squared distances, and their sums, are exact in float32.
+
+    The distances are calculated a block of rows at a time and written straight into the condensed cache, so no N x N array is made.
+
+    Args:
+        features (np.ndarray): The (structures, positions, 3) voxel features (as returned by voxel_xyz_features).
+        cache (np.ndarray): If given, the (positions, pairs) float32 array to fill, e.g. one in shared memory.
+        memory_budget (int): The approximate number of bytes to use for each block of rows.
+
+    Returns:
+        np.ndarray: A (positions, structures * (structures - 1) / 2) float32 array of condensed squared distances, with the pairs in the order of np.triu_indices(structures, k=1).
+    """
+    # the features are at most a few hundred voxels apart, so their squares fit in int32
+    features = np.asarray(features, dtype=np.int32)
+    structure_count, peptide_length = features.shape[:2]
+    if cache is None:
+        cache = np.empty((peptide_length, pair_count(structure_count)), dtype=np.float32)
+
+    # the differences, their squares and the masked copy take about this many bytes per pair
+    bytes_per_pair = peptide_length * (3 * 4 * 2 + 4 * 2)
+    first_row = 0
+    while first_row < structure_count - 1:
+        column_count = structure_count - first_row - 1
+        last_row = min(first_row + max(1, memory_budget // (bytes_per_pair * column_count)), structure_count)
+        rows = np.arange(first_row, last_row)
+        columns = np.arange(first_row + 1, structure_count)
+
+        squared_distances = ((features[rows, np.newaxis] - features[np.newaxis, columns]) ** 2).sum(axis=-1)
+        # only the pairs with the second row after the first are kept, flattened row by row as in the condensed matrix
+        squared_distances = squared_distances[columns[np.newaxis, :] > rows[:, np.newaxis]]
+
+        start = int(condensed_indices(first_row, first_row + 1, structure_count))
+        cache[:, start:start + len(squared_distances)] = squared_distances.T
+        first_row = last_row
+    return cache
+
+
+def position_set_distances(cache:np.ndarray, clustering_positions:List[int], structure_count:int) -> np.ndarray:
+    """
+    Sums the cached squared distances of a set of positions (starting at 1) into the square Euclidean distance matrix used by HDBSCAN(metric='precomputed'), which is the only N x N array made.
+
+    Returns:
+        np.ndarray: A (structures, structures) float64 distance matrix.
+    """
+    rows = [position - 1 for position in clustering_positions]
+    # the sums of the integer squared distances are exact in float32
+    condensed = cache[rows].sum(axis=0, dtype=np.float32)
+
+    distances = np.zeros((structure_count, structure_count))
+    start = 0
+    # each row of the condensed matrix is the upper part of a row of the square matrix, and mirrored into its column
+    for row in range(structure_count - 1):
+        end = start + structure_count - row - 1
+        row_distances = np.sqrt(condensed[start:end], dtype=np.float64)
+        distances[row, row + 1:] = row_distances
+        distances[row + 1:, row] = row_distances
+        start = end
+    return distances
+
+
+def cluster_position_set(features:np.ndarray, coordinates:np.ndarray, structure_labels:List[str], clustering_positions:List[int], min_cluster_size:int, distance_cache:np.ndarray=None, superpose:bool=False) -> Dict:
+    """
+    Clusters the structures on the voxels of a set of positions with HDBSCAN and builds the record written by the notebook's clustering cell.
+
+    Args:
+        features (np.ndarray): The (structures, positions, 3) voxel features (as returned by voxel_xyz_features).
+        coordinates (np.ndarray): The (structures, positions, 3) alpha carbon coordinates.
+        structure_labels (List[str]): The PDB code of each structure.
+        clustering_positions (List[int]): The positions to cluster on, starting at 1.
+        min_cluster_size (int): The minimum cluster size for HDBSCAN.
+        distance_cache (np.ndarray): If given, the per-position squared distances (as returned by position_distance_cache), which are summed and clustered with metric='precomputed' instead of clustering the features. This gives the clusters of algorithm='generic' on the features, not those of the default algorithm (see run_clustering_sweep).
+        superpose (bool): Whether to superpose each member of a cluster onto its first member before the maximum RMSDs are calculated. The record then also has the cluster_max_overall_rmsds and noise_cluster_max_overall_rmsd over the whole peptide.
+
+    Returns:
+        Dict: The clustering record for the position set.
+    """
+    if distance_cache is None:
+        hdb = HDBSCAN(min_cluster_size=min_cluster_size, gen_min_span_tree=True)
+        hdb.fit(position_set_features(features, clustering_positions))
+    else:
+        hdb = HDBSCAN(min_cluster_size=min_cluster_size, gen_min_span_tree=True, metric='precomputed')
+        hdb.fit(position_set_distances(distance_cache, clustering_positions, len(structure_labels)))
+    cluster_labels = np.asarray(hdb.labels_)
+
+    cluster_sizes = Counter(cluster_labels.tolist())
+    cluster_sizes.pop(-1, None)
+
+    clusters = {}
+    for cluster in sorted(cluster_sizes):
+        clusters[str(cluster + 1)] = [structure_labels[row] for row in np.flatnonzero(cluster_labels == cluster)]
+
+    noise_cluster = [structure_labels[row] for row in np.flatnonzero(cluster_labels == -1)]
+
+    # the maximum RMSDs of all of the clusters, and of the noise, are calculated in one pass
+    max_rmsds, max_overall_rmsds = cluster_max_rmsds(coordinates, cluster_labels, superpose=superpose)
+    cluster_max_rmsds_list = [max_rmsds[int(cluster_number) - 1] for cluster_number in clusters]
+    noise_cluster_max_rmsd = max_rmsds.get(-1)
+
+    # the noise cluster is included in the average, as in the notebook, unless it has fewer than two members
+    all_rmsds = [rmsd for rmsd in cluster_max_rmsds_list + [noise_cluster_max_rmsd] if rmsd is not None]
+
+    record = {
+        'clustering_positions': list(clustering_positions),
+        'cluster_count': len(clusters),
+        'noise_cluster_size': len(noise_cluster),
+        'min_cluster_size': min(cluster_sizes.values(), default=0),
+        'max_cluster_size': max(cluster_sizes.values(), default=0),
+        'mean_cluster_size': round(sum(cluster_sizes.values()) / len(cluster_sizes), 1) if cluster_sizes else 0,
+        'max_rmsd': round(sum(all_rmsds) / len(all_rmsds), 2) if all_rmsds else None,
+        'cluster_max_rmsds': cluster_max_rmsds_list,
+        'noise_cluster_max_rmsd': noise_cluster_max_rmsd,
+        'noise_cluster': noise_cluster,
+        'outlier_scores': [],
+        'clusters': clusters
+    }
+    # the records of superposed sweeps are marked and also report the overall RMSDs over the whole peptide, those of the notebook's sweeps are left as they were
+    if superpose:
+        record['superposed'] = True
+        record['cluster_max_overall_rmsds'] = [max_overall_rmsds[int(cluster_number) - 1] for cluster_number in clusters]
+        record['noise_cluster_max_overall_rmsd'] = max_overall_rmsds.get(-1)
+    return record
+
+
+def cluster_position_set_in_worker(handle:Dict, clustering_positions:List[int], min_cluster_size:int, distance_cache_handle:Dict=None, superpose:bool=False) -> Dict:
+    """
+    Clusters one position set in a worker process, using the voxel store, and the distance cache if there is one, shared by run_clustering_sweep. The features are built on the first call in each worker.
+    """
+    key = handle['arrays']['voxel_indices'].get('name') or handle['arrays']['voxel_indices'].get('filename')
+    if key not in _worker_features:
+        dataset = attach_shared_dataset(handle)
+        features = voxel_xyz_features(dataset['voxel_indices'], tuple(handle['metadata']['descriptor']['shape']))
+        # the store holds float32 coordinates, these are rounded back to the three decimal places of the PDB format
+        coordinates = np.round(dataset['coordinates'].astype(float), 3)
+        _worker_features[key] = {'features': features, 'coordinates': coordinates, 'structure_labels': dataset['pdb_codes'].tolist()}
+        # the features are copies, so the worker does not need to keep the shared arrays
+        del dataset
+        detach_shared_dataset(handle)
+
+    worker_features = _worker_features[key]
+    # the cache stays attached for as long as the worker runs, the blocks are only opened once per process
+    distance_cache = attach_shared_dataset(distance_cache_handle)['distance_cache'] if distance_cache_handle else None
+
+    return cluster_position_set(worker_features['features'], worker_features['coordinates'], worker_features['structure_labels'], clustering_positions, min_cluster_size, distance_cache=distance_cache, superpose=superpose)
+
+
+def clustering_sweep_filepath(voxel_grid_hash:str, min_cluster_size:int, superpose:bool=False) -> str:
+    """
+    Returns:
+        str: The directory the records for a voxel set and minimum cluster size are written to, e.g. output/clusters/<hash>/cluster_size_3, or output/clusters/<hash>/cluster_size_3_superposed for a superposed sweep
+    """
+    cluster_sizes_path = f"{CLUSTERS_DIRECTORY}/{voxel_grid_hash}/cluster_size_{min_cluster_size}"
+    return f"{cluster_sizes_path}_superposed" if superpose else cluster_sizes_path
+
+
+def write_clustering_record(record:Dict, cluster_sizes_path:str) -> str:
+    """
+    Writes a clustering record to <cluster_sizes_path>/clustering_<positions>.json
+
+    Returns:
+        str: The filename written.
+    """
+    cluster_positions_str = '_'.join([str(position) for position in record['clustering_positions']])
+    filename = f"{cluster_sizes_path}/clustering_{cluster_positions_str}.json"
+    with open(filename, 'w') as filehandle:
+        json.dump(record, filehandle, indent=4)
+    return filename
+
+
+class ClusteringSweep:
+    """
+    Holds what is shared by the clusterings of a voxel set: the voxel store and, if it is used, the per-position distance cache, both in shared memory, and the pool of worker processes. These are set up once, however many batches of position sets are clustered.
+
+    The distance cache is built once, in this process, straight into shared memory, and the workers attach to it rather than each building their own.
+
+        with ClusteringSweep(voxel_set_filepath, workers=4, use_distance_cache=True) as sweep:
+            for record in sweep.cluster([[4, 5], [5, 6]], min_cluster_size=3):
+                ...
+    """
+    def __init__(self, voxel_set_filepath:str, workers:int=1, use_distance_cache:bool=False, memory_budget:int=DEFAULT_MEMORY_BUDGET):
+        self.voxel_set_filepath = voxel_set_filepath
+        self.workers = workers
+        self.use_distance_cache = use_distance_cache
+        self.memory_budget = memory_budget
+        self.dataset = None
+        self.distance_cache_dataset = None
+        self.executor = None
+        self.structure_labels = []
+
+
+    def open(self):
+        """
+        Shares the voxel store, builds the distance cache if it is used, and starts the worker processes.
+        """
+        self.dataset = share_voxel_store(self.voxel_set_filepath)
+        arrays = self.dataset.arrays()
+        self.structure_labels = arrays['pdb_codes'].tolist()
+
+        if self.use_distance_cache:
+            features = voxel_xyz_features(arrays['voxel_indices'], tuple(arrays['metadata']['descriptor']['shape']))
+            structure_count, peptide_length = features.shape[:2]
+            self.distance_cache_dataset = SharedDataset.allocate({'distance_cache': (peptide_length, pair_count(structure_count))}, {'distance_cache': 'float32'})
+            position_distance_cache(features, cache=self.distance_cache_dataset.arrays()['distance_cache'], memory_budget=self.memory_budget)
+        del arrays
+
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+
+    def cluster(self, possible_clustering_positions:List[List[int]], min_cluster_size:int=3, superpose:bool=False) -> Iterator[Dict]:
+        """
+        Clusters the structures on each of a list of position sets, across the worker processes if there is more than one.
+
+        Yields:
+            Dict: The clustering record for each position set, in the order of the position sets.
+        """
+        distance_cache_handle = self.distance_cache_dataset.handle() if self.distance_cache_dataset else None
+        arguments = (repeat(self.dataset.handle()), possible_clustering_positions, repeat(min_cluster_size), repeat(distance_cache_handle), repeat(superpose))
+        if self.executor is not None:
+            return self.executor.map(cluster_position_set_in_worker, *arguments)
+        return map(cluster_position_set_in_worker, *arguments)
+
+
+    def close(self):
+        """
+        Stops the worker processes and releases the shared memory.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        # the features held for this process refer to the shared memory, which is released when the datasets are closed
+        _worker_features.clear()
+        if self.distance_cache_dataset is not None:
+            detach_shared_dataset(self.distance_cache_dataset.handle())
+            self.distance_cache_dataset.close()
+            self.distance_cache_dataset = None
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+
+    def __enter__(self):
+        return self.open()
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def run_clustering_sweep(possible_clustering_positions:List[List[int]], voxel_set_filepath:str, min_cluster_size:int=3, workers:int=1, verbose:bool=True, use_distance_cache:bool=False, superpose:bool=False) -> Dict:
+    """
+    Clusters the structures of a voxel set on each of a list of position sets, fanning the position sets out to a pool of worker processes.
+
+    The voxel store is shared with the workers rather than copied to them, and each worker builds the feature matrix once (see ClusteringSweep). The records are written as they arrive, in the order of the position sets.
+
+    Args:
+        possible_clustering_positions (List[List[int]]): The position sets to cluster on, with positions starting at 1.
+        voxel_set_filepath (str): The voxel set directory for the grid, which must have a voxel store.
+        min_cluster_size (int): The minimum cluster size for HDBSCAN.
+        workers (int): The number of worker processes. Position sets are clustered in this process if this is 1.
+        verbose (bool): Whether to print a summary of each position set.
+        use_distance_cache (bool): Whether to cluster on distance matrices summed from a per-position squared distance cache, which is built once and shared with the workers, rather than on the features of each position set. The distances are exact, but HDBSCAN builds its minimum spanning tree differently: for the low-dimensional features it uses Boruvka's algorithm on a KD-tree, whereas a precomputed matrix uses Prim's algorithm, giving the same clusters as algorithm='generic' on the features. Many structures share identical voxels, so there are many equal mutual reachability distances, and the two algorithms choose different spanning trees among them. The clusters can differ substantially from the default (for the legacy voxel set, positions [4, 7] give 27 clusters rather than 34), so the default, which matches the notebook, clusters the features.
+        superpose (bool): Whether to superpose each member of a cluster onto its first member, in one batch for all of the clusters of a position set, before the maximum RMSDs are calculated. The records are written to their own directory (see clustering_sweep_filepath).
+
+    Returns:
+        Dict: The clustering collection, containing the record for each position set keyed by its positions (e.g. '4_5_6'), the structure_labels and the structure_count.
+    """
+    with ClusteringSweep(voxel_set_filepath, workers=workers, use_distance_cache=use_distance_cache) as sweep:
+        return write_clustering_records(sweep, possible_clustering_positions, min_cluster_size=min_cluster_size, verbose=verbose, superpose=superpose)
+
+
+def write_clustering_records(sweep:ClusteringSweep, possible_clustering_positions:List[List[int]], min_cluster_size:int=3, verbose:bool=True, superpose:bool=False, cluster_sizes_path:str=None, record_fields:Dict=None) -> Dict:
+    """
+    Clusters the structures on each of a list of position sets with an open ClusteringSweep, and writes each record as it arrives (see run_clustering_sweep).
+
+    Args:
+        sweep (ClusteringSweep): The open sweep.
+        possible_clustering_positions (List[List[int]]): The position sets to cluster on, with positions starting at 1.
+        min_cluster_size (int): The minimum cluster size for HDBSCAN.
+        verbose (bool): Whether to print a summary of each position set.
+        superpose (bool): Whether to superpose the members of each cluster before the maximum RMSDs are calculated.
+        cluster_sizes_path (str): The directory to write the records to, by default the one given by clustering_sweep_filepath.
+        record_fields (Dict): Further fields to add to each record before it is written, e.g. the settings it was made with.
+
+    Returns:
+        Dict: The clustering collection, containing the record for each position set keyed by its positions (e.g. '4_5_6'), the structure_labels and the structure_count.
+    """
+    if cluster_sizes_path is None:
+        cluster_sizes_path = clustering_sweep_filepath(os.path.basename(sweep.voxel_set_filepath), min_cluster_size, superpose=superpose)
+    if not os.path.exists(cluster_sizes_path):
+        os.makedirs(cluster_sizes_path)
+
+    clustering_collection = {'clusters': {}, 'structure_labels': sweep.structure_labels, 'structure_count': len(sweep.structure_labels)}
+
+    for record in sweep.cluster(possible_clustering_positions, min_cluster_size=min_cluster_size, superpose=superpose):
+        if record_fields:
+            record.update(record_fields)
+        filename = write_clustering_record(record, cluster_sizes_path)
+        clustering_collection['clusters'][os.path.basename(filename)[len('clustering_'):-len('.json')]] = record
+        if verbose:
+            print (f"Clustering on {record['clustering_positions']}: {record['cluster_count']} clusters, {record['noise_cluster_size']} structures in the noise cluster, average max RMSD {record['max_rmsd']}")
+
+    return clustering_collection
@@ -0,0 +1,108 @@
+from typing import List
+
+import math
+
+import numpy as np
+
+from functions.voxels import VoxelGrid
+
+
+def smooth_volumes(volumes:np.ndarray, sigma:float, voxel_size:float=1) -> np.ndarray:
+    """
+    Smooths one or more volumes with a Gaussian kernel using FFT convolution.
+
+    The volumes are zero padded by three standard deviations so that density does not wrap around the edges of the grid. Density which spreads beyond the edges of the grid is lost.
+
+    Args:
+        volumes (np.ndarray): An array whose last three dimensions are the x, y and z axes of the grid, e.g. (positions, nx, ny, nz).
+        sigma (float): The standard deviation of the Gaussian kernel, in Ångströms.
+        voxel_size (float): The size of the voxels, in Ångströms.
+
+    Returns:
+        np.ndarray: The smoothed volumes, with the same shape as the input.
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    if sigma <= 0:
+        return volumes.copy()
+
+    grid_shape = volumes.shape[-3:]
+    padding = int(math.ceil(3 * sigma / voxel_size))
+    padded_shape = [axis_length + padding for axis_length in grid_shape]
+
+    # the Fourier transform of a normalised Gaussian is exp(-2 * pi^2 * sigma^2 * f^2), so the kernel is built directly in frequency space
+    frequencies = [np.fft.fftfreq(padded_shape[0], d=voxel_size), np.fft.fftfreq(padded_shape[1], d=voxel_size), np.fft.rfftfreq(padded_shape[2], d=voxel_size)]
+    kernel = np.ones([len(axis_frequencies) for axis_frequencies in frequencies])
+    for axis, axis_frequencies in enumerate(frequencies):
+        axis_shape = [1, 1, 1]
+        axis_shape[axis] = -1
+        kernel = kernel * np.exp(-2 * (math.pi * sigma * axis_frequencies) ** 2).reshape(axis_shape)
+
+    transformed = np.fft.rfftn(volumes, s=padded_shape, axes=(-3, -2, -1))
+    smoothed = np.fft.irfftn(transformed * kernel, s=padded_shape, axes=(-3, -2, -1))
+
+    return smoothed[..., :grid_shape[0], :grid_shape[1], :grid_shape[2]]
+
+
+def smooth_occupancy(occupancy:np.ndarray, voxel_grid:VoxelGrid, sigma:float=1.0, normalise:bool=False) -> np.ndarray:
+    """
+    Turns per-position (or per-cluster) voxel occupancy counts into Gaussian smoothed density maps.
+
+    Args:
+        occupancy (np.ndarray): An array of counts whose last dimension is the voxels of the grid in label order, e.g. (positions, voxels) or (clusters, positions, voxels).
+        voxel_grid (VoxelGrid): The voxel grid.
+        sigma (float): The standard deviation of the Gaussian kernel, in Ångströms.
+        normalise (bool): Whether to scale each map so that its density sums to one.
+
+    Returns:
+        np.ndarray: The density maps, with the voxel dimension replaced by the x, y and z axes of the grid.
+    """
+    volumes = voxel_grid.to_volume(np.asarray(occupancy, dtype=float))
+    density = smooth_volumes(volumes, sigma, voxel_size=voxel_grid.voxel_size)
+    if normalise:
+        totals = density.sum(axis=(-3, -2, -1), keepdims=True)
+        density = np.divide(density, totals, out=np.zeros_like(density), where=totals > 0)
+    return density
+
+
+def map_correlation(map_a:np.ndarray, map_b:np.ndarray) -> float:
+    """
+    Calculates the Pearson correlation between two density maps of the same shape.
+
+    Returns:
+        float: The correlation, or NaN if either map is constant.
+    """
+    return float(correlation_matrix(np.stack([np.asarray(map_a), np.asarray(map_b)]))[0, 1])
+
+
+def correlation_matrix(maps:np.ndarray) -> np.ndarray:
+    """
+    Calculates the Pearson correlation between every pair of a stack of density maps.
+
+    Args:
+        maps (np.ndarray): A (maps, ...) array of density maps, e.g. (clusters, nx, ny, nz).
+
+    Returns:
+        np.ndarray: A (maps, maps) array of correlations. Constant maps have a correlation of NaN.
+    """
+    maps = np.asarray(maps, dtype=float)
+    flattened = maps.reshape(maps.shape[0], -1)
+    centred = flattened - flattened.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centred, axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normalised = centred / norms[:, np.newaxis]
+    return normalised @ normalised.T
+
+
+def position_correlations(maps_a:np.ndarray, maps_b:np.ndarray) -> List[float]:
+    """
+    Calculates the correlation between matching positions of two sets of per-position density maps (e.g. two clusters or two alleles).
+
+    Args:
+        maps_a (np.ndarray): A (positions, nx, ny, nz) array of density maps.
+        maps_b (np.ndarray): A (positions, nx, ny, nz) array of density maps.
+
+    Returns:
+        List[float]: The correlation for each position.
+    """
+    return [map_correlation(map_a, map_b) for map_a, map_b in zip(maps_a, maps_b)]
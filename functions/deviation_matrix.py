@@ -0,0 +1,290 @@
+from typing import Dict, List, Tuple
+
+import json
+import os
+
+import numpy as np
+
+from functions.voxel_store import load_voxel_store
+
+
+DEVIATIONS_DIRECTORY_NAME = 'deviations'
+
+# the memory used for each block of pairs, by default 256MB
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+### The deviations follow calculate_max_rmsd in functions/structures.py: the deviation at a position is the root mean square of the x, y and z differences between the alpha carbons of two structures, without superposition ###
+
+def pair_count(structure_count:int) -> int:
+    """
+    Returns:
+        int: The number of pairs of structures, which is the length of a condensed matrix.
+    """
+    return structure_count * (structure_count - 1) // 2
+
+
+def condensed_indices(rows:np.ndarray, columns:np.ndarray, structure_count:int) -> np.ndarray:
+    """
+    Converts pairs of rows into indices of a condensed matrix, in which the pairs are in the order of np.triu_indices(structures, k=1) (as for position_distance_cache and scipy's squareform).
+
+    Args:
+        rows (np.ndarray): The row of the first structure of each pair.
+        columns (np.ndarray): The row of the second structure of each pair, which must differ from the first.
+        structure_count (int): The number of structures.
+
+    Returns:
+        np.ndarray: The condensed index of each pair.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    first = np.minimum(rows, columns)
+    second = np.maximum(rows, columns)
+    return first * structure_count - first * (first + 1) // 2 + (second - first - 1)
+
+
+def block_deviations(coordinates:np.ndarray, first_row:int, last_row:int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the deviations between each of a block of rows and every later row, in the order of the condensed matrix.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) float64 array of alpha carbon coordinates, NaN where a position is missing.
+        first_row (int): The first row of the block.
+        last_row (int): The row after the last row of the block.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The (positions, pairs) per-position deviations and the (pairs,) whole-peptide deviations, both float32.
+    """
+    structure_count = coordinates.shape[0]
+    rows = np.arange(first_row, last_row)
+    columns = np.arange(first_row + 1, structure_count)
+
+    squared_distances = ((coordinates[rows, np.newaxis] - coordinates[np.newaxis, columns]) ** 2).sum(axis=-1)
+    # only the pairs with the second row after the first are kept, flattened row by row as in the condensed matrix
+    upper = columns[np.newaxis, :] > rows[:, np.newaxis]
+    squared_distances = squared_distances[upper]
+
+    # the whole-peptide deviation is the root mean square over every position both structures have
+    present = ~np.isnan(squared_distances)
+    position_counts = present.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        whole_peptide = np.sqrt(np.where(present, squared_distances, 0).sum(axis=-1) / (3 * position_counts))
+
+    return np.sqrt(squared_distances / 3).T.astype(np.float32), whole_peptide.astype(np.float32)
+
+
+def block_row_count(structure_count:int, peptide_length:int, first_row:int, memory_budget:int) -> int:
+    """
+    Chooses how many rows to compare with every later row at once so that the temporary arrays fit in the memory budget. Later rows have fewer pairs, so the blocks grow towards the end of the matrix.
+    """
+    # the differences, their squares and the masked copies take about this many bytes per pair
+    bytes_per_pair = peptide_length * 3 * 8 * 2 + peptide_length * (8 + 4) * 2 + 16
+    column_count = max(structure_count - first_row - 1, 1)
+    return max(1, min(memory_budget // (bytes_per_pair * column_count), structure_count - first_row))
+
+
+def write_deviation_matrix(coordinates:np.ndarray, pdb_codes:List[str], deviations_filepath:str, memory_budget:int=DEFAULT_MEMORY_BUDGET, per_position:bool=True, metadata:Dict=None, verbose:bool=False) -> str:
+    """
+    Calculates the deviations between every pair of structures, a block of rows at a time, and writes them as condensed float32 matrices to memory-mapped .npy files. No N x N array is held in memory.
+
+    The files are whole_peptide.npy, a (pairs,) array, and, with per_position, positions.npy, a (positions, pairs) array. The metadata.json file is written last, so a directory with a metadata file is complete.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of alpha carbon coordinates, NaN where a position is missing.
+        pdb_codes (List[str]): The PDB code of each structure.
+        deviations_filepath (str): The directory to write to.
+        memory_budget (int): The approximate number of bytes to use for each block of pairs.
+        per_position (bool): Whether to write the per-position deviations as well as the whole-peptide deviations.
+        metadata (Dict): Further metadata to record, e.g. the voxel grid hash.
+        verbose (bool): Whether to print the progress.
+
+    Returns:
+        str: The path of the deviations directory.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    structure_count, peptide_length = coordinates.shape[:2]
+    total_pairs = pair_count(structure_count)
+
+    if not os.path.exists(deviations_filepath):
+        os.makedirs(deviations_filepath)
+    # an earlier matrix is no longer complete once it starts being overwritten
+    if os.path.exists(f"{deviations_filepath}/metadata.json"):
+        os.remove(f"{deviations_filepath}/metadata.json")
+
+    whole_peptide = np.lib.format.open_memmap(f"{deviations_filepath}/whole_peptide.npy", mode='w+', dtype=np.float32, shape=(total_pairs,))
+    positions = np.lib.format.open_memmap(f"{deviations_filepath}/positions.npy", mode='w+', dtype=np.float32, shape=(peptide_length, total_pairs)) if per_position else None
+
+    first_row = 0
+    while first_row < structure_count - 1:
+        last_row = first_row + block_row_count(structure_count, peptide_length, first_row, memory_budget)
+        # the pairs of a block of rows are contiguous in the condensed matrix
+        start = int(condensed_indices(first_row, first_row + 1, structure_count))
+        block_positions, block_whole_peptide = block_deviations(coordinates, first_row, last_row)
+        end = start + len(block_whole_peptide)
+
+        whole_peptide[start:end] = block_whole_peptide
+        if per_position:
+            positions[:, start:end] = block_positions
+        if verbose:
+            print (f"Rows {first_row} to {last_row - 1} of {structure_count}: {end} of {total_pairs} pairs")
+        first_row = last_row
+
+    whole_peptide.flush()
+    del whole_peptide
+    if per_position:
+        positions.flush()
+        del positions
+    elif os.path.exists(f"{deviations_filepath}/positions.npy"):
+        os.remove(f"{deviations_filepath}/positions.npy")
+
+    deviations_metadata = dict(metadata or {})
+    deviations_metadata.update({
+        'structure_count': structure_count,
+        'peptide_length': peptide_length,
+        'pair_count': total_pairs,
+        'per_position': per_position,
+        'pdb_codes': [str(pdb_code) for pdb_code in pdb_codes]
+    })
+    with open(f"{deviations_filepath}/metadata.json", 'w') as filehandle:
+        json.dump(deviations_metadata, filehandle, indent=4)
+    return deviations_filepath
+
+
+def build_deviation_matrix(voxel_set_filepath:str, memory_budget:int=DEFAULT_MEMORY_BUDGET, per_position:bool=True, verbose:bool=False) -> str:
+    """
+    Writes the deviation matrix for the structures of a voxel store to <voxel_set_filepath>/deviations/.
+
+    Returns:
+        str: The path of the deviations directory.
+    """
+    voxel_store = load_voxel_store(voxel_set_filepath, mmap=True)
+    # the store holds float32 coordinates, these are rounded back to the three decimal places of the PDB format
+    coordinates = np.round(voxel_store['coordinates'].astype(float), 3)
+    return write_deviation_matrix(coordinates, voxel_store['pdb_codes'].tolist(), f"{voxel_set_filepath}/{DEVIATIONS_DIRECTORY_NAME}", memory_budget=memory_budget, per_position=per_position, metadata={'voxel_grid_hash': voxel_store['metadata']['voxel_grid_hash']}, verbose=verbose)
+
+
+def has_deviation_matrix(voxel_set_filepath:str) -> bool:
+    """
+    Returns:
+        bool: Whether a complete deviation matrix has been written for the voxel set.
+    """
+    return os.path.exists(f"{voxel_set_filepath}/{DEVIATIONS_DIRECTORY_NAME}/metadata.json")
+
+
+class DeviationMatrix:
+    """
+    The deviations between every pair of structures, memory-mapped from the files written by write_deviation_matrix. Only the pairs used by a query are read from disk.
+
+        deviations = DeviationMatrix.from_voxel_set(voxel_set_filepath)
+        deviations.nearest_neighbours('1hhk', k=5)
+        deviations.cluster_diameters(record['clusters'])
+    """
+    def __init__(self, deviations_filepath:str):
+        with open(f"{deviations_filepath}/metadata.json", 'r') as filehandle:
+            self.metadata = json.load(filehandle)
+        self.pdb_codes = self.metadata['pdb_codes']
+        self.structure_count = self.metadata['structure_count']
+        self.peptide_length = self.metadata['peptide_length']
+        self.rows = {pdb_code: row for row, pdb_code in enumerate(self.pdb_codes)}
+        self.whole_peptide = np.load(f"{deviations_filepath}/whole_peptide.npy", mmap_mode='r', allow_pickle=False)
+        self.positions = np.load(f"{deviations_filepath}/positions.npy", mmap_mode='r', allow_pickle=False) if self.metadata['per_position'] else None
+
+
+    @classmethod
+    def from_voxel_set(cls, voxel_set_filepath:str):
+        """
+        Returns:
+            DeviationMatrix: The deviation matrix written by build_deviation_matrix for a voxel set.
+        """
+        return cls(f"{voxel_set_filepath}/{DEVIATIONS_DIRECTORY_NAME}")
+
+
+    def condensed(self, position:int=None) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The condensed matrix of whole-peptide deviations, or of the deviations at a position (starting at 1).
+        """
+        if position is None:
+            return self.whole_peptide
+        if self.positions is None:
+            raise ValueError('The per-position deviations were not written for this matrix')
+        return self.positions[position - 1]
+
+
+    def deviation(self, pdb_code:str, other_pdb_code:str, position:int=None) -> float:
+        """
+        Returns:
+            float: The deviation between two structures, over the whole peptide or at a position (starting at 1).
+        """
+        row = self.rows[pdb_code]
+        other_row = self.rows[other_pdb_code]
+        if row == other_row:
+            return 0.0
+        return float(self.condensed(position)[condensed_indices(row, other_row, self.structure_count)])
+
+
+    def row(self, pdb_code:str, position:int=None) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The deviations between a structure and every structure (including itself, at zero), in the order of pdb_codes.
+        """
+        row = self.rows[pdb_code]
+        others = np.arange(self.structure_count)
+        others = others[others != row]
+
+        deviations = np.zeros(self.structure_count, dtype=np.float32)
+        # the indices increase with the other row, so the reads from the file are in order
+        deviations[others] = self.condensed(position)[condensed_indices(row, others, self.structure_count)]
+        return deviations
+
+
+    def nearest_neighbours(self, pdb_code:str, k:int=5, position:int=None) -> List[Tuple[str, float]]:
+        """
+        Finds the structures closest to a structure. Pairs with no positions in common are never neighbours.
+
+        Args:
+            pdb_code (str): The structure.
+            k (int): The number of neighbours.
+            position (int): If given, the position (starting at 1) to compare, rather than the whole peptide.
+
+        Returns:
+            List[Tuple[str, float]]: The PDB code and deviation of each neighbour, closest first.
+        """
+        deviations = self.row(pdb_code, position=position)
+        deviations[self.rows[pdb_code]] = np.nan
+        candidates = np.flatnonzero(~np.isnan(deviations))
+        k = min(k, len(candidates))
+        if k == 0:
+            return []
+        nearest = candidates[np.argpartition(deviations[candidates], k - 1)[:k]]
+        nearest = nearest[np.argsort(deviations[nearest], kind='stable')]
+        return [(self.pdb_codes[row], float(deviations[row])) for row in nearest.tolist()]
+
+
+    def cluster_diameter(self, members:List[str], position:int=None) -> float:
+        """
+        Calculates the diameter of a cluster: the largest deviation between any two of its members.
+
+        Returns:
+            float: The diameter, or None if the cluster has fewer than two members.
+        """
+        member_rows = np.array(sorted(self.rows[member] for member in members), dtype=np.int64)
+        if len(member_rows) < 2:
+            return None
+        first, second = np.triu_indices(len(member_rows), k=1)
+        # the indices of sorted rows are sorted, so the reads from the file are in order
+        indices = np.sort(condensed_indices(member_rows[first], member_rows[second], self.structure_count))
+        deviations = self.condensed(position)[indices]
+        if np.isnan(deviations).all():
+            return None
+        return float(np.nanmax(deviations))
+
+
+    def cluster_diameters(self, clusters:Dict[str, List[str]], position:int=None) -> Dict:
+        """
+        Calculates the diameter of each of a dictionary of clusters of PDB codes, e.g. the clusters of a clustering record.
+
+        Returns:
+            Dict: The diameter keyed by cluster name, or None for clusters with fewer than two members.
+        """
+        return {cluster_name: self.cluster_diameter(members, position=position) for cluster_name, members in clusters.items()}
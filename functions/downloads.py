@@ -0,0 +1,343 @@
+from typing import Dict, Iterable, Tuple, Union
+
+from concurrent.futures import ThreadPoolExecutor
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# responses with these status codes are retried, any other status is treated as final
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# the manifest records the validators and checksum of each downloaded file, for conditional refreshes
+MANIFEST_FILENAME = 'structures/manifest.json'
+
+# the manifest is saved after this many new entries, so an interrupted run keeps the validators it has already received
+MANIFEST_SAVE_INTERVAL = 50
+
+
+def create_session(concurrency:int=8) -> requests.Session:
+    """
+    Creates a requests session whose connection pool is large enough for the number of concurrent downloads, so that connections are reused.
+
+    Args:
+        concurrency (int): The number of concurrent downloads.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def current_umask() -> int:
+    """
+    Returns:
+        int: The file mode creation mask of this process, which can only be read by setting it.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_file_atomically(filename:str, data:Union[str, bytes]):
+    """
+    Writes a file via a temporary file in the same directory, so that an interrupted write never leaves a partial file behind.
+
+    Args:
+        filename (str): The path of the file to write.
+        data (Union[str, bytes]): The contents of the file, bytes are written unchanged.
+    """
+    directory = os.path.dirname(filename) or '.'
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=directory, prefix='.download_')
+    try:
+        with os.fdopen(file_descriptor, 'wb' if isinstance(data, bytes) else 'w') as filehandle:
+            filehandle.write(data)
+        # mkstemp makes the file readable by its owner only, it is given the permissions open() would have given it
+        os.chmod(temporary_filename, 0o666 & ~current_umask())
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+
+def get_with_retries(session:requests.Session, url:str, retries:int=3, backoff:float=0.5, timeout:float=30, headers:Dict=None) -> requests.Response:
+    """
+    Fetches a URL, retrying connection errors, timeouts and temporary server errors with exponential backoff.
+
+    Args:
+        session (requests.Session): The session to use.
+        url (str): The URL to fetch.
+        retries (int): The number of times to retry after the first attempt.
+        backoff (float): The delay before the first retry in seconds, which doubles for each further retry.
+        timeout (float): The timeout for each request in seconds.
+        headers (Dict): Any additional request headers.
+
+    Returns:
+        requests.Response: The final response.
+
+    Raises:
+        requests.RequestException: If the last attempt fails with a connection error or timeout.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, timeout=timeout, headers=headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        time.sleep(backoff * 2 ** attempt)
+
+
+def build_manifest_entry(url:str, response:requests.Response, content:bytes) -> Dict:
+    """
+    Returns:
+        Dict: The manifest entry for a file downloaded from a URL, with the validators of the response and the checksum of its content.
+    """
+    return {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': len(content),
+        'checksum': hashlib.sha256(content).hexdigest()
+    }
+
+
+def download_structure_file(session:requests.Session, pdb_code:str, config:Dict, domain:str='peptide', retries:int=3, backoff:float=0.5) -> Tuple[str, bool, bool, str, Dict]:
+    """
+    Downloads a single structure file into the structures directory, unless it is already there.
+
+    Returns:
+        str: The PDB code.
+        bool: Whether the structure was downloaded.
+        bool: Whether the structure was already cached.
+        str: An error message, or None if no error occurred.
+        Dict: The manifest entry for the file if it was downloaded, otherwise None.
+    """
+    pdb_code = pdb_code.lower()
+    filename = f"structures/{pdb_code}_{domain}.pdb"
+    url = f"{config['base_url']}/{pdb_code}_1_{domain}.pdb"
+
+    if os.path.exists(filename):
+        return pdb_code, False, True, None, None
+
+    try:
+        r = get_with_retries(session, url, retries=retries, backoff=backoff)
+    except requests.RequestException as e:
+        return pdb_code, False, False, f"PDB code {pdb_code} has failed with error {e}", None
+
+    if r.status_code == 200:
+        # the bytes are written unchanged, so the checksum of the file matches the checksum in the manifest
+        write_file_atomically(filename, r.content)
+        return pdb_code, True, False, None, build_manifest_entry(url, r, r.content)
+    return pdb_code, False, False, f"PDB code {pdb_code} has failed with status {r.status_code}", None
+
+
+def download_structures(pdb_codes:Iterable[str], config:Dict, concurrency:int=8, domain:str='peptide', retries:int=3, backoff:float=0.5, verbose:bool=False, manifest_filename:str=MANIFEST_FILENAME) -> Dict:
+    """
+    Downloads a set of structure files concurrently, using a bounded pool of threads which share a pooled session.
+
+    Each file downloaded is recorded in the manifest, so that a later refresh can make conditional requests for it.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes of the structures to download.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        concurrency (int): The maximum number of downloads in flight at once.
+        domain (str): The domain of the structures to download, e.g. 'peptide'.
+        retries (int): The number of times to retry each download.
+        backoff (float): The delay before the first retry in seconds, which doubles for each further retry.
+        verbose (bool): Whether to print a line for each structure downloaded.
+        manifest_filename (str): The path of the manifest file.
+
+    Returns:
+        Dict: The lists of PDB codes downloaded and cached, and the error message for each PDB code which failed, in the order of pdb_codes.
+    """
+    if not os.path.exists('structures'):
+        os.makedirs('structures')
+
+    manifest = load_manifest(manifest_filename)
+    results = {'downloaded': [], 'cached': [], 'errors': {}}
+    unsaved_entries = 0
+
+    try:
+        with create_session(concurrency) as session:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                downloads = executor.map(lambda pdb_code: download_structure_file(session, pdb_code, config, domain=domain, retries=retries, backoff=backoff), pdb_codes)
+                # the manifest is only updated here, in the main thread
+                for pdb_code, downloaded, cached, error, entry in downloads:
+                    if downloaded:
+                        results['downloaded'].append(pdb_code)
+                        if verbose:
+                            print (f"Downloaded {pdb_code}")
+                    if cached:
+                        results['cached'].append(pdb_code)
+                    if error:
+                        results['errors'][pdb_code] = error
+                    if entry:
+                        manifest[f"structures/{pdb_code}_{domain}.pdb"] = entry
+                        unsaved_entries = save_manifest_periodically(manifest, unsaved_entries + 1, manifest_filename)
+    finally:
+        if unsaved_entries:
+            save_manifest(manifest, manifest_filename)
+    return results
+
+
+def file_checksum(filename:str) -> str:
+    """
+    Returns:
+        str: The SHA-256 checksum of a file, or None if the file does not exist.
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as filehandle:
+        return hashlib.sha256(filehandle.read()).hexdigest()
+
+
+def load_manifest(manifest_filename:str=MANIFEST_FILENAME) -> Dict:
+    """
+    Loads the manifest of downloaded files, keyed by filename. The manifest is empty if the file does not exist.
+    """
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename, 'r') as filehandle:
+            return json.load(filehandle)
+    return {}
+
+
+def save_manifest(manifest:Dict, manifest_filename:str=MANIFEST_FILENAME):
+    """
+    Writes the manifest of downloaded files.
+    """
+    write_file_atomically(manifest_filename, json.dumps(manifest, indent=4, sort_keys=True))
+
+
+def save_manifest_periodically(manifest:Dict, unsaved_entries:int, manifest_filename:str=MANIFEST_FILENAME) -> int:
+    """
+    Saves the manifest once MANIFEST_SAVE_INTERVAL entries have changed since it was last saved.
+
+    Returns:
+        int: The number of entries changed since the manifest was last saved.
+    """
+    if unsaved_entries >= MANIFEST_SAVE_INTERVAL:
+        save_manifest(manifest, manifest_filename)
+        return 0
+    return unsaved_entries
+
+
+def refresh_structure_file(session:requests.Session, pdb_code:str, config:Dict, manifest_entry:Dict=None, domain:str='peptide', retries:int=3, backoff:float=0.5) -> Tuple[str, str, Dict, str]:
+    """
+    Refreshes a single structure file with a conditional request, so that it is only transferred if it has changed upstream.
+
+    The request is only made conditional if the local file still matches the checksum in its manifest entry, otherwise the file is fetched in full.
+
+    Args:
+        session (requests.Session): The session to use.
+        pdb_code (str): The PDB code of the structure.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        manifest_entry (Dict): The manifest entry for the file from the previous download, if there is one.
+        domain (str): The domain of the structure, e.g. 'peptide'.
+        retries (int): The number of times to retry the request.
+        backoff (float): The delay before the first retry in seconds, which doubles for each further retry.
+
+    Returns:
+        str: The filename of the structure.
+        str: The outcome, one of 'downloaded' (new file), 'updated' (changed file), 'unchanged' or 'error'.
+        Dict: The new manifest entry for the file (the previous entry if the file was not transferred).
+        str: An error message, or None if no error occurred.
+    """
+    pdb_code = pdb_code.lower()
+    filename = f"structures/{pdb_code}_{domain}.pdb"
+    url = f"{config['base_url']}/{pdb_code}_1_{domain}.pdb"
+
+    local_checksum = file_checksum(filename)
+
+    headers = {}
+    if manifest_entry and local_checksum == manifest_entry.get('checksum') and manifest_entry.get('url') == url:
+        if manifest_entry.get('etag'):
+            headers['If-None-Match'] = manifest_entry['etag']
+        if manifest_entry.get('last_modified'):
+            headers['If-Modified-Since'] = manifest_entry['last_modified']
+
+    try:
+        r = get_with_retries(session, url, retries=retries, backoff=backoff, headers=headers)
+    except requests.RequestException as e:
+        return filename, 'error', manifest_entry, f"PDB code {pdb_code} has failed with error {e}"
+
+    if r.status_code == 304:
+        return filename, 'unchanged', manifest_entry, None
+
+    if r.status_code != 200:
+        return filename, 'error', manifest_entry, f"PDB code {pdb_code} has failed with status {r.status_code}"
+
+    content = r.content
+    new_entry = build_manifest_entry(url, r, content)
+    checksum = new_entry['checksum']
+
+    # the bytes are written unchanged, so the checksum of the file matches the checksum of the response
+    if checksum != local_checksum:
+        write_file_atomically(filename, content)
+
+    if local_checksum is None:
+        outcome = 'downloaded'
+    elif checksum != local_checksum:
+        outcome = 'updated'
+    else:
+        outcome = 'unchanged'
+    return filename, outcome, new_entry, None
+
+
+def refresh_structures(pdb_codes:Iterable[str], config:Dict, concurrency:int=8, domain:str='peptide', retries:int=3, backoff:float=0.5, manifest_filename:str=MANIFEST_FILENAME) -> Dict:
+    """
+    Refreshes a set of structure files against the server using conditional requests, transferring only new and changed files, and updates the manifest.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes of the structures to refresh.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        concurrency (int): The maximum number of requests in flight at once.
+        domain (str): The domain of the structures, e.g. 'peptide'.
+        retries (int): The number of times to retry each request.
+        backoff (float): The delay before the first retry in seconds, which doubles for each further retry.
+        manifest_filename (str): The path of the manifest file.
+
+    Returns:
+        Dict: The lists of PDB codes downloaded, updated and unchanged, and the error message for each PDB code which failed.
+    """
+    if not os.path.exists('structures'):
+        os.makedirs('structures')
+
+    manifest = load_manifest(manifest_filename)
+    pdb_codes = [pdb_code.lower() for pdb_code in pdb_codes]
+
+    results = {'downloaded': [], 'updated': [], 'unchanged': [], 'errors': {}}
+    unsaved_entries = 0
+
+    def refresh(pdb_code:str) -> Tuple[str, str, Dict, str]:
+        filename = f"structures/{pdb_code}_{domain}.pdb"
+        return refresh_structure_file(session, pdb_code, config, manifest_entry=manifest.get(filename), domain=domain, retries=retries, backoff=backoff)
+
+    try:
+        with create_session(concurrency) as session:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                # the manifest is only updated here, in the main thread, and is saved as it goes so an interrupted refresh keeps its validators
+                for pdb_code, (filename, outcome, entry, error) in zip(pdb_codes, executor.map(refresh, pdb_codes)):
+                    if error:
+                        results['errors'][pdb_code] = error
+                    else:
+                        results[outcome].append(pdb_code)
+                    if entry and entry != manifest.get(filename):
+                        manifest[filename] = entry
+                        unsaved_entries = save_manifest_periodically(manifest, unsaved_entries + 1, manifest_filename)
+    finally:
+        if unsaved_entries:
+            save_manifest(manifest, manifest_filename)
+    return results
@@ -0,0 +1,145 @@
+from typing import Dict
+
+import numpy as np
+
+from functions.occupancy import PositionOccupancy
+from functions.voxels import VoxelGrid
+
+
+# the largest squared offset of each connectivity, in voxels. neighbour_distance(...) < 1.5, as used in the notebook, is the 'edge' neighbourhood
+CONNECTIVITY_SQUARED_DISTANCES = {
+    'face': 1,
+    'edge': 2,
+    'corner': 3
+}
+
+
+def neighbourhood_stencil(connectivity:str='edge', radius:float=None) -> np.ndarray:
+    """
+    Builds the integer (x, y, z) offsets of the neighbours of a voxel, not including the voxel itself.
+
+    Args:
+        connectivity (str): 'face' (6 neighbours), 'edge' (18 neighbours) or 'corner' (26 neighbours). Ignored if a radius is given.
+        radius (float): If given, every voxel whose centre is less than this many voxels away is a neighbour.
+
+    Returns:
+        np.ndarray: A (neighbours, 3) integer array of offsets.
+    """
+    if radius is None:
+        max_squared_distance = CONNECTIVITY_SQUARED_DISTANCES[connectivity]
+        reach = 1
+    else:
+        # the distance is strictly less than the radius, in the same way as neighbour_distance(...) < 1.5
+        max_squared_distance = np.nextafter(radius * radius, 0)
+        reach = int(np.ceil(radius))
+
+    steps = np.arange(-reach, reach + 1)
+    offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+    squared_distances = (offsets ** 2).sum(axis=1)
+    return offsets[(squared_distances > 0) & (squared_distances <= max_squared_distance)]
+
+
+def neighbourhood_sums(volume:np.ndarray, stencil:np.ndarray) -> np.ndarray:
+    """
+    Sums the values of the neighbours of every voxel in a volume, with one shifted slice per stencil offset. Neighbours outside the grid count as zero.
+
+    Args:
+        volume (np.ndarray): An array whose last three dimensions are the x, y and z axes of the grid, e.g. the (positions, nx, ny, nz) occupancy volume.
+        stencil (np.ndarray): The offsets of the neighbours (as returned by neighbourhood_stencil).
+
+    Returns:
+        np.ndarray: An array of the same shape as volume, holding the sum over the neighbours of each voxel.
+    """
+    volume = np.asarray(volume)
+    reach = int(np.abs(stencil).max()) if len(stencil) else 0
+    padding = [(0, 0)] * (volume.ndim - 3) + [(reach, reach)] * 3
+    padded = np.pad(volume, padding)
+
+    nx, ny, nz = volume.shape[-3:]
+    sums = np.zeros_like(volume)
+    for dx, dy, dz in stencil.tolist():
+        sums += padded[..., reach + dx:reach + dx + nx, reach + dy:reach + dy + ny, reach + dz:reach + dz + nz]
+    return sums
+
+
+def neighbour_indices(voxel_index:int, voxel_grid:VoxelGrid, stencil:np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: The indices, in label order, of the neighbours of a voxel which are inside the grid.
+    """
+    nx, ny, nz = voxel_grid.shape
+    xyz = np.array([voxel_index % nx, (voxel_index // nx) % ny, voxel_index // (nx * ny)]) + stencil
+    inside = np.all((xyz >= 0) & (xyz < voxel_grid.shape), axis=1)
+    return voxel_grid.xyz_to_indices(xyz[inside])
+
+
+def mode_and_neighbour_statistics(occupancy:PositionOccupancy, connectivity:str='edge', radius:float=None) -> Dict:
+    """
+    Computes the occupancy of the modal voxel and of its neighbours for every position in one pass over the occupancy volume.
+
+    Args:
+        occupancy (PositionOccupancy): The occupancy of the voxels at each position.
+        connectivity (str): The neighbourhood of a voxel (see neighbourhood_stencil). The default matches neighbour_distance(...) < 1.5.
+        radius (float): If given, the radius of the neighbourhood in voxels, instead of a connectivity.
+
+    Returns:
+        Dict: A dictionary of arrays with one value per position: the modal_voxel indices, mode_counts, neighbour_counts, and the mode_percentage, neighbour_percentage and mode_and_neighbour_percentage (rounded to two places, as by percentage), plus the neighbour_voxels (the occupied neighbours of the modal voxel) for each position.
+    """
+    stencil = neighbourhood_stencil(connectivity, radius=radius)
+    voxel_grid = occupancy.voxel_grid
+
+    modal_indices, mode_counts = occupancy.modal_voxels()
+    neighbour_counts = voxel_grid.from_volume(neighbourhood_sums(occupancy.volume, stencil))[np.arange(occupancy.peptide_length), modal_indices]
+
+    structure_count = max(occupancy.structure_count, 1)
+
+    neighbour_voxels = []
+    for position, modal_index in enumerate(modal_indices.tolist()):
+        indices = neighbour_indices(modal_index, voxel_grid, stencil)
+        neighbour_voxels.append(indices[occupancy.counts[position, indices] > 0])
+
+    return {
+        'modal_voxel': modal_indices,
+        'mode_counts': mode_counts,
+        'neighbour_counts': neighbour_counts,
+        'mode_percentage': np.round(mode_counts / structure_count * 100, 2),
+        'neighbour_percentage': np.round(neighbour_counts / structure_count * 100, 2),
+        'mode_and_neighbour_percentage': np.round((mode_counts + neighbour_counts) / structure_count * 100, 2),
+        'neighbour_voxels': neighbour_voxels
+    }
+
+
+def neighbourhood_enrichment(occupancy:PositionOccupancy, connectivity:str='edge', radius:float=None) -> np.ndarray:
+    """
+    Computes, for every voxel at every position, the fraction of structures occupying the voxel or one of its neighbours.
+
+    Returns:
+        np.ndarray: A (positions, voxels) array of fractions, with voxels in label order.
+    """
+    stencil = neighbourhood_stencil(connectivity, radius=radius)
+    volume = occupancy.volume
+    neighbourhood_counts = occupancy.voxel_grid.from_volume(volume + neighbourhood_sums(volume, stencil))
+    return neighbourhood_counts / max(occupancy.structure_count, 1)
+
+
+def position_mode_set(statistics:Dict, occupancy:PositionOccupancy) -> Dict:
+    """
+    Converts the statistics (as returned by mode_and_neighbour_statistics) into the position_mode_set dictionary built by the notebook, keyed by position starting at 1.
+    """
+    voxel_grid = occupancy.voxel_grid
+    mode_set = {}
+    for position in range(occupancy.peptide_length):
+        neighbour_voxels = statistics['neighbour_voxels'][position].tolist()
+        mode_set[position + 1] = {
+            'modal_voxel': {
+                'voxel_name': voxel_grid.index_to_label(statistics['modal_voxel'][position]),
+                'count': int(statistics['mode_counts'][position])
+            },
+            'neighbour_voxels': [{'voxel_name': voxel_grid.index_to_label(voxel_index), 'count': int(occupancy.counts[position, voxel_index])} for voxel_index in neighbour_voxels],
+            'stats': {
+                'mode_percentage': float(statistics['mode_percentage'][position]),
+                'neighbour_percentage': float(statistics['neighbour_percentage'][position]),
+                'mode_and_neighbour_percentage': float(statistics['mode_and_neighbour_percentage'][position])
+            }
+        }
+    return mode_set
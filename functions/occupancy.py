@@ -0,0 +1,377 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from functions.structures import load_peptide_atoms
+from functions.voxels import VoxelGrid
+
+
+def residue_positions(residue_numbers:np.ndarray) -> np.ndarray:
+    """
+    Converts residue numbers into zero-based peptide positions, in the order in which the residues first appear.
+
+    Args:
+        residue_numbers (np.ndarray): The residue number of each atom.
+
+    Returns:
+        np.ndarray: The zero-based position of each atom's residue in the peptide.
+    """
+    unique_numbers, first_appearance, inverse = np.unique(residue_numbers, return_index=True, return_inverse=True)
+    position_order = np.argsort(np.argsort(first_appearance))
+    return position_order[inverse.reshape(-1)]
+
+
+def atom_occupancy(positions:np.ndarray, coordinates:np.ndarray, voxel_grid:VoxelGrid, peptide_length:int) -> np.ndarray:
+    """
+    Counts the atoms in each voxel for each peptide position using a single scatter-add.
+
+    Args:
+        positions (np.ndarray): The zero-based peptide position of each atom.
+        coordinates (np.ndarray): An (atoms, 3) array of atom coordinates.
+        voxel_grid (VoxelGrid): The voxel grid.
+        peptide_length (int): The number of peptide positions. Atoms at later positions are ignored.
+
+    Returns:
+        np.ndarray: A (positions, voxels) integer array of atom counts, with voxels in label order.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    voxel_indices, valid = voxel_grid.find_voxel_indices(coordinates)
+
+    # atoms outside the grid or beyond the last position are not counted
+    keep = valid & (positions >= 0) & (positions < peptide_length)
+
+    keys = positions[keep] * voxel_grid.voxel_count + voxel_indices[keep]
+    occupancy = np.bincount(keys, minlength=peptide_length * voxel_grid.voxel_count)
+    return occupancy.reshape(peptide_length, voxel_grid.voxel_count)
+
+
+def select_peptide_atoms(peptide_df:Dict, heavy_atoms_only:bool=True) -> Dict:
+    """
+    Selects the atoms of a peptide dataframe to be counted and returns them as arrays.
+
+    Only the first alternate location of each atom is kept, so that atoms are not counted twice.
+
+    Args:
+        peptide_df (Dict): The dictionary of dataframes for the peptide structure (as returned by load_pdb_file_to_dataframe).
+        heavy_atoms_only (bool): Whether to exclude hydrogen (and deuterium) atoms.
+
+    Returns:
+        Dict: A dictionary containing the zero-based positions and the (atoms, 3) coordinates of the selected atoms.
+    """
+    atoms = peptide_df['ATOM']
+
+    selection = atoms['alt_loc'].isin(['', 'A']).values
+    if heavy_atoms_only:
+        selection = selection & ~atoms['element_symbol'].isin(['H', 'D']).values
+
+    positions = residue_positions(atoms['residue_number'].values)
+
+    return {
+        'positions': positions[selection],
+        'coordinates': atoms[['x_coord', 'y_coord', 'z_coord']].values[selection]
+    }
+
+
+def select_atom_arrays(atoms:Dict, heavy_atoms_only:bool=True) -> Dict:
+    """
+    Selects the atoms to be counted from the atom arrays of a peptide (as returned by read_pdb_atoms). This is the equivalent of select_peptide_atoms which does not need pandas.
+
+    Returns:
+        Dict: A dictionary containing the zero-based positions and the (atoms, 3) coordinates of the selected atoms.
+    """
+    selection = np.isin(atoms['alt_loc'], ['', 'A'])
+    if heavy_atoms_only:
+        selection &= ~np.isin(atoms['element_symbol'], ['H', 'D'])
+
+    positions = residue_positions(atoms['residue_number'])
+
+    return {
+        'positions': positions[selection],
+        'coordinates': atoms['coordinates'][selection]
+    }
+
+
+def peptide_atom_occupancy(peptide_df:Dict, voxel_grid:VoxelGrid, peptide_length:int=9, heavy_atoms_only:bool=True) -> np.ndarray:
+    """
+    Counts the atoms of a single peptide in each voxel for each position.
+
+    Args:
+        peptide_df (Dict): The dictionary of dataframes for the peptide structure (as returned by load_pdb_file_to_dataframe).
+        voxel_grid (VoxelGrid): The voxel grid.
+        peptide_length (int): The number of peptide positions.
+        heavy_atoms_only (bool): Whether to exclude hydrogen atoms.
+
+    Returns:
+        np.ndarray: A (positions, voxels) integer array of atom counts, with voxels in label order.
+    """
+    atoms = select_peptide_atoms(peptide_df, heavy_atoms_only=heavy_atoms_only)
+    return atom_occupancy(atoms['positions'], atoms['coordinates'], voxel_grid, peptide_length)
+
+
+def structure_set_atom_occupancy(structure_info:Dict, voxel_grid:VoxelGrid, config:Dict, peptide_length:int=9, heavy_atoms_only:bool=True) -> Dict:
+    """
+    Counts the atoms of every peptide in structure_info in each voxel for each position.
+
+    The atom tables of all of the structures are concatenated and counted in a single scatter-add.
+
+    Args:
+        structure_info (Dict): The structure information dictionary (as returned by fetch_structure_info).
+        voxel_grid (VoxelGrid): The voxel grid.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        peptide_length (int): The number of peptide positions.
+        heavy_atoms_only (bool): Whether to exclude hydrogen atoms.
+
+    Returns:
+        Dict: A dictionary containing the pdb_codes which were counted, the (positions, voxels) occupancy array and the pdb_codes which failed to load.
+    """
+    pdb_codes = []
+    errors = []
+    all_positions = []
+    all_coordinates = []
+
+    for pdb_code in structure_info['structures']:
+        peptide_atoms = load_peptide_atoms(pdb_code, config)
+        if peptide_atoms is not None:
+            atoms = select_atom_arrays(peptide_atoms, heavy_atoms_only=heavy_atoms_only)
+            all_positions.append(atoms['positions'])
+            all_coordinates.append(atoms['coordinates'])
+            pdb_codes.append(pdb_code)
+        else:
+            errors.append(pdb_code)
+
+    if pdb_codes:
+        occupancy = atom_occupancy(np.concatenate(all_positions), np.concatenate(all_coordinates), voxel_grid, peptide_length)
+    else:
+        occupancy = np.zeros((peptide_length, voxel_grid.voxel_count), dtype=np.int64)
+
+    return {
+        'pdb_codes': pdb_codes,
+        'occupancy': occupancy,
+        'errors': errors
+    }
+
+
+def sparse_occupancy(occupancy:np.ndarray) -> Dict:
+    """
+    Converts a dense (positions, voxels) occupancy array into a sparse form containing only the occupied voxels.
+
+    Args:
+        occupancy (np.ndarray): A (positions, voxels) occupancy array.
+
+    Returns:
+        Dict: A dictionary of equal length arrays of zero-based positions, voxel_indices and counts.
+    """
+    positions, voxel_indices = np.nonzero(occupancy)
+    return {
+        'positions': positions,
+        'voxel_indices': voxel_indices,
+        'counts': occupancy[positions, voxel_indices]
+    }
+
+
+def dense_occupancy(sparse:Dict, voxel_grid:VoxelGrid, peptide_length:int=9) -> np.ndarray:
+    """
+    Converts a sparse occupancy (as returned by sparse_occupancy) back into a dense (positions, voxels) array.
+    """
+    occupancy = np.zeros((peptide_length, voxel_grid.voxel_count), dtype=np.int64)
+    np.add.at(occupancy, (sparse['positions'], sparse['voxel_indices']), sparse['counts'])
+    return occupancy
+
+
+def voxel_index_occupancy(voxel_indices:np.ndarray, valid:np.ndarray, voxel_count:int, groups:np.ndarray=None, group_count:int=None) -> np.ndarray:
+    """
+    Counts the structures occupying each voxel at each position from a (structures, positions) voxel index matrix (as returned by voxelize_structure_set), optionally split by group (e.g. cluster).
+
+    Args:
+        voxel_indices (np.ndarray): A (structures, positions) integer array of voxel indices.
+        valid (np.ndarray): A (structures, positions) boolean array which is True where the voxel index is inside the grid.
+        voxel_count (int): The number of voxels in the grid.
+        groups (np.ndarray): An optional zero-based group number for each structure. Structures with a negative group (e.g. HDBSCAN noise) are not counted.
+        group_count (int): The number of groups. Defaults to one more than the largest group number.
+
+    Returns:
+        np.ndarray: A (positions, voxels) integer array of counts, or a (groups, positions, voxels) array if groups are given.
+    """
+    voxel_indices = np.asarray(voxel_indices)
+    valid = np.asarray(valid, dtype=bool)
+    structure_count, peptide_length = voxel_indices.shape
+
+    positions = np.broadcast_to(np.arange(peptide_length), voxel_indices.shape)
+
+    if groups is None:
+        keys = positions[valid] * voxel_count + voxel_indices[valid]
+        occupancy = np.bincount(keys, minlength=peptide_length * voxel_count)
+        return occupancy.reshape(peptide_length, voxel_count)
+
+    groups = np.asarray(groups, dtype=np.int64)
+    if group_count is None:
+        group_count = int(groups.max()) + 1 if groups.size else 0
+    structure_groups = np.broadcast_to(groups[:, np.newaxis], voxel_indices.shape)
+    keep = valid & (structure_groups >= 0) & (structure_groups < group_count)
+
+    keys = (structure_groups[keep] * peptide_length + positions[keep]) * voxel_count + voxel_indices[keep]
+    occupancy = np.bincount(keys, minlength=group_count * peptide_length * voxel_count)
+    return occupancy.reshape(group_count, peptide_length, voxel_count)
+
+
+class PositionOccupancy:
+    """
+    The occupancy of the voxels at each peptide position by a set of structures, held as a (positions, voxels) count array and a compact index of the members of each voxel.
+
+    This replaces walking the position_voxel_set dictionaries: counts, modal voxels, top-k voxels and fractions are all array operations, and the members of a voxel are a slice of one sorted array.
+    """
+    def __init__(self, voxel_indices:np.ndarray, pdb_codes:List[str], voxel_grid:VoxelGrid):
+        """
+        Args:
+            voxel_indices (np.ndarray): A (structures, positions) integer array of voxel indices in label order, with -1 for positions outside the grid (e.g. the voxel_indices of a voxel store).
+            pdb_codes (List[str]): The PDB code of each row of voxel_indices.
+            voxel_grid (VoxelGrid): The voxel grid.
+        """
+        self.voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+        self.pdb_codes = np.asarray(pdb_codes)
+        self.voxel_grid = voxel_grid
+        self.structure_count, self.peptide_length = self.voxel_indices.shape
+
+        valid = self.voxel_indices >= 0
+        self.counts = voxel_index_occupancy(self.voxel_indices, valid, voxel_grid.voxel_count)
+
+        # the member index sorts the (structure, position) entries by position and voxel, so the members of a voxel at a position are a contiguous run of rows
+        keys = np.broadcast_to(np.arange(self.peptide_length), self.voxel_indices.shape) * voxel_grid.voxel_count + self.voxel_indices
+        keys = np.where(valid, keys, -1).T.reshape(-1)
+        rows = np.broadcast_to(np.arange(self.structure_count), (self.peptide_length, self.structure_count)).reshape(-1)
+        order = np.argsort(keys, kind='stable')
+        order = order[keys[order] >= 0]
+        self.member_rows = rows[order]
+        self.member_offsets = np.concatenate([[0], np.cumsum(self.counts.reshape(-1))])
+
+
+    @classmethod
+    def from_voxel_store(cls, voxel_store:Dict, voxel_grid:VoxelGrid, pdb_codes:List[str]=None):
+        """
+        Builds the occupancy from a voxel store (as returned by load_voxel_store).
+
+        Args:
+            voxel_store (Dict): The voxel store.
+            voxel_grid (VoxelGrid): The voxel grid of the store.
+            pdb_codes (List[str]): If given, only these structures are included, in this order.
+        """
+        if pdb_codes is None:
+            return cls(voxel_store['voxel_indices'], voxel_store['pdb_codes'], voxel_grid)
+
+        row_lookup = {pdb_code: row for row, pdb_code in enumerate(voxel_store['pdb_codes'].tolist())}
+        rows = [row_lookup[pdb_code] for pdb_code in pdb_codes]
+        return cls(np.asarray(voxel_store['voxel_indices'])[rows], [voxel_store['pdb_codes'][row] for row in rows], voxel_grid)
+
+
+    @property
+    def volume(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The counts as a (positions, nx, ny, nz) array.
+        """
+        return self.voxel_grid.to_volume(self.counts)
+
+
+    def members(self, position:int, voxel_label:str) -> List[str]:
+        """
+        Returns the PDB codes of the structures occupying a voxel at a position.
+
+        Args:
+            position (int): The peptide position, starting at 1.
+            voxel_label (str): The voxel label, e.g. '9_6_9'.
+
+        Returns:
+            List[str]: The PDB codes, in the order of the structures.
+        """
+        key = (position - 1) * self.voxel_grid.voxel_count + self.voxel_grid.label_to_index(voxel_label)
+        return self.pdb_codes[self.member_rows[self.member_offsets[key]:self.member_offsets[key + 1]]].tolist()
+
+
+    def member_rows_for(self, position:int, voxel_index:int) -> np.ndarray:
+        """
+        Returns the rows (structure numbers) occupying a voxel at a zero-based position, by voxel index.
+        """
+        key = position * self.voxel_grid.voxel_count + voxel_index
+        return self.member_rows[self.member_offsets[key]:self.member_offsets[key + 1]]
+
+
+    def fractions(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: A (positions, voxels) array of the fraction of all structures occupying each voxel at each position.
+        """
+        return self.counts / max(self.structure_count, 1)
+
+
+    def modal_voxels(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the most occupied voxel at each position. Ties are broken by the lowest voxel index.
+
+        Returns:
+            np.ndarray: The voxel index of the modal voxel for each position.
+            np.ndarray: The count of the modal voxel for each position.
+        """
+        modal_indices = np.argmax(self.counts, axis=1)
+        return modal_indices, self.counts[np.arange(self.peptide_length), modal_indices]
+
+
+    def top_voxels(self, k:int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k most occupied voxels at each position, most occupied first. Ties are broken by the lowest voxel index.
+
+        Returns:
+            np.ndarray: A (positions, k) array of voxel indices.
+            np.ndarray: A (positions, k) array of counts.
+        """
+        k = min(k, self.voxel_grid.voxel_count)
+        # only the k largest counts are partitioned out, then just those are sorted
+        if k < self.voxel_grid.voxel_count:
+            candidates = np.argpartition(-self.counts, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), (self.peptide_length, k))
+        candidate_counts = np.take_along_axis(self.counts, candidates, axis=1)
+        order = np.lexsort((candidates, -candidate_counts), axis=1)
+        top_indices = np.take_along_axis(candidates, order, axis=1)
+        return top_indices, np.take_along_axis(self.counts, top_indices, axis=1)
+
+
+    def occupied_voxel_count(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The number of different voxels occupied at each position.
+        """
+        return np.count_nonzero(self.counts, axis=1)
+
+
+    def to_used_voxel_set(self) -> Dict:
+        """
+        Converts the voxel indices into the legacy used_voxel_set dictionary (as returned by aggregate_voxel_usage).
+
+        Returns:
+            Dict: The labels of the voxels occupied by each structure, in position order, keyed by PDB code.
+        """
+        used_voxel_set = {}
+        for pdb_code, voxel_indices in zip(self.pdb_codes.tolist(), self.voxel_indices.tolist()):
+            used_voxel_set[pdb_code] = [self.voxel_grid.index_to_label(voxel_index) for voxel_index in voxel_indices if voxel_index >= 0]
+        return used_voxel_set
+
+
+    def to_position_voxel_set(self) -> Dict:
+        """
+        Converts the occupancy into the legacy position_voxel_set dictionary (as returned by aggregate_voxel_usage), keyed by peptide position starting at 1, with voxels in the order in which they are first occupied.
+
+        Returns:
+            Dict: The count and members of each voxel for each position.
+        """
+        position_voxel_set = {}
+        for position in range(self.peptide_length):
+            voxel_indices = np.flatnonzero(self.counts[position])
+            if voxel_indices.size == 0:
+                continue
+            # the first member of each voxel is its earliest structure, which gives the order of first occupancy
+            first_rows = self.member_rows[self.member_offsets[position * self.voxel_grid.voxel_count + voxel_indices]]
+            position_voxel_set[position + 1] = {}
+            for voxel_index in voxel_indices[np.argsort(first_rows, kind='stable')]:
+                members = self.pdb_codes[self.member_rows_for(position, voxel_index)].tolist()
+                position_voxel_set[position + 1][self.voxel_grid.index_to_label(voxel_index)] = {'count': len(members), 'members': members}
+        return position_voxel_set
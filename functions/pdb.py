@@ -0,0 +1,125 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+# the fixed columns of the PDB ATOM/HETATM record, as (start, end) character positions
+PDB_COLUMNS = {
+    'record_name': (0, 6),
+    'atom_number': (6, 11),
+    'atom_name': (12, 16),
+    'alt_loc': (16, 17),
+    'residue_name': (17, 20),
+    'chain_id': (21, 22),
+    'residue_number': (22, 26),
+    'insertion': (26, 27),
+    'x_coord': (30, 38),
+    'y_coord': (38, 46),
+    'z_coord': (46, 54),
+    'occupancy': (54, 60),
+    'b_factor': (60, 66),
+    'element_symbol': (76, 78)
+}
+
+PDB_LINE_LENGTH = 80
+
+
+def read_pdb_atoms(filename:str, atom_names:List[str]=None, record_names:Tuple[str]=('ATOM',)) -> Dict[str, np.ndarray]:
+    """
+    Reads the atoms of a PDB file straight into NumPy arrays, using the fixed columns of the PDB format.
+
+    The file is read in one pass, the matching records are packed into a single block of characters and each column is converted for all atoms at once.
+
+    Args:
+        filename (str): The path of the PDB file.
+        atom_names (List[str]): If given, only atoms with these names (e.g. ['CA']) are read.
+        record_names (Tuple[str]): The record types to read, e.g. ('ATOM',) or ('ATOM', 'HETATM').
+
+    Returns:
+        Dict[str, np.ndarray]: Arrays with one value per atom for atom_name, alt_loc, residue_name, chain_id, residue_number, insertion, occupancy, b_factor and element_symbol, plus an (atoms, 3) array of coordinates.
+    """
+    with open(filename, 'r') as filehandle:
+        text = filehandle.read()
+    return parse_pdb_atoms(text, atom_names=atom_names, record_names=record_names)
+
+
+def parse_pdb_atoms(text:str, atom_names:List[str]=None, record_names:Tuple[str]=('ATOM',)) -> Dict[str, np.ndarray]:
+    """
+    Parses the atoms of PDB formatted text into NumPy arrays (see read_pdb_atoms).
+    """
+    record_prefixes = tuple(record_names)
+    lines = [line for line in text.splitlines() if line.startswith(record_prefixes)]
+
+    # atom names are filtered before the columns are converted, so unwanted atoms cost almost nothing
+    if atom_names is not None:
+        wanted_names = set(atom_names)
+        lines = [line for line in lines if line[12:16].strip() in wanted_names]
+
+    block = np.frombuffer(''.join([line[:PDB_LINE_LENGTH].ljust(PDB_LINE_LENGTH) for line in lines]).encode('ascii', errors='replace'), dtype='S1')
+    block = block.reshape(len(lines), PDB_LINE_LENGTH)
+
+    def column(name:str) -> np.ndarray:
+        start, end = PDB_COLUMNS[name]
+        return np.ascontiguousarray(block[:, start:end]).view(f"S{end - start}").reshape(len(lines))
+
+    def text_column(name:str) -> np.ndarray:
+        return np.char.strip(column(name).astype(str))
+
+    def number_column(name:str, dtype:type, default:float=0) -> np.ndarray:
+        values = np.char.strip(column(name))
+        # blank numeric fields (e.g. a missing occupancy) are given the default value
+        values = np.where(values == b'', str(default).encode(), values)
+        return values.astype(dtype)
+
+    atom_name = text_column('atom_name')
+    element_symbol = text_column('element_symbol')
+
+    # older files may not have the element column, in which case it is taken from the first letter of the atom name
+    missing_elements = element_symbol == ''
+    if missing_elements.any():
+        inferred = np.array([name.lstrip('0123456789')[:1] for name in atom_name[missing_elements]], dtype=element_symbol.dtype)
+        element_symbol[missing_elements] = inferred
+
+    coordinates = np.stack([number_column('x_coord', float), number_column('y_coord', float), number_column('z_coord', float)], axis=1) if lines else np.zeros((0, 3))
+
+    return {
+        'atom_name': atom_name,
+        'alt_loc': text_column('alt_loc'),
+        'residue_name': text_column('residue_name'),
+        'chain_id': text_column('chain_id'),
+        'residue_number': number_column('residue_number', np.int64),
+        'insertion': text_column('insertion'),
+        'coordinates': coordinates,
+        'occupancy': number_column('occupancy', float, default=1.0),
+        'b_factor': number_column('b_factor', float),
+        'element_symbol': element_symbol
+    }
+
+
+def first_atom_per_residue(atoms:Dict[str, np.ndarray], atom_name:str='CA') -> Tuple[List, List[str]]:
+    """
+    Selects the first atom with a given name for each residue, in the order in which the residues appear.
+
+    Args:
+        atoms (Dict[str, np.ndarray]): The atoms (as returned by read_pdb_atoms).
+        atom_name (str): The atom name to select, e.g. 'CA'.
+
+    Returns:
+        List: The x, y and z coordinates of the atom for each residue.
+        List[str]: The residue name for each residue.
+    """
+    matching = np.flatnonzero(atoms['atom_name'] == atom_name)
+    residue_numbers, first_matches = np.unique(atoms['residue_number'][matching], return_index=True)
+    selected = matching[np.sort(first_matches)]
+    coordinates = [tuple(coordinate) for coordinate in atoms['coordinates'][selected].tolist()]
+    return coordinates, atoms['residue_name'][selected].tolist()
+
+
+def select_atoms(atoms:Dict[str, np.ndarray], selection:np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Applies a boolean mask (or an array of indices) to every atom array.
+
+    Returns:
+        Dict[str, np.ndarray]: The atom arrays for the selected atoms.
+    """
+    return {name: values[selection] for name, values in atoms.items()}
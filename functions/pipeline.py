@@ -0,0 +1,432 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import json
+import os
+import traceback
+
+from functions.pdb import first_atom_per_residue
+from functions.structures import download_structure, load_peptide_atoms
+from functions.voxels import VoxelGrid, find_voxels_for_coordinates
+from functions.voxel_store import VoxelStoreBuilder, build_voxel_store, has_voxel_store, load_voxel_store, store_structure_voxels, write_voxel_store
+
+
+### Each stage of the pipeline is a generator which handles one structure at a time, so only one structure is held in memory ###
+
+def fetch_structures(pdb_codes:Iterable[str], config:Dict, counts:Dict=None) -> Iterator[str]:
+    """
+    Makes sure that the peptide structure file for each PDB code is in the structures directory, downloading it if needed.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes to fetch.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        counts (Dict): An optional dictionary which is updated with the number of structures downloaded, cached and in error.
+
+    Yields:
+        str: The PDB code of each structure which is available locally.
+    """
+    for pdb_code in pdb_codes:
+        # the structure data is discarded here, it is parsed from the file by the next stage
+        structure_data, downloaded, cached, error = download_structure(pdb_code, config)
+        if counts is not None:
+            counts['downloaded'] = counts.get('downloaded', 0) + int(downloaded)
+            counts['cached'] = counts.get('cached', 0) + int(cached)
+            counts['errors'] = counts.get('errors', 0) + int(error is not None)
+        if error:
+            print (error)
+            continue
+        yield pdb_code
+
+
+def voxelize_atoms(atoms:Dict, voxel_grid:VoxelGrid) -> Dict:
+    """
+    Finds the voxel occupied by the alpha carbon of each residue of a parsed peptide.
+
+    Returns:
+        Dict: The structure_voxels dictionary (as returned by find_voxels_for_structure).
+    """
+    coordinates, sequence = first_atom_per_residue(atoms, atom_name='CA')
+    return find_voxels_for_coordinates(coordinates, sequence, voxel_grid['voxels'], voxel_size=voxel_grid.voxel_size)
+
+
+def voxelize_structure(pdb_code:str, voxel_grid:VoxelGrid, config:Dict) -> Tuple[str, Dict, str]:
+    """
+    Parses and voxelizes a single structure, capturing any error rather than raising it. This is the unit of work for the process pool.
+
+    Returns:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary, or None if the structure could not be parsed or voxelized.
+        str: An error message, or None if no error occurred.
+    """
+    try:
+        atoms = load_peptide_atoms(pdb_code, config, atom_names=['CA'])
+        if atoms is None:
+            return pdb_code, None, f"PDB code {pdb_code} could not be loaded"
+        return pdb_code, voxelize_atoms(atoms, voxel_grid), None
+    except Exception:
+        return pdb_code, None, f"PDB code {pdb_code} has failed with error {traceback.format_exc()}"
+
+
+def voxelize_batch(pdb_codes:List[str], voxel_grid:VoxelGrid, config:Dict) -> List[Tuple[str, Dict, str]]:
+    """
+    Parses and voxelizes a batch of structures, so that the cost of passing the grid and config to a worker is shared between structures.
+
+    Returns:
+        List[Tuple[str, Dict, str]]: The result of voxelize_structure for each structure.
+    """
+    return [voxelize_structure(pdb_code, voxel_grid, config) for pdb_code in pdb_codes]
+
+
+def skip_failed_structures(results:Iterable[Tuple[str, Dict, str]], errors:List=None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Prints the error for each structure which failed to voxelize and passes the others on to the next stage.
+
+    Args:
+        results (Iterable[Tuple[str, Dict, str]]): The results of voxelize_structure.
+        errors (List): An optional list which is extended with the (pdb_code, error) of each structure which failed.
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary.
+    """
+    for pdb_code, structure_voxels, error in results:
+        if error:
+            print (error)
+            if errors is not None:
+                errors.append((pdb_code, error))
+            continue
+        yield pdb_code, structure_voxels
+
+
+def voxelize_structures_serially(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, errors:List=None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Parses and voxelizes structures one at a time, capturing the errors in the same way as voxelize_structures_in_parallel.
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary.
+    """
+    return skip_failed_structures(map(voxelize_structure, pdb_codes, repeat(voxel_grid), repeat(config)), errors=errors)
+
+
+def voxelize_structures_in_parallel(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, workers:int, errors:List=None, batch_size:int=8) -> Iterator[Tuple[str, Dict]]:
+    """
+    Parses and voxelizes structures across a pool of worker processes. Results are yielded in the same order as the PDB codes, so the output is identical to the serial pipeline.
+
+    The PDB codes are read from the upstream stage as the work proceeds, in batches, with only a few batches per worker in flight at once, so the pipeline keeps streaming.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes to process (e.g. from fetch_structures).
+        voxel_grid (VoxelGrid): The voxel grid.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        workers (int): The number of worker processes.
+        errors (List): An optional list which is extended with the (pdb_code, error) of each structure which failed.
+        batch_size (int): The number of structures sent to a worker at once.
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary.
+    """
+    return skip_failed_structures(voxelize_batches_in_parallel(pdb_codes, voxel_grid, config, workers, batch_size), errors=errors)
+
+
+def voxelize_batches_in_parallel(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, workers:int, batch_size:int) -> Iterator[Tuple[str, Dict, str]]:
+    """
+    Submits batches of structures to a pool of worker processes, keeping at most two batches per worker in flight, and yields the results in order.
+
+    Yields:
+        Tuple[str, Dict, str]: The result of voxelize_structure for each structure.
+    """
+    pdb_codes = iter(pdb_codes)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while True:
+            # top up the batches in flight before waiting for the oldest one
+            while len(pending) < workers * 2:
+                batch = list(islice(pdb_codes, batch_size))
+                if not batch:
+                    break
+                pending.append(executor.submit(voxelize_batch, batch, voxel_grid, config))
+            if not pending:
+                break
+            for result in pending.popleft().result():
+                yield result
+
+
+def write_structure_voxels(voxelized_structures:Iterable[Tuple[str, Dict]], voxel_set_filepath:str, voxel_grid_hash:str, verbose:bool=True) -> Iterator[Tuple[str, Dict]]:
+    """
+    Writes the voxels for each structure to <voxel_set_filepath>/<pdb_code>.json and passes them on to the next stage.
+    """
+    for pdb_code, structure_voxels in voxelized_structures:
+        voxel_data = {
+            'voxel_grid_hash': voxel_grid_hash,
+            'structure_voxels': structure_voxels
+        }
+
+        filename = f"{voxel_set_filepath}/{pdb_code}.json"
+
+        with open(filename, 'w') as filehandle:
+            json.dump(voxel_data, filehandle, indent=4)
+        if verbose:
+            print (f"Voxels for {pdb_code} have been written to {filename}")
+        yield pdb_code, structure_voxels
+
+
+def add_to_voxel_store(voxelized_structures:Iterable[Tuple[str, Dict]], store_builder:VoxelStoreBuilder) -> Iterator[Tuple[str, Dict]]:
+    """
+    Adds the voxels for each structure to the arrays of the voxel store being built, and passes them on to the next stage.
+    """
+    for pdb_code, structure_voxels in voxelized_structures:
+        store_builder.add(pdb_code, structure_voxels)
+        yield pdb_code, structure_voxels
+
+
+def load_structure_voxels(pdb_codes:Iterable[str], voxel_set_filepath:str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Reads previously written voxels for each structure back from <voxel_set_filepath>/<pdb_code>.json
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary.
+    """
+    for pdb_code in pdb_codes:
+        filename = f"{voxel_set_filepath}/{pdb_code}.json"
+        with open(filename, 'r') as filehandle:
+            yield pdb_code, json.load(filehandle)['structure_voxels']
+
+
+def aggregate_voxel_usage(voxelized_structures:Iterable[Tuple[str, Dict]]) -> Tuple[Dict, Dict]:
+    """
+    Consumes a stream of structure voxels and builds the voxel usage for each structure and the voxel counts and members for each position.
+
+    Returns:
+        Dict: The used voxel labels for each PDB code (as written to used_voxels.json).
+        Dict: The count and members of each voxel for each position (as written to position_voxels.json).
+    """
+    used_voxel_set = {}
+    position_voxel_set = {}
+
+    for pdb_code, structure_voxels in voxelized_structures:
+        used_voxels = [structure_voxels[position]['voxel_label'] for position in structure_voxels]
+        used_voxel_set[pdb_code] = used_voxels
+
+        # voxels are keyed by their true peptide position, so a position outside the grid does not shift the positions after it
+        for position in structure_voxels:
+            voxel_label = structure_voxels[position]['voxel_label']
+            if int(position) not in position_voxel_set:
+                position_voxel_set[int(position)] = {}
+            if voxel_label not in position_voxel_set[int(position)]:
+                position_voxel_set[int(position)][voxel_label] = {'count':0,'members':[]}
+            # each structure is only seen once, so it can only be a member of a voxel at a position once
+            position_voxel_set[int(position)][voxel_label]['members'].append(pdb_code)
+            position_voxel_set[int(position)][voxel_label]['count'] += 1
+
+    return used_voxel_set, sort_positions(position_voxel_set)
+
+
+def sort_positions(position_voxel_set:Dict) -> Dict:
+    """
+    Returns:
+        Dict: The position_voxel_set with its positions in peptide order, whichever order they were first occupied in.
+    """
+    return {position: position_voxel_set[position] for position in sorted(position_voxel_set, key=int)}
+
+
+def write_voxel_usage(used_voxel_set:Dict, position_voxel_set:Dict, voxel_set_filepath:str):
+    """
+    Writes the voxel usage to <voxel_set_filepath>/used_voxels.json and <voxel_set_filepath>/position_voxels.json
+    """
+    with open(f"{voxel_set_filepath}/used_voxels.json", 'w') as filehandle:
+        json.dump(used_voxel_set, filehandle, indent=4)
+
+    with open(f"{voxel_set_filepath}/position_voxels.json", 'w') as filehandle:
+        json.dump(position_voxel_set, filehandle, indent=4)
+
+
+def run_voxel_pipeline(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, voxel_set_filepath:str, verbose:bool=True, workers:int=1, write_json:bool=True) -> Dict:
+    """
+    Runs the streaming pipeline of fetch, parse, voxelize, write and aggregate for a set of structures, then writes the voxel usage files and the voxel store.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes to process.
+        voxel_grid (VoxelGrid): The voxel grid.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        voxel_set_filepath (str): The output directory for the voxel grid.
+        verbose (bool): Whether to print a line for each structure written.
+        workers (int): The number of processes used to parse and voxelize the structures. Structures are processed serially if this is 1.
+        write_json (bool): Whether to write the per-structure JSON files as well as the voxel store.
+
+    Returns:
+        Dict: The number of structures downloaded, cached, in error and voxelized.
+    """
+    if not os.path.exists(voxel_set_filepath):
+        os.makedirs(voxel_set_filepath)
+
+    voxel_grid_hash = os.path.basename(voxel_set_filepath)
+
+    counts = {'downloaded': 0, 'cached': 0, 'errors': 0}
+    errors = []
+
+    # the store arrays are preallocated for the structures in the list, if its length is known, and filled as the structures stream past
+    store_builder = VoxelStoreBuilder(voxel_grid, voxel_grid_hash, structure_count=len(pdb_codes) if hasattr(pdb_codes, '__len__') else 0)
+
+    voxelized = voxelize_and_write_structures(pdb_codes, voxel_grid, config, voxel_set_filepath, counts, errors, verbose=verbose, workers=workers, write_json=write_json)
+
+    used_voxel_set, position_voxel_set = aggregate_voxel_usage(add_to_voxel_store(voxelized, store_builder))
+
+    write_voxel_usage(used_voxel_set, position_voxel_set, voxel_set_filepath)
+
+    write_voxel_store(store_builder.build(), voxel_set_filepath)
+
+    counts['errors'] += len(errors)
+    counts['voxelized'] = len(used_voxel_set)
+    return counts
+
+
+def voxelize_and_write_structures(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, voxel_set_filepath:str, counts:Dict, errors:List, verbose:bool=True, workers:int=1, write_json:bool=True) -> Iterator[Tuple[str, Dict]]:
+    """
+    Chains the fetch, parse, voxelize and write stages for a set of structures (see run_voxel_pipeline).
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary.
+    """
+    voxel_grid_hash = os.path.basename(voxel_set_filepath)
+
+    fetched = fetch_structures(pdb_codes, config, counts=counts)
+    if workers > 1:
+        voxelized = voxelize_structures_in_parallel(fetched, voxel_grid, config, workers, errors=errors)
+    else:
+        voxelized = voxelize_structures_serially(fetched, voxel_grid, config, errors=errors)
+    if write_json:
+        voxelized = write_structure_voxels(voxelized, voxel_set_filepath, voxel_grid_hash, verbose=verbose)
+    return voxelized
+
+
+def load_voxel_usage(voxel_set_filepath:str) -> Tuple[Dict, Dict]:
+    """
+    Reads the voxel usage files written by write_voxel_usage.
+
+    Returns:
+        Dict: The used voxel labels for each PDB code.
+        Dict: The count and members of each voxel for each position, keyed by position (as a string).
+    """
+    with open(f"{voxel_set_filepath}/used_voxels.json", 'r') as filehandle:
+        used_voxel_set = json.load(filehandle)
+
+    with open(f"{voxel_set_filepath}/position_voxels.json", 'r') as filehandle:
+        position_voxel_set = json.load(filehandle)
+    return used_voxel_set, position_voxel_set
+
+
+def remove_voxel_usage(used_voxel_set:Dict, position_voxel_set:Dict, pdb_code:str, structure_voxels:Dict):
+    """
+    Removes a structure from the voxel usage in place, dropping voxels and positions which are left with no members.
+
+    Args:
+        used_voxel_set (Dict): The used voxel labels for each PDB code.
+        position_voxel_set (Dict): The count and members of each voxel for each position, keyed by position (as a string).
+        pdb_code (str): The PDB code of the structure.
+        structure_voxels (Dict): The structure_voxels dictionary of the structure, which gives the position of each of its voxels.
+    """
+    used_voxel_set.pop(pdb_code)
+    for position in structure_voxels:
+        voxel_label = structure_voxels[position]['voxel_label']
+        position_voxels = position_voxel_set[str(position)]
+        position_voxels[voxel_label]['members'].remove(pdb_code)
+        position_voxels[voxel_label]['count'] -= 1
+        if position_voxels[voxel_label]['count'] == 0:
+            del position_voxels[voxel_label]
+        if not position_voxels:
+            del position_voxel_set[str(position)]
+
+
+def add_voxel_usage(used_voxel_set:Dict, position_voxel_set:Dict, pdb_code:str, structure_voxels:Dict):
+    """
+    Adds a structure to the voxel usage in place, in the same way as aggregate_voxel_usage.
+    """
+    used_voxels = [structure_voxels[position]['voxel_label'] for position in structure_voxels]
+    used_voxel_set[pdb_code] = used_voxels
+
+    new_position = False
+    for position in structure_voxels:
+        voxel_label = structure_voxels[position]['voxel_label']
+        if str(position) not in position_voxel_set:
+            position_voxel_set[str(position)] = {}
+            new_position = True
+        if voxel_label not in position_voxel_set[str(position)]:
+            position_voxel_set[str(position)][voxel_label] = {'count':0,'members':[]}
+        position_voxel_set[str(position)][voxel_label]['members'].append(pdb_code)
+        position_voxel_set[str(position)][voxel_label]['count'] += 1
+
+    # a position which was empty until now is put back in peptide order
+    if new_position:
+        sorted_positions = sort_positions(position_voxel_set)
+        position_voxel_set.clear()
+        position_voxel_set.update(sorted_positions)
+
+
+def run_incremental_voxel_pipeline(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, config:Dict, voxel_set_filepath:str, verbose:bool=True, workers:int=1, write_json:bool=True) -> Dict:
+    """
+    Brings an existing voxel set up to date with a list of structures, voxelizing only the structures which are new and removing those which are no longer in the list.
+
+    The voxel usage is updated in place, so new members are appended to the member lists rather than following the order of the structure list. The voxel store is rewritten in the order of the structure list. If the voxel set has no store or usage files yet, the full pipeline is run instead.
+
+    Args:
+        pdb_codes (Iterable[str]): The PDB codes which should be in the voxel set.
+        voxel_grid (VoxelGrid): The voxel grid.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        voxel_set_filepath (str): The output directory for the voxel grid.
+        verbose (bool): Whether to print a line for each structure written.
+        workers (int): The number of processes used to parse and voxelize the new structures.
+        write_json (bool): Whether to write the per-structure JSON files for new structures (and delete those of removed structures).
+
+    Returns:
+        Dict: The number of structures downloaded, cached, in error, voxelized, added, removed and unchanged.
+    """
+    pdb_codes = list(pdb_codes)
+
+    if not (has_voxel_store(voxel_set_filepath) and os.path.exists(f"{voxel_set_filepath}/used_voxels.json") and os.path.exists(f"{voxel_set_filepath}/position_voxels.json")):
+        counts = run_voxel_pipeline(pdb_codes, voxel_grid, config, voxel_set_filepath, verbose=verbose, workers=workers, write_json=write_json)
+        counts.update({'added': counts['voxelized'], 'removed': 0, 'unchanged': 0})
+        return counts
+
+    voxel_grid_hash = os.path.basename(voxel_set_filepath)
+
+    # the store and the usage files say which structures have already been voxelized
+    voxel_store = load_voxel_store(voxel_set_filepath, mmap=False)
+    used_voxel_set, position_voxel_set = load_voxel_usage(voxel_set_filepath)
+    stored_structures = dict(store_structure_voxels(voxel_store, voxel_grid))
+
+    wanted_codes = set(pdb_codes)
+    removed_codes = [pdb_code for pdb_code in stored_structures if pdb_code not in wanted_codes]
+    added_codes = [pdb_code for pdb_code in pdb_codes if pdb_code not in stored_structures]
+
+    for pdb_code in removed_codes:
+        structure_voxels = stored_structures.pop(pdb_code)
+        if pdb_code in used_voxel_set:
+            remove_voxel_usage(used_voxel_set, position_voxel_set, pdb_code, structure_voxels)
+        if write_json and os.path.exists(f"{voxel_set_filepath}/{pdb_code}.json"):
+            os.remove(f"{voxel_set_filepath}/{pdb_code}.json")
+
+    counts = {'downloaded': 0, 'cached': 0, 'errors': 0, 'added': 0}
+    errors = []
+
+    for pdb_code, structure_voxels in voxelize_and_write_structures(added_codes, voxel_grid, config, voxel_set_filepath, counts, errors, verbose=verbose, workers=workers, write_json=write_json):
+        stored_structures[pdb_code] = structure_voxels
+        add_voxel_usage(used_voxel_set, position_voxel_set, pdb_code, structure_voxels)
+        counts['added'] += 1
+
+    write_voxel_usage(used_voxel_set, position_voxel_set, voxel_set_filepath)
+
+    ordered_structures = [(pdb_code, stored_structures[pdb_code]) for pdb_code in pdb_codes if pdb_code in stored_structures]
+    write_voxel_store(build_voxel_store(ordered_structures, voxel_grid, voxel_grid_hash), voxel_set_filepath)
+
+    counts['errors'] += len(errors)
+    counts['voxelized'] = len(used_voxel_set)
+    counts['removed'] = len(removed_codes)
+    counts['unchanged'] = len(pdb_codes) - len(added_codes)
+    return counts
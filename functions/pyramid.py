@@ -0,0 +1,145 @@
+from typing import List, Tuple
+
+import math
+
+import numpy as np
+
+from functions.voxels import VoxelGrid
+
+
+class VoxelPyramid:
+    """
+    A power-of-two hierarchy of voxel grids which share a start. 
+
+    Level 0 is the finest grid, and each level above it has voxels twice the size of the level below, so that the x, y and z indices of a voxel at any level are the indices at the finest level shifted right by the level number.
+    Coordinates only need to be assigned to voxels once, at the finest level.
+    """
+
+    def __init__(self, origin:List[float], fine_shape:List[int], finest_voxel_size:float, level_count:int):
+        """
+        Args:
+            origin (List[float]): The start (lowest x, y and z corner) of the grid.
+            fine_shape (List[int]): The number of voxels along the x, y and z axes at the finest level.
+            finest_voxel_size (float): The size of the voxels at the finest level.
+            level_count (int): The number of levels in the pyramid.
+        """
+        self.origin = [float(value) for value in origin]
+        self.level_count = level_count
+        self.grids = []
+        for level in range(level_count):
+            scale = 2 ** level
+            # coarser levels are rounded up so that they cover every voxel of the finest level
+            shape = [int(math.ceil(axis_length / scale)) for axis_length in fine_shape]
+            self.grids.append(VoxelGrid(self.origin, shape, finest_voxel_size * scale, params={'level': level}))
+
+
+    @property
+    def voxel_sizes(self) -> List[float]:
+        return [grid.voxel_size for grid in self.grids]
+
+
+    def grid(self, level:int) -> VoxelGrid:
+        return self.grids[level]
+
+
+    def find_voxel_xyz(self, coordinates:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the x, y and z indices of the voxels containing an array of coordinates at the finest level.
+
+        Returns:
+            np.ndarray: An integer array of the same shape as the coordinates containing the x, y and z indices at the finest level.
+            np.ndarray: A boolean array which is True where the coordinate is inside the grid.
+        """
+        return self.grids[0].find_voxel_xyz(coordinates)
+
+
+    def level_xyz(self, fine_xyz:np.ndarray, level:int) -> np.ndarray:
+        """
+        Converts x, y and z indices at the finest level into the indices at a coarser level.
+        """
+        return np.right_shift(np.asarray(fine_xyz, dtype=np.int64), level)
+
+
+    def level_indices(self, fine_xyz:np.ndarray, valid:np.ndarray, level:int) -> np.ndarray:
+        """
+        Converts x, y and z indices at the finest level into voxel indices in label order at a coarser level.
+
+        Returns:
+            np.ndarray: The index of each voxel at the given level, or -1 where the coordinate is outside the grid.
+        """
+        return self.grids[level].xyz_to_indices(self.level_xyz(fine_xyz, level), valid)
+
+
+    def all_level_indices(self, coordinates:np.ndarray) -> List[np.ndarray]:
+        """
+        Assigns an array of coordinates to voxels at every level of the pyramid with a single voxelization.
+
+        Args:
+            coordinates (np.ndarray): An array of coordinates whose last dimension is the x, y and z coordinate, e.g. (structures, positions, 3).
+
+        Returns:
+            List[np.ndarray]: The voxel indices in label order at each level, with -1 for coordinates outside the grid.
+        """
+        fine_xyz, valid = self.find_voxel_xyz(coordinates)
+        return [self.level_indices(fine_xyz, valid, level) for level in range(self.level_count)]
+
+
+    def roll_up(self, fine_volume:np.ndarray) -> List[np.ndarray]:
+        """
+        Sums a volume of counts at the finest level into each coarser level in turn.
+
+        Args:
+            fine_volume (np.ndarray): An array whose last three dimensions are the x, y and z axes of the finest grid, e.g. (positions, nx, ny, nz).
+
+        Returns:
+            List[np.ndarray]: The volume at each level, starting with the finest.
+        """
+        volumes = [np.asarray(fine_volume)]
+        for level in range(1, self.level_count):
+            volumes.append(roll_up_volume(volumes[-1]))
+        return volumes
+
+
+def roll_up_volume(volume:np.ndarray) -> np.ndarray:
+    """
+    Sums each block of 2 x 2 x 2 voxels of a volume into a single voxel. Axes with an odd length are zero padded first.
+
+    Args:
+        volume (np.ndarray): An array whose last three dimensions are the x, y and z axes of the grid.
+
+    Returns:
+        np.ndarray: The coarser volume, with each of the last three dimensions halved (rounding up).
+    """
+    volume = np.asarray(volume)
+    padding = [(0, 0)] * (volume.ndim - 3) + [(0, axis_length % 2) for axis_length in volume.shape[-3:]]
+    volume = np.pad(volume, padding)
+
+    nx, ny, nz = volume.shape[-3:]
+    blocks = volume.reshape(volume.shape[:-3] + (nx // 2, 2, ny // 2, 2, nz // 2, 2))
+    return blocks.sum(axis=(-5, -3, -1))
+
+
+def create_voxel_pyramid(centre_of_mass:List[float], box_xyz:List[float], finest_voxel_size:float=0.25, level_count:int=5, x_offset:int=0, y_offset:int=0, z_offset:int=0) -> VoxelPyramid:
+    """
+    This function creates a voxel pyramid covering the same box as create_voxel_grid, e.g. from 0.25Å to 4Å voxels with the default arguments.
+
+    Args:
+        centre_of_mass (List[float]): The centre of mass of the structure.
+        box_xyz (List[float]): The dimensions of the box.
+        finest_voxel_size (float): The size of the voxels at the finest level.
+        level_count (int): The number of levels in the pyramid.
+        x_offset (int): The x offset.
+        y_offset (int): The y offset.
+        z_offset (int): The z offset.
+
+    Returns:
+        VoxelPyramid: The voxel pyramid.
+    """
+    cx, cy, cz = centre_of_mass
+    length, width, height = box_xyz
+
+    origin = [cx - (length / 2) + x_offset, cy - (width / 2) + y_offset, cz - (height / 2) + z_offset]
+
+    fine_shape = [int(math.ceil(axis_length / finest_voxel_size)) for axis_length in box_xyz]
+
+    return VoxelPyramid(origin, fine_shape, finest_voxel_size, level_count)
@@ -0,0 +1,117 @@
+from typing import Dict, Tuple
+
+import json
+import os
+
+from functions.voxels import VoxelGrid, create_voxel_grid
+
+
+REGISTRY_FILENAME = 'output/voxel_sets/registry.json'
+
+
+def load_registry(registry_filename:str=REGISTRY_FILENAME) -> Dict:
+    """
+    Loads the registry of voxel grids, which maps grid digests to their descriptors and output directories.
+
+    Args:
+        registry_filename (str): The path of the registry file.
+
+    Returns:
+        Dict: The registry, keyed by grid digest. The registry is empty if the file does not exist.
+    """
+    if os.path.exists(registry_filename):
+        with open(registry_filename, 'r') as filehandle:
+            return json.load(filehandle)
+    return {}
+
+
+def register_voxel_grid(voxel_grid:VoxelGrid, voxel_set_filepath:str=None, registry_filename:str=REGISTRY_FILENAME) -> str:
+    """
+    Adds a voxel grid to the registry, if it is not already there, and returns the directory for its output.
+
+    Args:
+        voxel_grid (VoxelGrid): The voxel grid.
+        voxel_set_filepath (str): The directory for the grid's output. Defaults to output/voxel_sets/<digest> for new grids.
+        registry_filename (str): The path of the registry file.
+
+    Returns:
+        str: The directory for the grid's output.
+    """
+    registry = load_registry(registry_filename)
+    digest = voxel_grid.digest
+
+    if digest in registry and voxel_set_filepath is None:
+        return registry[digest]['voxel_set_filepath']
+
+    if voxel_set_filepath is None:
+        voxel_set_filepath = f"output/voxel_sets/{digest}"
+
+    registry[digest] = {
+        'descriptor': voxel_grid.descriptor,
+        'params': voxel_grid.params,
+        'voxel_set_filepath': voxel_set_filepath
+    }
+
+    registry_directory = os.path.dirname(registry_filename)
+    if registry_directory and not os.path.exists(registry_directory):
+        os.makedirs(registry_directory)
+
+    with open(registry_filename, 'w') as filehandle:
+        json.dump(registry, filehandle, indent=4)
+
+    return voxel_set_filepath
+
+
+def find_voxel_set_filepath(voxel_grid:VoxelGrid, registry_filename:str=REGISTRY_FILENAME) -> str:
+    """
+    Finds the output directory for a voxel grid from the registry, without adding it.
+
+    Returns:
+        str: The directory for the grid's output, or output/voxel_sets/<digest> if the grid is not registered.
+    """
+    registry = load_registry(registry_filename)
+    digest = voxel_grid.digest
+    if digest in registry:
+        return registry[digest]['voxel_set_filepath']
+    return f"output/voxel_sets/{digest}"
+
+
+def voxel_grid_from_config(config:Dict) -> VoxelGrid:
+    """
+    Creates the voxel grid described by the configuration file (centre_of_mass, box_xyz, voxel_size, range_offset and offsets).
+    """
+    offsets = config.get('offsets', {})
+    return create_voxel_grid(config['centre_of_mass'], config['box_xyz'], config['voxel_size'], range_offset=config.get('range_offset', 0), x_offset=offsets.get('x', 0), y_offset=offsets.get('y', 0), z_offset=offsets.get('z', 0))
+
+
+def voxel_grid_from_descriptor(descriptor:Dict, params:Dict=None) -> VoxelGrid:
+    """
+    Rebuilds a voxel grid from its descriptor (as stored in the registry), so that it has the same digest as the grid it describes.
+
+    Args:
+        descriptor (Dict): The grid descriptor (as returned by VoxelGrid.descriptor).
+        params (Dict): The parameters used to create the grid, if known. The offsets are always taken from the descriptor.
+
+    Returns:
+        VoxelGrid: The voxel grid.
+    """
+    params = dict(params) if params is not None else {}
+    for axis, offset in descriptor['offsets'].items():
+        params[f"{axis}_offset"] = offset
+    return VoxelGrid(descriptor['origin'], descriptor['shape'], descriptor['voxel_size'], params=params)
+
+
+def resolve_voxel_set(config:Dict, registry_filename:str=REGISTRY_FILENAME) -> Tuple[str, str]:
+    """
+    Finds the output directory for the voxel grid described by the configuration file.
+
+    Args:
+        config (Dict): The configuration dictionary.
+        registry_filename (str): The path of the registry file.
+
+    Returns:
+        str: The directory for the grid's output, e.g. output/voxel_sets/e91d9bdc62da8457549cfbeed4c2b0aa
+        str: The name of that directory, which is used as the identifier of the voxel set in other output paths.
+    """
+    voxel_set_filepath = find_voxel_set_filepath(voxel_grid_from_config(config), registry_filename=registry_filename)
+    return voxel_set_filepath, os.path.basename(voxel_set_filepath)
@@ -0,0 +1,193 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+### The RMSD used for clusters follows calculate_max_rmsd in functions/structures.py: for each position, the root mean square of the x, y and z differences between the alpha carbons of two structures ###
+
+### With superpose, the structures of each pair are first aligned by the Kabsch algorithm, so that small shifts in the placement of a peptide are not counted as differences in its shape ###
+
+def superpose_pairs(mobile:np.ndarray, reference:np.ndarray) -> np.ndarray:
+    """
+    Superposes each of a stack of mobile peptides onto its reference peptide by the Kabsch algorithm, with one batched SVD of the stacked covariance matrices.
+
+    Only the positions present in both peptides of a pair are used for its alignment.
+
+    Args:
+        mobile (np.ndarray): A (pairs, positions, 3) array of the coordinates to move, NaN where a position is missing.
+        reference (np.ndarray): A (pairs, positions, 3) array of the coordinates to align to, NaN where a position is missing.
+
+    Returns:
+        np.ndarray: The (pairs, positions, 3) superposed mobile coordinates, NaN where a position is missing from either peptide.
+    """
+    present = ~(np.isnan(mobile).any(axis=-1) | np.isnan(reference).any(axis=-1))[..., np.newaxis]
+    position_counts = np.maximum(present.sum(axis=1, keepdims=True), 1)
+
+    # both peptides of each pair are centred on the centroid of their shared positions
+    mobile_centroids = np.where(present, mobile, 0).sum(axis=1, keepdims=True) / position_counts
+    reference_centroids = np.where(present, reference, 0).sum(axis=1, keepdims=True) / position_counts
+    centred_mobile = np.where(present, mobile - mobile_centroids, 0)
+    centred_reference = np.where(present, reference - reference_centroids, 0)
+
+    covariances = np.einsum('npi,npj->nij', centred_mobile, centred_reference)
+    u, _, vt = np.linalg.svd(covariances)
+
+    # the last axis is flipped where needed so that each rotation is proper rather than a reflection
+    signs = np.sign(np.linalg.det(u @ vt))
+    signs[signs == 0] = 1
+    vt[:, -1, :] *= signs[:, np.newaxis]
+    rotations = u @ vt
+
+    superposed = centred_mobile @ rotations + reference_centroids
+    return np.where(present, superposed, np.nan)
+
+
+def position_deviations(coordinates:np.ndarray, reference_rows:np.ndarray, target_rows:np.ndarray, superpose:bool=False) -> np.ndarray:
+    """
+    Calculates the per-position RMSD between pairs of structures, as calculate_max_rmsd does before taking the maximum.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of alpha carbon coordinates, NaN where a position is missing.
+        reference_rows (np.ndarray): The row of the reference structure of each pair.
+        target_rows (np.ndarray): The row of the target structure of each pair.
+        superpose (bool): Whether to superpose each target onto its reference first.
+
+    Returns:
+        np.ndarray: A (pairs, positions) array of deviations, NaN where either position is missing.
+    """
+    targets = coordinates[np.asarray(target_rows)]
+    references = coordinates[np.asarray(reference_rows)]
+    if superpose:
+        targets = superpose_pairs(targets, references)
+    return np.sqrt(np.mean((targets - references) ** 2, axis=-1))
+
+
+def overall_deviations(deviations:np.ndarray) -> np.ndarray:
+    """
+    Combines per-position deviations into the deviation over the whole peptide, the root mean square over the positions present in both structures.
+
+    Args:
+        deviations (np.ndarray): A (pairs, positions) array of deviations (as returned by position_deviations).
+
+    Returns:
+        np.ndarray: A (pairs,) array of deviations, NaN for pairs with no positions in common.
+    """
+    present = ~np.isnan(deviations)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(np.where(present, deviations ** 2, 0).sum(axis=-1) / present.sum(axis=-1))
+
+
+def cluster_references(cluster_labels:np.ndarray) -> Dict:
+    """
+    Finds the reference structure of every cluster, which is its first member, as in calculate_max_rmsd_for_cluster.
+
+    Args:
+        cluster_labels (np.ndarray): The cluster label of each structure, e.g. HDBSCAN labels_ with -1 for noise. The noise is treated as one more cluster.
+
+    Returns:
+        Dict: A dictionary containing the sorted unique labels, the group number of each structure (its index into labels), the reference_rows of each group and the member counts of each group.
+    """
+    cluster_labels = np.asarray(cluster_labels)
+    labels, first_rows, groups, counts = np.unique(cluster_labels, return_index=True, return_inverse=True, return_counts=True)
+    return {
+        'labels': labels,
+        'groups': groups.reshape(-1),
+        'reference_rows': first_rows,
+        'counts': counts
+    }
+
+
+def cluster_position_deviations(coordinates:np.ndarray, cluster_labels:np.ndarray, superpose:bool=False) -> Dict:
+    """
+    Calculates, in one pass for all clusters, the largest deviation at each position between the first member of each cluster and any other member.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of alpha carbon coordinates, NaN where a position is missing.
+        cluster_labels (np.ndarray): The cluster label of each structure. The noise (-1) is treated as one more cluster.
+        superpose (bool): Whether to superpose each member onto the first member of its cluster first.
+
+    Returns:
+        Dict: A dictionary containing the unique cluster labels, the member counts, the (clusters, positions) max_position_deviations and the (clusters,) max_overall_deviations over the whole peptide, which are NaN for clusters with fewer than two members.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    references = cluster_references(cluster_labels)
+    groups = references['groups']
+    structure_count, peptide_length = coordinates.shape[:2]
+
+    # each structure is compared with the reference of its own cluster, the references themselves are left out
+    targets = np.setdiff1d(np.arange(structure_count), references['reference_rows'])
+    deviations = position_deviations(coordinates, references['reference_rows'][groups[targets]], targets, superpose=superpose)
+
+    max_position_deviations = np.full((len(references['labels']), peptide_length), -np.inf)
+    max_overall_deviations = np.full(len(references['labels']), -np.inf)
+    # missing positions are skipped, as NaN does not compare as larger than anything
+    np.fmax.at(max_position_deviations, groups[targets], deviations)
+    np.fmax.at(max_overall_deviations, groups[targets], overall_deviations(deviations))
+    max_position_deviations[np.isneginf(max_position_deviations)] = np.nan
+    max_overall_deviations[np.isneginf(max_overall_deviations)] = np.nan
+
+    return {
+        'labels': references['labels'],
+        'counts': references['counts'],
+        'max_position_deviations': max_position_deviations,
+        'max_overall_deviations': max_overall_deviations
+    }
+
+
+def cluster_max_rmsds(coordinates:np.ndarray, cluster_labels:np.ndarray, superpose:bool=False) -> Tuple[Dict, Dict]:
+    """
+    Calculates the maximum RMSD of every cluster, as calculate_max_rmsd_for_cluster does for one cluster, and the maximum overall RMSD over the whole peptide, in a single pass.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of alpha carbon coordinates, NaN where a position is missing.
+        cluster_labels (np.ndarray): The cluster label of each structure. The noise (-1) is treated as one more cluster.
+        superpose (bool): Whether to superpose each member onto the first member of its cluster first.
+
+    Returns:
+        Dict: The maximum RMSD at any position keyed by cluster label, or None for clusters with fewer than two members.
+        Dict: The maximum overall RMSD keyed by cluster label, or None for clusters with fewer than two members.
+    """
+    deviations = cluster_position_deviations(coordinates, cluster_labels, superpose=superpose)
+    max_position_deviations = deviations['max_position_deviations']
+    max_overall_deviations = deviations['max_overall_deviations']
+
+    max_rmsds = {}
+    max_overall_rmsds = {}
+    for group, label in enumerate(deviations['labels'].tolist()):
+        if np.isnan(max_position_deviations[group]).all():
+            max_rmsds[label] = None
+            max_overall_rmsds[label] = None
+        else:
+            max_rmsds[label] = float(np.nanmax(max_position_deviations[group]))
+            max_overall_rmsds[label] = float(max_overall_deviations[group])
+    return max_rmsds, max_overall_rmsds
+
+
+def cluster_max_rmsd(coordinates:np.ndarray, member_rows:List[int], superpose:bool=False) -> float:
+    """
+    Calculates the maximum RMSD of a single cluster from the rows of its members, the first of which is the reference, optionally after superposing each member onto it.
+
+    Returns:
+        float: The largest RMSD at any position between the first member and any other member, or None if the cluster has fewer than two members.
+    """
+    if len(member_rows) < 2:
+        return None
+    deviations = position_deviations(np.asarray(coordinates, dtype=float), [member_rows[0]] * (len(member_rows) - 1), member_rows[1:], superpose=superpose)
+    return float(np.nanmax(deviations))
+
+
+def max_rmsds_for_clusters(clusters:Dict[str, List[str]], pdb_codes:List[str], coordinates:np.ndarray, superpose:bool=False) -> Dict:
+    """
+    Calculates the maximum RMSD of each of a dictionary of clusters of PDB codes (e.g. the clusters of a clustering record), against a stacked coordinate tensor such as the coordinates of a voxel store.
+
+    Args:
+        clusters (Dict[str, List[str]]): The members of each cluster, keyed by cluster name.
+        pdb_codes (List[str]): The PDB code of each row of coordinates.
+        coordinates (np.ndarray): A (structures, positions, 3) array of alpha carbon coordinates.
+        superpose (bool): Whether to superpose each member onto the first member of its cluster first.
+
+    Returns:
+        Dict: The maximum RMSD keyed by cluster name, or None for clusters with fewer than two members.
+    """
+    row_lookup = {pdb_code: row for row, pdb_code in enumerate(pdb_codes)}
+    return {cluster_name: cluster_max_rmsd(coordinates, [row_lookup[member] for member in members], superpose=superpose) for cluster_name, members in clusters.items()}
@@ -0,0 +1,212 @@
+from typing import Dict, List, Tuple
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from functions.voxel_store import STORE_ARRAYS, STORE_DIRECTORY_NAME, load_voxel_store
+
+
+# the shared memory blocks attached in this process, kept open for as long as the process uses their arrays
+_attached_blocks = {}
+
+
+def attach_shared_array(spec:Dict) -> np.ndarray:
+    """
+    Returns a NumPy array over a shared array without copying it, from its spec (as held by a SharedDataset handle).
+
+    Arrays in shared memory are attached by name; arrays in a .npy file are memory-mapped read only.
+
+    Args:
+        spec (Dict): The spec of the array, containing the kind ('shared_memory' or 'memmap'), the name or filename, the shape and the dtype.
+
+    Returns:
+        np.ndarray: The array.
+    """
+    if spec['kind'] == 'memmap':
+        return np.load(spec['filename'], mmap_mode='r', allow_pickle=False)
+
+    block = _attached_blocks.get(spec['name'])
+    if block is None:
+        # worker processes share the resource tracker of the process which created the block, so attaching does not change when the block is released
+        block = shared_memory.SharedMemory(name=spec['name'])
+        _attached_blocks[spec['name']] = block
+    return np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=block.buf)
+
+
+def attach_shared_dataset(handle:Dict) -> Dict:
+    """
+    Attaches every array of a dataset handle (as returned by SharedDataset.handle) in a worker process.
+
+    Returns:
+        Dict: The arrays, keyed by name, and the metadata.
+    """
+    dataset = {name: attach_shared_array(spec) for name, spec in handle['arrays'].items()}
+    dataset['metadata'] = handle['metadata']
+    return dataset
+
+
+def detach_shared_dataset(handle:Dict):
+    """
+    Closes the shared memory blocks of a dataset handle attached in this process. Arrays attached from the handle must not be used afterwards.
+    """
+    for spec in handle['arrays'].values():
+        block = _attached_blocks.pop(spec.get('name'), None)
+        if block is not None:
+            try:
+                block.close()
+            except BufferError:
+                # arrays over the block still exist in this process, the memory is freed when they are
+                pass
+
+
+class SharedDataset:
+    """
+    Places the arrays of a dataset (e.g. a voxel store) in shared memory once, so that worker processes can use them without the arrays being pickled or copied.
+
+    Workers are passed the small, picklable dictionary returned by handle() and call attach_shared_dataset on it. The creating process owns the memory and releases it with close(), or by using the dataset as a context manager.
+
+        with SharedDataset.from_arrays(load_voxel_store(voxel_set_filepath)) as dataset:
+            with ProcessPoolExecutor() as executor:
+                results = executor.map(work, repeat(dataset.handle()), chunks)
+    """
+    def __init__(self):
+        self.blocks = {}
+        self.specs = {}
+        self.metadata = {}
+
+
+    @classmethod
+    def from_arrays(cls, arrays:Dict, names:List[str]=None, metadata:Dict=None):
+        """
+        Copies arrays into new shared memory blocks.
+
+        Args:
+            arrays (Dict): The arrays, keyed by name. A 'metadata' entry is passed through to the handle rather than shared.
+            names (List[str]): If given, only these arrays are shared.
+            metadata (Dict): Metadata to pass to the workers, by default the 'metadata' entry of arrays.
+
+        Returns:
+            SharedDataset: The dataset.
+        """
+        dataset = cls()
+        dataset.metadata = metadata if metadata is not None else arrays.get('metadata', {})
+        for name, values in arrays.items():
+            if name == 'metadata' or (names is not None and name not in names):
+                continue
+            values = np.asarray(values)
+            # a shared memory block cannot be empty
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            shared_values = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+            shared_values[...] = values
+            dataset.blocks[name] = block
+            dataset.specs[name] = {'kind': 'shared_memory', 'name': block.name, 'shape': list(values.shape), 'dtype': values.dtype.str}
+        return dataset
+
+
+    @classmethod
+    def allocate(cls, shapes:Dict[str, Tuple], dtypes:Dict[str, str], metadata:Dict=None):
+        """
+        Creates new, zeroed shared memory blocks for arrays which are to be filled in place (through arrays()), so that large arrays are never held twice.
+
+        Args:
+            shapes (Dict[str, Tuple]): The shape of each array, keyed by name.
+            dtypes (Dict[str, str]): The dtype of each array, keyed by name.
+            metadata (Dict): Metadata to pass to the workers.
+
+        Returns:
+            SharedDataset: The dataset.
+        """
+        dataset = cls()
+        dataset.metadata = metadata if metadata is not None else {}
+        for name, shape in shapes.items():
+            dtype = np.dtype(dtypes[name])
+            # a shared memory block cannot be empty
+            block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+            dataset.blocks[name] = block
+            dataset.specs[name] = {'kind': 'shared_memory', 'name': block.name, 'shape': list(shape), 'dtype': dtype.str}
+        return dataset
+
+
+    @classmethod
+    def from_npy_files(cls, filenames:Dict[str, str], metadata:Dict=None):
+        """
+        Shares arrays which are already in .npy files (e.g. the files of a voxel store) by memory-mapping them, which needs no extra memory at all. The operating system shares the file pages between the processes.
+
+        Args:
+            filenames (Dict[str, str]): The .npy filename of each array, keyed by name.
+            metadata (Dict): Metadata to pass to the workers.
+
+        Returns:
+            SharedDataset: The dataset.
+        """
+        dataset = cls()
+        dataset.metadata = metadata if metadata is not None else {}
+        for name, filename in filenames.items():
+            values = np.load(filename, mmap_mode='r', allow_pickle=False)
+            dataset.specs[name] = {'kind': 'memmap', 'filename': filename, 'shape': list(values.shape), 'dtype': values.dtype.str}
+        return dataset
+
+
+    def handle(self) -> Dict:
+        """
+        Returns:
+            Dict: The picklable handle which workers pass to attach_shared_dataset.
+        """
+        return {'arrays': self.specs, 'metadata': self.metadata}
+
+
+    def arrays(self) -> Dict:
+        """
+        Returns:
+            Dict: The shared arrays in the creating process, keyed by name.
+        """
+        dataset = {}
+        for name, spec in self.specs.items():
+            if name in self.blocks:
+                dataset[name] = np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=self.blocks[name].buf)
+            else:
+                dataset[name] = attach_shared_array(spec)
+        dataset['metadata'] = self.metadata
+        return dataset
+
+
+    def close(self):
+        """
+        Releases the shared memory blocks. Arrays attached to them must not be used afterwards.
+        """
+        for block in self.blocks.values():
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                # arrays over the block still exist in this process, the memory is freed when they are
+                pass
+        self.blocks = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def share_voxel_store(voxel_set_filepath:str, use_shared_memory:bool=True) -> SharedDataset:
+    """
+    Shares the voxel store of a voxel set with worker processes.
+
+    Args:
+        voxel_set_filepath (str): The voxel set directory for the grid.
+        use_shared_memory (bool): Whether to copy the arrays into shared memory once, or to have every worker memory-map the store files.
+
+    Returns:
+        SharedDataset: The dataset, whose handle gives the pdb_codes, voxel_indices, coordinates and residues arrays and the store metadata.
+    """
+    if use_shared_memory:
+        return SharedDataset.from_arrays(load_voxel_store(voxel_set_filepath, mmap=True))
+
+    voxel_store = load_voxel_store(voxel_set_filepath, mmap=True)
+    filenames = {name: f"{voxel_set_filepath}/{STORE_DIRECTORY_NAME}/{name}.npy" for name in STORE_ARRAYS}
+    return SharedDataset.from_npy_files(filenames, metadata=voxel_store['metadata'])
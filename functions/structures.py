@@ -3,9 +3,13 @@ from typing import Dict, List, Union
 import requests
 import os
 
-from pymol import cmd
 import numpy as np
 
+try:
+    from pymol import cmd
+except ImportError:
+    print ("pymol not installed")
+
 try:
     from sklearn.metrics import mean_squared_error
 except ImportError:
@@ -18,7 +22,11 @@ except ImportError:
 
 
 
+from functions.downloads import write_file_atomically
 from functions.helpers import deslugify_allele
+from functions.atom_cache import load_cached_pdb_atoms
+from functions.pdb import read_pdb_atoms, first_atom_per_residue
+from functions.voxels import VoxelGrid
 
 
 def fetch_structure_info(sql_query:str, excluded_structures:List, only_highest_resolution:bool=False) -> Dict:
@@ -114,6 +122,7 @@ def download_structure(pdb_code:str, config:Dict, verbose=False) -> Union[str, b
 
     # lowercase the pdb code for both the filename and the URL
     pdb_code = pdb_code.lower()
+    structure_data = None
     downloaded = False
     cached = False
     error = None
@@ -139,8 +148,7 @@ def download_structure(pdb_code:str, config:Dict, verbose=False) -> Union[str, b
         if r.status_code == 200:
             structure_data = r.text
 
-            with open(filename, 'w') as filehandle:
-                filehandle.write(structure_data)
+            write_file_atomically(filename, structure_data)
             downloaded = True
         else:
             error = f"PDB code {pdb_code} has failed with status {r.status_code}"
@@ -175,8 +183,7 @@ def load_pdb_file_to_dataframe(pdb_code:str, domain:str, config:Dict) -> Dict:
         if r.status_code == 200:
             structure_data = r.text
 
-            with open(filename, 'w') as filehandle:
-                filehandle.write(structure_data)
+            write_file_atomically(filename, structure_data)
 
             structure_df = PandasPdb().read_pdb(filename)
         # if the request fails, set structure_df None and print an error message
@@ -191,6 +198,103 @@ def load_pdb_file_to_dataframe(pdb_code:str, domain:str, config:Dict) -> Dict:
         return None
 
 
+def load_peptide_atoms(pdb_code:str, config:Dict, atom_names:List[str]=None, domain:str='peptide', use_cache:bool=True) -> Dict:
+    """
+    Loads the atoms of a structure file into NumPy arrays with the fixed column reader, downloading the file first if needed. Unlike load_pdb_file_to_dataframe this does not need biopandas.
+
+    Args:
+        pdb_code (str): The PDB code of the structure to be loaded, e.g. '1hhk'.
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        atom_names (List[str]): If given, only atoms with these names (e.g. ['CA']) are read.
+        domain (str): The domain of the structure to be loaded, e.g. 'peptide'.
+        use_cache (bool): Whether to use the binary cache of parsed atoms in structures/cache, which is refreshed automatically when the file changes.
+
+    Returns:
+        Dict: The atom arrays (as returned by read_pdb_atoms), or None if the structure could not be downloaded.
+    """
+    pdb_code = pdb_code.lower()
+    filename = f"structures/{pdb_code}_{domain}.pdb"
+
+    if not os.path.exists(filename):
+        structure_data, downloaded, cached, error = download_structure(pdb_code, config)
+        if error:
+            print (error)
+            return None
+
+    if use_cache:
+        return load_cached_pdb_atoms(filename, atom_names=atom_names)
+    return read_pdb_atoms(filename, atom_names=atom_names)
+
+
+def stack_peptide_coordinates(structure_info:Dict, config:Dict, atom_name:str='CA', peptide_length:int=None) -> Dict:
+    """
+    Loads the peptide of every structure in structure_info and stacks the atom coordinates into a single array.
+
+    Args:
+        structure_info (Dict): The structure information dictionary (as returned by fetch_structure_info).
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        atom_name (str): The name of the atom to use for each residue, e.g. 'CA'.
+        peptide_length (int): The number of positions in the array. Defaults to the length of the longest peptide.
+
+    Returns:
+        Dict: A dictionary containing the pdb_codes which loaded, a (structures, positions, 3) float array of coordinates (NaN for missing residues), the residue names for each structure, and the pdb_codes which failed to load.
+    """
+    pdb_codes = []
+    all_coordinates = []
+    residues = []
+    errors = []
+
+    for pdb_code in structure_info['structures']:
+        atoms = load_peptide_atoms(pdb_code, config, atom_names=[atom_name])
+        if atoms is not None:
+            coordinates, sequence = first_atom_per_residue(atoms, atom_name=atom_name)
+            pdb_codes.append(pdb_code)
+            all_coordinates.append(coordinates)
+            residues.append(sequence)
+        else:
+            errors.append(pdb_code)
+
+    if peptide_length is None:
+        peptide_length = max([len(coordinates) for coordinates in all_coordinates], default=0)
+
+    # pad shorter peptides with NaN so that every structure has the same number of positions
+    stacked_coordinates = np.full((len(pdb_codes), peptide_length, 3), np.nan)
+    for i, coordinates in enumerate(all_coordinates):
+        coordinates = coordinates[:peptide_length]
+        if coordinates:
+            stacked_coordinates[i, :len(coordinates)] = coordinates
+
+    return {
+        'pdb_codes': pdb_codes,
+        'coordinates': stacked_coordinates,
+        'residues': residues,
+        'errors': errors
+    }
+
+
+def voxelize_structure_set(structure_info:Dict, voxel_grid:VoxelGrid, config:Dict, atom_name:str='CA', peptide_length:int=None) -> Dict:
+    """
+    Voxelizes every structure in structure_info in one vectorized step.
+
+    Args:
+        structure_info (Dict): The structure information dictionary (as returned by fetch_structure_info).
+        voxel_grid (VoxelGrid): The voxel grid (as returned by create_voxel_grid).
+        config (Dict): The configuration dictionary which contains the base_url for the Histo website.
+        atom_name (str): The name of the atom to use for each residue, e.g. 'CA'.
+        peptide_length (int): The number of positions. Defaults to the length of the longest peptide.
+
+    Returns:
+        Dict: The dictionary from stack_peptide_coordinates, with the addition of a (structures, positions) integer array of voxel_indices (in label order, -1 if outside the grid) and a boolean valid mask of the same shape.
+    """
+    structure_set = stack_peptide_coordinates(structure_info, config, atom_name=atom_name, peptide_length=peptide_length)
+
+    voxel_indices, valid = voxel_grid.find_voxel_indices(structure_set['coordinates'])
+
+    structure_set['voxel_indices'] = voxel_indices
+    structure_set['valid'] = valid
+    return structure_set
+
+
 def load_pdb_file_to_pymol(pdb_code, structure_info, name = None, cluster_number = None):
     if cluster_number:
         cluster_number = ''
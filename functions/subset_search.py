@@ -0,0 +1,262 @@
+from typing import Callable, Dict, List, Tuple
+
+import hashlib
+import itertools
+import json
+import os
+
+from functions.clustering import ClusteringSweep, clustering_sweep_filepath, write_clustering_records
+
+
+# the search writes its records to a directory of its own, so records made by the notebook or by sweeps are never mistaken for its checkpoints
+SEARCH_DIRECTORY_NAME = 'subset_search'
+
+
+def noise_rmsd_score(record:Dict) -> float:
+    """
+    The score used in the notebook: the size of the noise cluster multiplied by the average of the maximum RMSDs of the clusters. Lower is better.
+
+    A subset with no cluster of two or more members has no maximum RMSD, and scores worst rather than best.
+    """
+    if record['max_rmsd'] is None:
+        return float('inf')
+    return round(record['noise_cluster_size'] * record['max_rmsd'], 2)
+
+
+def noise_score(record:Dict) -> float:
+    """
+    The size of the noise cluster. Lower is better.
+    """
+    return record['noise_cluster_size']
+
+
+def max_rmsd_score(record:Dict) -> float:
+    """
+    The average of the maximum RMSDs of the clusters. Lower is better.
+    """
+    return record['max_rmsd'] if record['max_rmsd'] is not None else float('inf')
+
+
+# the scoring functions which can be chosen by name, each takes a clustering record and returns a score where lower is better
+SCORING_FUNCTIONS = {
+    'noise_rmsd': noise_rmsd_score,
+    'noise': noise_score,
+    'max_rmsd': max_rmsd_score
+}
+
+
+def position_subsets(peptide_length:int=9, min_size:int=1, max_size:int=None) -> List[Tuple[int, ...]]:
+    """
+    Lists the subsets of the peptide positions (starting at 1), smallest first. With the defaults this is all 511 non-empty subsets of nine positions.
+
+    Returns:
+        List[Tuple[int, ...]]: The position subsets.
+    """
+    if max_size is None:
+        max_size = peptide_length
+    subsets = []
+    for size in range(min_size, max_size + 1):
+        subsets += list(itertools.combinations(range(1, peptide_length + 1), size))
+    return subsets
+
+
+def positions_key(positions:Tuple[int, ...]) -> str:
+    """
+    Returns:
+        str: The key for a position set used in the clustering record filenames, e.g. '4_5_6'
+    """
+    return '_'.join([str(position) for position in positions])
+
+
+def is_pruned(positions:Tuple[int, ...], records:Dict, pruned:set, max_noise_fraction:float, structure_count:int) -> bool:
+    """
+    Decides whether to skip a position set because one of the sets with one position fewer was skipped, or left more than max_noise_fraction of the structures as noise.
+
+    Adding a position can only increase the distances between structures, so supersets of a set which is mostly noise rarely cluster better. This is a heuristic, and is only applied if max_noise_fraction is given.
+    """
+    if max_noise_fraction is None or len(positions) == 1:
+        return False
+    for subset in itertools.combinations(positions, len(positions) - 1):
+        key = positions_key(subset)
+        if key in pruned:
+            return True
+        if key in records and records[key]['noise_cluster_size'] > max_noise_fraction * structure_count:
+            return True
+    return False
+
+
+def is_dominated_by_subsets(positions:Tuple[int, ...], records:Dict, pruned:set, dominated:set) -> bool:
+    """
+    Decides whether to skip a position set because every set with one position fewer was dominated by a set already scored (see dominated_keys), or was itself skipped.
+
+    Like is_pruned this is a heuristic: a superset of dominated sets can still turn out better, so it is only applied if prune_dominated is given to search_position_subsets.
+    """
+    if len(positions) == 1:
+        return False
+    # only the subsets which were searched count, e.g. not those smaller than the smallest size searched
+    subset_keys = [positions_key(subset) for subset in itertools.combinations(positions, len(positions) - 1)]
+    searched_keys = [key for key in subset_keys if key in records or key in pruned]
+    return len(searched_keys) > 0 and all(key in pruned or key in dominated for key in searched_keys)
+
+
+def rmsd_for_ranking(max_rmsd:float) -> float:
+    """
+    Returns:
+        float: The average maximum RMSD of a record, with a missing RMSD counted as the worst.
+    """
+    return max_rmsd if max_rmsd is not None else float('inf')
+
+
+def dominated_keys(rows:List[Dict]) -> set:
+    """
+    Finds the position sets which are dominated: another set has no larger a noise cluster and no larger an average maximum RMSD, and is better in at least one. A set with no maximum RMSD counts as having the largest.
+
+    Returns:
+        set: The keys of the dominated position sets.
+    """
+    dominated = set()
+    for row in rows:
+        for other in rows:
+            if other is row:
+                continue
+            row_rmsd = rmsd_for_ranking(row['max_rmsd'])
+            other_rmsd = rmsd_for_ranking(other['max_rmsd'])
+            if other['noise_cluster_size'] <= row['noise_cluster_size'] and other_rmsd <= row_rmsd and (other['noise_cluster_size'] < row['noise_cluster_size'] or other_rmsd < row_rmsd):
+                dominated.add(row['positions'])
+                break
+    return dominated
+
+
+def subset_search_filepath(voxel_grid_hash:str, min_cluster_size:int, superpose:bool=False) -> str:
+    """
+    Returns:
+        str: The directory the search records and ranked tables are written to, e.g. output/clusters/<hash>/cluster_size_3/subset_search
+    """
+    return f"{clustering_sweep_filepath(voxel_grid_hash, min_cluster_size, superpose=superpose)}/{SEARCH_DIRECTORY_NAME}"
+
+
+def search_settings(structure_labels:List[str], min_cluster_size:int, use_distance_cache:bool, superpose:bool) -> Dict:
+    """
+    Describes how the records of a search are made, including a fingerprint of the structures clustered. Only records with the same settings are resumed.
+
+    Returns:
+        Dict: The method, min_cluster_size, superpose, structure_count and structure_set_hash (the SHA-256 of the PDB codes in order).
+    """
+    return {
+        'method': 'distance_cache' if use_distance_cache else 'features',
+        'min_cluster_size': min_cluster_size,
+        'superpose': superpose,
+        'structure_count': len(structure_labels),
+        'structure_set_hash': hashlib.sha256('\n'.join(structure_labels).encode()).hexdigest()
+    }
+
+
+def load_checkpointed_record(search_path:str, positions:Tuple[int, ...], settings:Dict) -> Dict:
+    """
+    Returns:
+        Dict: The clustering record already written for a position set with the same search settings, or None if there is none.
+    """
+    filename = f"{search_path}/clustering_{positions_key(positions)}.json"
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as filehandle:
+        record = json.load(filehandle)
+    # records made with another method, cluster size or set of structures are clustered again
+    if record.get('search_settings') != settings:
+        return None
+    return record
+
+
+def search_position_subsets(voxel_set_filepath:str, peptide_length:int=9, min_size:int=1, max_size:int=None, min_cluster_size:int=3, score:Callable=noise_rmsd_score, max_noise_fraction:float=None, prune_dominated:bool=False, workers:int=1, use_distance_cache:bool=False, superpose:bool=False, resume:bool=True, verbose:bool=False) -> List[Dict]:
+    """
+    Clusters the structures of a voxel set on every subset of the peptide positions, or every subset within a range of sizes, and ranks the subsets by a score.
+
+    Subsets are evaluated one size at a time, so that supersets of poor subsets can be pruned (see is_pruned and is_dominated_by_subsets). Both kinds of pruning are heuristics and are off by default, in which case every subset is evaluated and dominance is only flagged in the ranked table.
+
+    The voxel store, the distance cache (if used) and the worker processes are set up once for the whole search. Each clustering record is written to output/clusters/<hash>/cluster_size_<n>/subset_search/ as soon as it is made, with the search settings (see search_settings). With resume, the records there with the same settings are reused, so an interrupted search carries on where it stopped.
+
+    Args:
+        voxel_set_filepath (str): The voxel set directory for the grid, which must have a voxel store.
+        peptide_length (int): The number of peptide positions.
+        min_size (int): The smallest number of positions in a subset.
+        max_size (int): The largest number of positions in a subset, by default all of them.
+        min_cluster_size (int): The minimum cluster size for HDBSCAN.
+        score (Callable): The scoring function, which takes a clustering record and returns a score where lower is better (see SCORING_FUNCTIONS).
+        max_noise_fraction (float): If given, supersets of subsets which leave more than this fraction of the structures as noise are not evaluated.
+        prune_dominated (bool): Whether to skip supersets all of whose subsets with one position fewer are dominated by a subset already scored.
+        workers (int): The number of worker processes.
+        use_distance_cache (bool): Whether to cluster on distances summed from the per-position distance cache, which gives different clusters from the features used by the sweeps and the notebook (see run_clustering_sweep).
+        superpose (bool): Whether to calculate the maximum RMSDs after superposing each member of a cluster onto its first member (see run_clustering_sweep).
+        resume (bool): Whether to reuse the clustering records already written with the same settings.
+        verbose (bool): Whether to print a summary of each subset as it is clustered.
+
+    Returns:
+        List[Dict]: The ranked table, one row per evaluated subset with the rank, positions, score, cluster_count, noise_cluster_size, max_rmsd and whether the subset is dominated, best first. Subsets which could not be scored come last, with a score of None.
+    """
+    voxel_grid_hash = os.path.basename(voxel_set_filepath)
+    search_path = subset_search_filepath(voxel_grid_hash, min_cluster_size, superpose=superpose)
+    if not os.path.exists(search_path):
+        os.makedirs(search_path)
+
+    if max_size is None:
+        max_size = peptide_length
+
+    records = {}
+    pruned = set()
+
+    with ClusteringSweep(voxel_set_filepath, workers=workers, use_distance_cache=use_distance_cache) as sweep:
+        settings = search_settings(sweep.structure_labels, min_cluster_size, use_distance_cache, superpose)
+        structure_count = settings['structure_count']
+
+        for size in range(min_size, max_size + 1):
+            to_cluster = []
+            reused_count = 0
+            pruned_count = 0
+            # the dominance of the subsets scored so far decides which supersets are skipped
+            dominated = dominated_keys(ranking_rows(records, score)) if prune_dominated else set()
+            for positions in position_subsets(peptide_length, size, size):
+                if is_pruned(positions, records, pruned, max_noise_fraction, structure_count) or (prune_dominated and is_dominated_by_subsets(positions, records, pruned, dominated)):
+                    pruned.add(positions_key(positions))
+                    pruned_count += 1
+                    continue
+                record = load_checkpointed_record(search_path, positions, settings) if resume else None
+                if record is not None:
+                    records[positions_key(positions)] = record
+                    reused_count += 1
+                else:
+                    to_cluster.append(list(positions))
+
+            if to_cluster:
+                clustering_collection = write_clustering_records(sweep, to_cluster, min_cluster_size=min_cluster_size, verbose=verbose, superpose=superpose, cluster_sizes_path=search_path, record_fields={'search_settings': settings})
+                records.update(clustering_collection['clusters'])
+
+            print (f"Subsets of {size} positions: {len(to_cluster)} clustered, {reused_count} reused, {pruned_count} pruned")
+
+    rows = ranking_rows(records, score)
+    dominated = dominated_keys(rows)
+    rows.sort(key=lambda row: (row['score'], len(row['positions'].split('_')), row['positions']))
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+        row['dominated'] = row['positions'] in dominated
+        # an infinite score, from a subset with no maximum RMSD, is not valid JSON
+        if row['score'] == float('inf'):
+            row['score'] = None
+
+    return [{name: row[name] for name in ['rank', 'positions', 'score', 'cluster_count', 'noise_cluster_size', 'max_rmsd', 'dominated']} for row in rows]
+
+
+def ranking_rows(records:Dict, score:Callable) -> List[Dict]:
+    """
+    Returns:
+        List[Dict]: A row for each clustering record, keyed by position set, with its positions, score, cluster_count, noise_cluster_size and max_rmsd.
+    """
+    rows = []
+    for key, record in records.items():
+        rows.append({
+            'positions': key,
+            'score': score(record),
+            'cluster_count': record['cluster_count'],
+            'noise_cluster_size': record['noise_cluster_size'],
+            'max_rmsd': record['max_rmsd']
+        })
+    return rows
@@ -0,0 +1,101 @@
+from typing import Dict, List, Tuple
+
+import itertools
+
+import numpy as np
+
+from functions.voxels import VoxelGrid, create_voxel_grid
+
+
+def offset_lattice(x_offsets:List[float], y_offsets:List[float], z_offsets:List[float]) -> List[Tuple[float, float, float]]:
+    """
+    Builds every combination of x, y and z offsets.
+
+    Returns:
+        List[Tuple[float, float, float]]: The (x, y, z) offsets.
+    """
+    return list(itertools.product(x_offsets, y_offsets, z_offsets))
+
+
+def grid_occupancy_statistics(coordinates:np.ndarray, voxel_grid:VoxelGrid, boundary_margin:float=0.1) -> Dict:
+    """
+    Calculates occupancy statistics for a set of stacked peptide coordinates on a single voxel grid.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of coordinates (as returned by stack_peptide_coordinates). Missing residues should be NaN.
+        voxel_grid (VoxelGrid): The voxel grid.
+        boundary_margin (float): Coordinates closer than this to a voxel face (in Ångströms) are counted as sensitive to the placement of the grid.
+
+    Returns:
+        Dict: A dictionary of statistics, overall and for each position.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    structure_count, peptide_length = coordinates.shape[:2]
+    present = ~np.isnan(coordinates).any(axis=-1)
+
+    voxel_xyz, valid = voxel_grid.find_voxel_xyz(coordinates)
+    voxel_indices = voxel_grid.xyz_to_indices(voxel_xyz, valid)
+
+    # count the structures in each used voxel at each position without building a dense array
+    positions = np.broadcast_to(np.arange(peptide_length), voxel_indices.shape)
+    keys = positions[valid] * voxel_grid.voxel_count + voxel_indices[valid]
+    used_keys, key_counts = np.unique(keys, return_counts=True)
+    key_positions = used_keys // voxel_grid.voxel_count
+
+    voxels_used = np.bincount(key_positions, minlength=peptide_length)
+    modal_counts = np.zeros(peptide_length, dtype=np.int64)
+    np.maximum.at(modal_counts, key_positions, key_counts)
+
+    # the distance from each coordinate to the nearest face of its voxel
+    with np.errstate(invalid='ignore'):
+        fractional = (coordinates - np.asarray(voxel_grid.origin)) / voxel_grid.voxel_size - voxel_xyz
+        face_distance = np.minimum(fractional, 1 - fractional).min(axis=-1) * voxel_grid.voxel_size
+        near_boundary = valid & (face_distance < boundary_margin)
+
+    present_counts = present.sum(axis=0)
+    inside_counts = valid.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        position_inside_fractions = inside_counts / present_counts
+        position_modal_fractions = modal_counts / inside_counts
+        position_boundary_fractions = near_boundary.sum(axis=0) / inside_counts
+
+    return {
+        'voxel_count': voxel_grid.voxel_count,
+        'structure_count': structure_count,
+        'inside_fraction': float(valid.sum() / max(present.sum(), 1)),
+        'boundary_fraction': float(near_boundary.sum() / max(valid.sum(), 1)),
+        'voxels_used': int(len(used_keys)),
+        'position_inside_fractions': [round(float(value), 4) for value in position_inside_fractions],
+        'position_voxels_used': [int(value) for value in voxels_used],
+        'position_modal_fractions': [round(float(value), 4) for value in position_modal_fractions],
+        'position_boundary_fractions': [round(float(value), 4) for value in position_boundary_fractions]
+    }
+
+
+def sweep_grid_parameters(coordinates:np.ndarray, centre_of_mass:List[float], box_xyz:List[float], voxel_sizes:List[float], offsets:List[Tuple[float, float, float]], range_offset:int=1, boundary_margin:float=0.1) -> List[Dict]:
+    """
+    Evaluates occupancy statistics for every combination of voxel size and offsets, using coordinates which have been parsed once.
+
+    Args:
+        coordinates (np.ndarray): A (structures, positions, 3) array of coordinates (as returned by stack_peptide_coordinates).
+        centre_of_mass (List[float]): The centre of mass of the structure.
+        box_xyz (List[float]): The dimensions of the box.
+        voxel_sizes (List[float]): The voxel sizes to evaluate.
+        offsets (List[Tuple[float, float, float]]): The (x, y, z) offsets to evaluate (see offset_lattice).
+        range_offset (int): The range offset passed to create_voxel_grid.
+        boundary_margin (float): Coordinates closer than this to a voxel face (in Ångströms) are counted as sensitive to the placement of the grid.
+
+    Returns:
+        List[Dict]: A record for each setting, containing the voxel_size, the offsets and the statistics from grid_occupancy_statistics.
+    """
+    results = []
+    for voxel_size in voxel_sizes:
+        for x_offset, y_offset, z_offset in offsets:
+            voxel_grid = create_voxel_grid(centre_of_mass, box_xyz, voxel_size, range_offset=range_offset, x_offset=x_offset, y_offset=y_offset, z_offset=z_offset)
+            results.append({
+                'voxel_size': voxel_size,
+                'offsets': {'x': x_offset, 'y': y_offset, 'z': z_offset},
+                'statistics': grid_occupancy_statistics(coordinates, voxel_grid, boundary_margin=boundary_margin)
+            })
+    return results
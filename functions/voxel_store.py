@@ -0,0 +1,239 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import json
+import os
+
+import numpy as np
+
+from functions.voxels import VoxelGrid
+
+
+STORE_DIRECTORY_NAME = 'voxel_store'
+
+# the arrays of the store, each of which is written to its own .npy file so that it can be memory-mapped
+STORE_ARRAYS = ['pdb_codes', 'voxel_indices', 'coordinates', 'residues']
+
+
+class VoxelStoreBuilder:
+    """
+    Fills the arrays of a voxel store one structure at a time, so that structures can be added as they stream past without their voxel dictionaries being kept.
+
+    The arrays are preallocated for the expected number of structures, and grow if more structures, or longer peptides, are added.
+
+        builder = VoxelStoreBuilder(voxel_grid, voxel_grid_hash, structure_count=len(pdb_codes))
+        for pdb_code, structure_voxels in voxelized_structures:
+            builder.add(pdb_code, structure_voxels)
+        voxel_store = builder.build()
+    """
+    def __init__(self, voxel_grid:VoxelGrid, voxel_grid_hash:str, structure_count:int=0, peptide_length:int=9):
+        self.voxel_grid = voxel_grid
+        self.voxel_grid_hash = voxel_grid_hash
+        self.structure_count = 0
+        self.peptide_length = 0
+        self.pdb_codes = []
+        self.voxel_indices = np.full((max(structure_count, 1), peptide_length), -1, dtype=np.int32)
+        self.coordinates = np.full((max(structure_count, 1), peptide_length, 3), np.nan, dtype=np.float32)
+        self.residues = np.full((max(structure_count, 1), peptide_length), '', dtype='U3')
+
+
+    def reserve(self, structure_count:int, peptide_length:int):
+        """
+        Grows the arrays to hold at least this many structures and positions, doubling the number of rows so that adding structures one at a time stays cheap.
+        """
+        rows, columns = self.voxel_indices.shape
+        if structure_count <= rows and peptide_length <= columns:
+            return
+        if structure_count > rows:
+            rows = max(structure_count, rows * 2)
+        columns = max(columns, peptide_length)
+
+        voxel_indices = np.full((rows, columns), -1, dtype=np.int32)
+        coordinates = np.full((rows, columns, 3), np.nan, dtype=np.float32)
+        residues = np.full((rows, columns), '', dtype='U3')
+        used_rows, used_columns = self.voxel_indices.shape
+        voxel_indices[:used_rows, :used_columns] = self.voxel_indices
+        coordinates[:used_rows, :used_columns] = self.coordinates
+        residues[:used_rows, :used_columns] = self.residues
+        self.voxel_indices, self.coordinates, self.residues = voxel_indices, coordinates, residues
+
+
+    def add(self, pdb_code:str, structure_voxels:Dict):
+        """
+        Adds the voxels of a structure (as returned by find_voxels_for_structure) as the next row of the store.
+        """
+        peptide_length = max([int(position) for position in structure_voxels], default=0)
+        self.reserve(self.structure_count + 1, peptide_length)
+
+        row = self.structure_count
+        for position, voxel in structure_voxels.items():
+            column = int(position) - 1
+            self.voxel_indices[row, column] = self.voxel_grid.label_to_index(voxel['voxel_label'])
+            self.coordinates[row, column] = voxel['atom_coordinates']
+            self.residues[row, column] = voxel['residue']
+
+        self.pdb_codes.append(pdb_code)
+        self.structure_count += 1
+        self.peptide_length = max(self.peptide_length, peptide_length)
+
+
+    def build(self) -> Dict:
+        """
+        Returns:
+            Dict: The store (as returned by build_voxel_store), trimmed to the structures added and the longest peptide.
+        """
+        rows, columns = self.structure_count, self.peptide_length
+        return {
+            'pdb_codes': np.array(self.pdb_codes, dtype=str),
+            'voxel_indices': self.voxel_indices[:rows, :columns],
+            'coordinates': self.coordinates[:rows, :columns],
+            'residues': self.residues[:rows, :columns],
+            'metadata': {
+                'voxel_grid_hash': self.voxel_grid_hash,
+                'descriptor': self.voxel_grid.descriptor,
+                'atom_name': 'CA',
+                'structure_count': rows,
+                'peptide_length': columns
+            }
+        }
+
+
+def build_voxel_store(voxelized_structures:Iterable[Tuple[str, Dict]], voxel_grid:VoxelGrid, voxel_grid_hash:str, structure_count:int=0) -> Dict:
+    """
+    Packs the voxels for a set of structures into a single columnar store, one structure at a time (see VoxelStoreBuilder).
+
+    Positions are zero-based columns of each array. Positions which were outside the grid have a voxel index of -1, NaN coordinates and an empty residue code.
+
+    Args:
+        voxelized_structures (Iterable[Tuple[str, Dict]]): The PDB code and structure_voxels dictionary (as returned by find_voxels_for_structure) of each structure.
+        voxel_grid (VoxelGrid): The voxel grid the structures were voxelized on.
+        voxel_grid_hash (str): The name of the voxel set directory for the grid.
+        structure_count (int): The expected number of structures, for which the arrays are preallocated.
+
+    Returns:
+        Dict: A dictionary containing the pdb_codes (structures), the voxel_indices (structures, positions) int32 matrix, the (structures, positions, 3) float32 coordinates, the residues (structures, positions) and the metadata.
+    """
+    builder = VoxelStoreBuilder(voxel_grid, voxel_grid_hash, structure_count=structure_count)
+    for pdb_code, structure_voxels in voxelized_structures:
+        builder.add(pdb_code, structure_voxels)
+    return builder.build()
+
+
+def write_voxel_store(voxel_store:Dict, voxel_set_filepath:str) -> str:
+    """
+    Writes the store to <voxel_set_filepath>/voxel_store/, as one .npy file per array and a metadata.json file.
+
+    Returns:
+        str: The path of the store directory.
+    """
+    store_filepath = f"{voxel_set_filepath}/{STORE_DIRECTORY_NAME}"
+    if not os.path.exists(store_filepath):
+        os.makedirs(store_filepath)
+
+    for name in STORE_ARRAYS:
+        np.save(f"{store_filepath}/{name}.npy", voxel_store[name], allow_pickle=False)
+
+    # the metadata is written last, so a store with a metadata file is complete
+    with open(f"{store_filepath}/metadata.json", 'w') as filehandle:
+        json.dump(voxel_store['metadata'], filehandle, indent=4)
+    return store_filepath
+
+
+def has_voxel_store(voxel_set_filepath:str) -> bool:
+    """
+    Returns:
+        bool: Whether a complete store has been written for the voxel set.
+    """
+    return os.path.exists(f"{voxel_set_filepath}/{STORE_DIRECTORY_NAME}/metadata.json")
+
+
+def load_voxel_store(voxel_set_filepath:str, mmap:bool=True) -> Dict:
+    """
+    Loads the store for a voxel set.
+
+    Args:
+        voxel_set_filepath (str): The voxel set directory for the grid.
+        mmap (bool): Whether to memory-map the arrays (read only) rather than reading them into memory.
+
+    Returns:
+        Dict: The store (as returned by build_voxel_store).
+    """
+    store_filepath = f"{voxel_set_filepath}/{STORE_DIRECTORY_NAME}"
+    mmap_mode = 'r' if mmap else None
+
+    voxel_store = {name: np.load(f"{store_filepath}/{name}.npy", mmap_mode=mmap_mode, allow_pickle=False) for name in STORE_ARRAYS}
+    with open(f"{store_filepath}/metadata.json", 'r') as filehandle:
+        voxel_store['metadata'] = json.load(filehandle)
+    return voxel_store
+
+
+def voxel_store_from_json(pdb_codes:Iterable[str], voxel_grid:VoxelGrid, voxel_set_filepath:str) -> Dict:
+    """
+    Builds the store from the per-structure JSON files of a voxel set, e.g. to convert a voxel set written before the store existed.
+    """
+    # imported here as the pipeline module imports this one
+    from functions.pipeline import load_structure_voxels
+
+    voxel_grid_hash = os.path.basename(voxel_set_filepath)
+    return build_voxel_store(load_structure_voxels(pdb_codes, voxel_set_filepath), voxel_grid, voxel_grid_hash)
+
+
+def store_structure_voxels(voxel_store:Dict, voxel_grid:VoxelGrid, pdb_codes:List[str]=None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Rebuilds the legacy structure_voxels dictionary for each structure in the store.
+
+    Coordinates are stored as float32, so they are rounded back to the three decimal places of the PDB format.
+
+    Args:
+        voxel_store (Dict): The store (as returned by load_voxel_store).
+        voxel_grid (VoxelGrid): The voxel grid of the store.
+        pdb_codes (List[str]): If given, only these structures are returned, in this order.
+
+    Yields:
+        str: The PDB code.
+        Dict: The structure_voxels dictionary (as returned by find_voxels_for_structure).
+    """
+    all_pdb_codes = voxel_store['pdb_codes'].tolist()
+    if pdb_codes is None:
+        rows = range(len(all_pdb_codes))
+    else:
+        row_lookup = {pdb_code: row for row, pdb_code in enumerate(all_pdb_codes)}
+        rows = [row_lookup[pdb_code] for pdb_code in pdb_codes]
+
+    voxels = voxel_grid['voxels']
+
+    for row in rows:
+        voxel_indices = voxel_store['voxel_indices'][row].tolist()
+        coordinates = np.round(voxel_store['coordinates'][row].astype(float), 3).tolist()
+        residues = voxel_store['residues'][row].tolist()
+
+        structure_voxels = {}
+        for column, voxel_index in enumerate(voxel_indices):
+            if voxel_index < 0:
+                continue
+            p = column + 1
+            voxel_label = voxel_grid.index_to_label(voxel_index)
+            structure_voxels[str(p)] = {
+                'position': p,
+                'voxel_label': voxel_label,
+                'atom_name': voxel_store['metadata']['atom_name'],
+                'atom_coordinates': coordinates[column],
+                'voxel_start': voxels[voxel_label]['start'],
+                'voxel_centre': voxels[voxel_label]['centre'],
+                'residue': residues[column]
+            }
+        yield all_pdb_codes[row], structure_voxels
+
+
+def export_voxel_store_to_json(voxel_store:Dict, voxel_grid:VoxelGrid, voxel_set_filepath:str, verbose:bool=True) -> int:
+    """
+    Writes the legacy <voxel_set_filepath>/<pdb_code>.json file for each structure in the store.
+
+    Returns:
+        int: The number of files written.
+    """
+    # imported here as the pipeline module imports this one
+    from functions.pipeline import write_structure_voxels
+
+    voxel_grid_hash = voxel_store['metadata']['voxel_grid_hash']
+    written = write_structure_voxels(store_structure_voxels(voxel_store, voxel_grid), voxel_set_filepath, voxel_grid_hash, verbose=verbose)
+    return sum(1 for structure in written)
@@ -1,9 +1,318 @@
+from typing import List, Dict, Optional, Iterator, Tuple
+from collections.abc import Mapping
 
-from typing import List, Dict
+import hashlib
+import json
+import math
 
 import numpy as np
 
-def create_voxel_grid(centre_of_mass:List[float], box_xyz:List[float], voxel_size:float, range_offset:int=0, x_offset:int=0, y_offset:int=0, z_offset:int=0) -> Dict:
+
+# the version of the grid descriptor, increment this if the meaning of the descriptor fields changes
+GRID_SCHEMA_VERSION = 1
+
+
+class VoxelGrid:
+    """
+    An array-backed voxel grid which stores only the start, shape and voxel size of the grid.
+
+    The start, end and centre of each voxel are calculated on demand, either for the whole grid as NumPy arrays, or for a single voxel. 
+    Indexing the grid with 'params', 'voxels', 'labels' or 'metadata' gives the same view as the dictionary previously returned by create_voxel_grid, so existing code can use either.
+
+    Voxels are ordered with x varying fastest, then y, then z, which is the order of the voxel labels.
+    """
+
+    def __init__(self, origin:List[float], shape:List[int], voxel_size:float, params:Dict=None, metadata:Dict=None):
+        """
+        Args:
+            origin (List[float]): The start (lowest x, y and z corner) of the first voxel in the grid.
+            shape (List[int]): The number of voxels along the x, y and z axes.
+            voxel_size (float): The size of the voxels.
+            params (Dict): The parameters used to create the grid.
+            metadata (Dict): Any metadata for the grid.
+        """
+        self.origin = [float(value) for value in origin]
+        self.shape = tuple(int(value) for value in shape)
+        self.voxel_size = voxel_size
+        self.params = params if params is not None else {}
+        self.metadata = metadata if metadata is not None else {}
+
+
+    @property
+    def voxel_count(self) -> int:
+        return self.shape[0] * self.shape[1] * self.shape[2]
+
+
+    @property
+    def descriptor(self) -> Dict:
+        """
+        Returns:
+            Dict: The canonical description of the grid (start, shape, voxel size, offsets and schema version), from which the grid can be rebuilt.
+        """
+        return {
+            'schema_version': GRID_SCHEMA_VERSION,
+            'origin': [round(value, 6) for value in self.origin],
+            'shape': list(self.shape),
+            'voxel_size': float(self.voxel_size),
+            'offsets': {axis: self.params.get(f"{axis}_offset", 0) for axis in ['x', 'y', 'z']}
+        }
+
+
+    @property
+    def digest(self) -> str:
+        """
+        Returns:
+            str: A stable hash of the grid descriptor, which identifies the grid without building the voxels.
+        """
+        return hashlib.md5(json.dumps(self.descriptor, sort_keys=True).encode()).hexdigest()
+
+
+    @property
+    def indices(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: An (n, 3) array of the integer x, y and z indices of every voxel, in label order.
+        """
+        nx, ny, nz = self.shape
+        flat_indices = np.arange(self.voxel_count)
+        return np.stack([flat_indices % nx, (flat_indices // nx) % ny, flat_indices // (nx * ny)], axis=1)
+
+
+    @property
+    def starts(self) -> np.ndarray:
+        return np.asarray(self.origin) + self.indices * self.voxel_size
+
+
+    @property
+    def ends(self) -> np.ndarray:
+        return np.asarray(self.origin) + (self.indices + 1) * self.voxel_size
+
+
+    @property
+    def centres(self) -> np.ndarray:
+        return np.asarray(self.origin) + (self.indices + 0.5) * self.voxel_size
+
+
+    @property
+    def labels(self) -> List[str]:
+        return list(self.iter_labels())
+
+
+    def iter_labels(self) -> Iterator[str]:
+        nx, ny, nz = self.shape
+        for z in range(nz):
+            for y in range(ny):
+                for x in range(nx):
+                    yield f"{x}_{y}_{z}"
+
+
+    def label_to_xyz(self, voxel_label:str) -> Optional[Tuple[int, int, int]]:
+        """
+        Converts a voxel label (e.g. '9_6_9') into its x, y and z indices.
+
+        Returns:
+            Tuple[int, int, int]: The x, y and z indices, or None if the label is not a voxel in this grid.
+        """
+        try:
+            xyz = tuple(int(value) for value in voxel_label.split('_'))
+        except (AttributeError, ValueError):
+            return None
+        if len(xyz) != 3:
+            return None
+        for index, axis_length in zip(xyz, self.shape):
+            if not 0 <= index < axis_length:
+                return None
+        return xyz
+
+
+    def voxel(self, voxel_label:str) -> Dict:
+        """
+        Calculates the start, end and centre of a single voxel.
+
+        Args:
+            voxel_label (str): The label of the voxel, e.g. '9_6_9'.
+
+        Returns:
+            Dict: A dictionary containing the start, end and centre of the voxel.
+        """
+        xyz = self.label_to_xyz(voxel_label)
+        if xyz is None:
+            raise KeyError(voxel_label)
+        return {
+            'start': [axis_start + index * self.voxel_size for axis_start, index in zip(self.origin, xyz)],
+            'end': [axis_start + (index + 1) * self.voxel_size for axis_start, index in zip(self.origin, xyz)],
+            'centre': [axis_start + (index + 0.5) * self.voxel_size for axis_start, index in zip(self.origin, xyz)]
+        }
+
+
+    def label_to_index(self, voxel_label:str) -> int:
+        """
+        Converts a voxel label into the index of the voxel in label order.
+        """
+        xyz = self.label_to_xyz(voxel_label)
+        if xyz is None:
+            raise KeyError(voxel_label)
+        return xyz[0] + self.shape[0] * (xyz[1] + self.shape[1] * xyz[2])
+
+
+    def index_to_label(self, voxel_index:int) -> str:
+        """
+        Converts the index of a voxel in label order back into its voxel label.
+        """
+        nx, ny, nz = self.shape
+        voxel_index = int(voxel_index)
+        if not 0 <= voxel_index < self.voxel_count:
+            raise KeyError(voxel_index)
+        return f"{voxel_index % nx}_{(voxel_index // nx) % ny}_{voxel_index // (nx * ny)}"
+
+
+    def find_voxel_xyz(self, coordinates:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the x, y and z indices of the voxels containing an array of coordinates in a single vectorized step.
+
+        Args:
+            coordinates (np.ndarray): An array of coordinates of any shape whose last dimension is the x, y and z coordinate, e.g. (structures, positions, 3). Missing coordinates can be given as NaN.
+
+        Returns:
+            np.ndarray: An integer array of the same shape as the coordinates containing the x, y and z index of the containing voxel. Coordinates outside the grid have indices of 0.
+            np.ndarray: A boolean array with the shape of the coordinates minus the last dimension which is True where the coordinate is inside the grid.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        origin = np.asarray(self.origin)
+        shape = np.asarray(self.shape)
+
+        with np.errstate(invalid='ignore'):
+            xyz = np.floor((coordinates - origin) / self.voxel_size)
+            # correct for floating point rounding so that voxel boundaries match is_coordinate_inside_voxel exactly
+            voxel_starts = origin + xyz * self.voxel_size
+            xyz = xyz - (coordinates < voxel_starts) + (coordinates >= voxel_starts + float(self.voxel_size))
+            # NaN coordinates fail both comparisons, so are also marked as outside the grid
+            valid = np.all((xyz >= 0) & (xyz < shape), axis=-1)
+
+        xyz = np.where(valid[..., np.newaxis], xyz, 0).astype(np.int64)
+        return xyz, valid
+
+
+    def xyz_to_indices(self, xyz:np.ndarray, valid:np.ndarray=None) -> np.ndarray:
+        """
+        Converts an integer array of x, y and z voxel indices into indices in label order.
+
+        Args:
+            xyz (np.ndarray): An integer array whose last dimension is the x, y and z index.
+            valid (np.ndarray): An optional boolean mask. Voxels which are not valid are given an index of -1.
+
+        Returns:
+            np.ndarray: The index of each voxel in label order.
+        """
+        xyz = np.asarray(xyz, dtype=np.int64)
+        voxel_indices = xyz[..., 0] + self.shape[0] * (xyz[..., 1] + self.shape[1] * xyz[..., 2])
+        if valid is not None:
+            voxel_indices = np.where(valid, voxel_indices, -1)
+        return voxel_indices
+
+
+    def find_voxel_indices(self, coordinates:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the voxels containing an array of coordinates in a single vectorized step.
+
+        Args:
+            coordinates (np.ndarray): An array of coordinates of any shape whose last dimension is the x, y and z coordinate, e.g. (structures, positions, 3). Missing coordinates can be given as NaN.
+
+        Returns:
+            np.ndarray: An integer array of the index of the containing voxel in label order, with the shape of the coordinates minus the last dimension. Coordinates outside the grid have an index of -1.
+            np.ndarray: A boolean array of the same shape which is True where the coordinate is inside the grid.
+        """
+        xyz, valid = self.find_voxel_xyz(coordinates)
+        return self.xyz_to_indices(xyz, valid), valid
+
+
+    def to_volume(self, values:np.ndarray) -> np.ndarray:
+        """
+        Reshapes values in label order into a three-dimensional volume.
+
+        Args:
+            values (np.ndarray): An array whose last dimension has one value per voxel, in label order.
+
+        Returns:
+            np.ndarray: An array whose last three dimensions are the x, y and z axes of the grid.
+        """
+        values = np.asarray(values)
+        return values.reshape(values.shape[:-1] + self.shape, order='F')
+
+
+    def from_volume(self, volume:np.ndarray) -> np.ndarray:
+        """
+        Flattens a volume (as returned by to_volume) back into label order.
+        """
+        volume = np.asarray(volume)
+        return volume.reshape(volume.shape[:-3] + (self.voxel_count,), order='F')
+
+
+    def keys(self) -> List[str]:
+        return ['params', 'voxels', 'labels', 'metadata']
+
+
+    def __contains__(self, key:str) -> bool:
+        return key in self.keys()
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+
+    def __getitem__(self, key:str):
+        if key == 'params':
+            return self.params
+        elif key == 'voxels':
+            return VoxelView(self)
+        elif key == 'labels':
+            return self.labels
+        elif key == 'metadata':
+            return self.metadata
+        raise KeyError(key)
+
+
+    def to_dict(self) -> Dict:
+        """
+        Builds the full dictionary representation of the grid, as used for voxel_set.json.
+
+        Returns:
+            Dict: A dictionary containing the params, voxels, labels and metadata of the grid.
+        """
+        return {
+            'params': self.params,
+            'voxels': {voxel_label: self.voxel(voxel_label) for voxel_label in self.iter_labels()},
+            'labels': self.labels,
+            'metadata': self.metadata
+        }
+
+
+class VoxelView(Mapping):
+    """
+    A read-only, dictionary-like view of the voxels in a VoxelGrid, keyed by voxel label.
+    """
+
+    def __init__(self, voxel_grid:VoxelGrid):
+        self.voxel_grid = voxel_grid
+
+
+    def __getitem__(self, voxel_label:str) -> Dict:
+        return self.voxel_grid.voxel(voxel_label)
+
+
+    def __contains__(self, voxel_label:str) -> bool:
+        return self.voxel_grid.label_to_xyz(voxel_label) is not None
+
+
+    def __iter__(self) -> Iterator[str]:
+        return self.voxel_grid.iter_labels()
+
+
+    def __len__(self) -> int:
+        return self.voxel_grid.voxel_count
+
+
+def create_voxel_grid(centre_of_mass:List[float], box_xyz:List[float], voxel_size:float, range_offset:int=0, x_offset:int=0, y_offset:int=0, z_offset:int=0) -> VoxelGrid:
     """
     This function creates a voxel grid based on the centre of mass and the dimensions of the box, the size of voxels, and the range and x, y, and z offsets.
 
@@ -17,18 +326,11 @@ def create_voxel_grid(centre_of_mass:List[float], box_xyz:List[float], voxel_siz
         z_offset (int): The z offset.
 
     Returns:
-        Dict: A dictionary containing the voxel grid.
+        VoxelGrid: The voxel grid. Use VoxelGrid.to_dict() for the full dictionary representation.
     """
 
     params = dict(zip(locals().keys(), locals().values()))
 
-    voxel_grid = {
-        "params": params,
-        "voxels": {}, 
-        "labels": [],
-        "metadata": {}
-    }
-
     cx, cy, cz = centre_of_mass
     length, width, height = box_xyz
 
@@ -36,38 +338,37 @@ def create_voxel_grid(centre_of_mass:List[float], box_xyz:List[float], voxel_siz
     start_y = cy - (width / 2) + y_offset
     start_z = cz - (height / 2) + z_offset  
 
-    end_x = start_x + length
-    end_y = start_y + width
-    end_z = start_z + height
-
     num_cubes_x = int(length / voxel_size)
     num_cubes_y = int(width / voxel_size)
     num_cubes_z = int(height / voxel_size)
 
+    shape = [num_cubes_x + range_offset, num_cubes_y + range_offset, num_cubes_z + range_offset]
 
-    for z in range(num_cubes_z + range_offset):
-        for y in range(num_cubes_y + range_offset):
-            for x in range(num_cubes_x + range_offset):
-                voxel_label = f"{x}_{y}_{z}"
-                voxel_grid['voxels'][voxel_label] = {
-                    'start': [start_x + x * voxel_size, start_y + y * voxel_size, start_z + z * voxel_size],
-                    'end': [start_x + (x + 1) * voxel_size, start_y + (y + 1) * voxel_size, start_z + (z + 1) * voxel_size],
-                    'centre': [start_x + (x + 0.5) * voxel_size, start_y + (y + 0.5) * voxel_size, start_z + (z + 0.5) * voxel_size]
-                }
-                voxel_grid['labels'].append(voxel_label)
+    voxel_grid = VoxelGrid([start_x, start_y, start_z], shape, voxel_size, params=params)
     
-    voxel_grid['params']['voxel_count'] = len(voxel_grid['voxels'])
+    voxel_grid.params['voxel_count'] = voxel_grid.voxel_count
     
     return voxel_grid
 
 
-def find_voxels_for_structure(peptide_df, voxels, voxel_size:int=1):
+def find_voxels_for_structure(peptide_df, voxels, voxel_size:int=1, lookup:str='analytic'):
+    """
+    This function finds the voxel occupied by the alpha carbon of each residue of a peptide.
+
+    Args:
+        peptide_df (Dict): The dictionary of dataframes for the peptide structure (as returned by load_pdb_file_to_dataframe).
+        voxels (Dict): The voxels of the voxel grid, keyed by voxel label.
+        voxel_size (int): The size of the voxels.
+        lookup (str): Either 'analytic', which calculates the voxel for each coordinate directly from the start of the grid, or 'scan', which checks each coordinate against every voxel in turn.
+
+    Returns:
+        Dict: A dictionary keyed by peptide position containing the voxel and atom information. Positions whose coordinates fall outside the grid are not included.
+    """
 
-    # initialise the lists and dictionaries
+    # initialise the lists
     coordinates_to_check = []
     sequence = []
     positions = []
-    structure_voxels = {}
 
 
     # iterate through the rows of the dataframe to generate a list of coordinates to check
@@ -86,30 +387,92 @@ def find_voxels_for_structure(peptide_df, voxels, voxel_size:int=1):
                 sequence.append(row['residue_name'])
                 coordinates_to_check.append((x,y,z))
                 positions.append(residue_number)
-    
+
+    return find_voxels_for_coordinates(coordinates_to_check, sequence, voxels, voxel_size=voxel_size, lookup=lookup)
+
+
+def find_voxels_for_coordinates(coordinates_to_check:List, sequence:List[str], voxels, voxel_size:int=1, lookup:str='analytic') -> Dict:
+    """
+    This function finds the voxel occupied by each of a list of alpha carbon coordinates, one per peptide position.
+
+    Args:
+        coordinates_to_check (List): The x, y and z coordinates for each position.
+        sequence (List[str]): The residue name for each position.
+        voxels (Dict): The voxels of the voxel grid, keyed by voxel label.
+        voxel_size (int): The size of the voxels.
+        lookup (str): Either 'analytic' or 'scan' (see find_voxels_for_structure).
+
+    Returns:
+        Dict: A dictionary keyed by peptide position containing the voxel and atom information. Positions whose coordinates fall outside the grid are not included.
+    """
+    structure_voxels = {}
+
     # set the variable for the position number to 1
     p = 1
 
-    # iterate through the coordinates to check and the voxels to find the voxels that contain the coordinates
+    # iterate through the coordinates to check and find the voxels that contain the coordinates
     for coordinate in coordinates_to_check:
-        for voxel in voxels:
-            # if the atom is inside a specific voxel, add the voxel and the atom information to the structure_voxels dictionary
-            if is_coordinate_inside_voxel(coordinate[0],coordinate[1],coordinate[2], voxels[voxel]['start'], voxel_size):
-                structure_voxels[str(p)] = {
-                    'position': p,
-                    'voxel_label': voxel,
-                    'atom_name': 'CA',
-                    'atom_coordinates': coordinate,
-                    'voxel_start': voxels[voxel]['start'],
-                    'voxel_centre': voxels[voxel]['centre'],
-                    'residue': sequence[p-1]
-                }
-                break
+        if lookup == 'analytic':
+            voxel = find_voxel_label(coordinate[0], coordinate[1], coordinate[2], voxels, voxel_size)
+        else:
+            voxel = None
+            for voxel_label in voxels:
+                if is_coordinate_inside_voxel(coordinate[0],coordinate[1],coordinate[2], voxels[voxel_label]['start'], voxel_size):
+                    voxel = voxel_label
+                    break
+        # if the atom is inside a specific voxel, add the voxel and the atom information to the structure_voxels dictionary
+        if voxel is not None:
+            structure_voxels[str(p)] = {
+                'position': p,
+                'voxel_label': voxel,
+                'atom_name': 'CA',
+                'atom_coordinates': coordinate,
+                'voxel_start': voxels[voxel]['start'],
+                'voxel_centre': voxels[voxel]['centre'],
+                'residue': sequence[p-1]
+            }
         p += 1
     # return the structure_voxels dictionary
     return structure_voxels
 
 
+def find_voxel_label(x:float, y:float, z:float, voxels:Dict, voxel_size:float) -> Optional[str]:
+    """
+    Finds the voxel containing a three-dimensional coordinate by calculating the voxel index directly from the start of the grid, rather than checking every voxel.
+
+    Args:
+        x (float): The x-coordinate of the target point.
+        y (float): The y-coordinate of the target point.
+        z (float): The z-coordinate of the target point.
+        voxels (Dict): The voxels of the voxel grid, keyed by voxel label.
+        voxel_size (float): The size of the voxels.
+
+    Returns:
+        str: The label of the voxel containing the coordinate, or None if the coordinate is outside the grid.
+    """
+    grid_start = voxels['0_0_0']['start']
+
+    indices = []
+    for coordinate, axis_start in zip((x, y, z), grid_start):
+        index = math.floor((coordinate - axis_start) / voxel_size)
+        voxel_start = axis_start + index * voxel_size
+        # correct for floating point rounding so that voxel boundaries match is_coordinate_inside_voxel exactly
+        if coordinate < voxel_start:
+            index -= 1
+        elif coordinate >= voxel_start + float(voxel_size):
+            index += 1
+        if index < 0:
+            return None
+        indices.append(index)
+
+    voxel_label = f"{indices[0]}_{indices[1]}_{indices[2]}"
+
+    # coordinates beyond the far edges of the grid have no matching voxel
+    if voxel_label not in voxels:
+        return None
+    return voxel_label
+
+
 def is_coordinate_inside_voxel(x:float, y:float, z:float, voxel_corner, voxel_size) -> bool:
     """
     Detects whether a three-dimensional coordinate is contained within a specific cube.
@@ -1,153 +1,50 @@
-from typing import Dict
-
+import argparse
 import os
-import requests
 import json
-import hashlib
-
-from biopandas.pdb import PandasPdb
-
-
-import constants
-import helpers
-
-
-
-
-### Functions used by this script ###
-
-def load_pdb_file_to_dataframe(pdb_code:str, domain:str) -> Dict:
-    """
-    Loads a PDB file from the Histo website and returns a dataframe containing the data.
-
-    Args:
-        pdb_code (str): The PDB code of the structure to be loaded, e.g. '1hhk'.
-        domain (str): The domain of the structure to be loaded, e.g. 'peptide'.
 
-    """
-    # lowercase the pdb code for both the filename and the URL
-    pdb_code = pdb_code.lower()
-
-    # create the filename and the URL
-    filename = f"structures/{pdb_code}_{domain}.pdb"
-    url = f"{constants.base_url}/{pdb_code}_1_{domain}.pdb"
-
-    # if the file exists, read it into a dataframe
-    if os.path.exists(filename):
-        structure_df = PandasPdb().read_pdb(filename)
-
-    # otherwise, download the file and then read it into a dataframe
-    else:
-    
-        r = requests.get(url)
-        if r.status_code == 200:
-            structure_data = r.text
-
-            with open(filename, 'w') as filehandle:
-                filehandle.write(structure_data)
-
-            structure_df = PandasPdb().read_pdb(filename)
-        # if the request fails, set structure_df None and print an error message
-        else:
-            print (f"PDB code {pdb_code} has failed with status {r.status_code}")
-            structure_df = None
-
-    # if the structure_df is not None, return the dataframe
-    if structure_df:        
-        return structure_df.df
-    else:
-        return None
-
-
-def find_voxels_for_structure(peptide_df, voxels, voxel_size:int=1):
-
-    # initialise the lists and dictionaries
-    coordinates_to_check = []
-    sequence = []
-    positions = []
-    structure_voxels = {}
-
-
-    # iterate through the rows of the dataframe to generate a list of coordinates to check
-    for index, row in peptide_df['ATOM'].iterrows():
-
-        # first, extract the relevant data from the row
-        atom_name = row['atom_name']
-        residue_name = row['residue_name']
-        chain_id = row['chain_id']
-        x, y, z = row['x_coord'], row['y_coord'], row['z_coord']
-        residue_number = row['residue_number']
-        
-        # if the atom name is the target atom name, add the residue name to the sequence list and the coordinates to the coordinates_to_check list
-        if atom_name == 'CA': # this is hard-coded for now, but should be a parameter in the future 
-            if residue_number not in positions:
-                sequence.append(row['residue_name'])
-                coordinates_to_check.append((x,y,z))
-                positions.append(residue_number)
-    
-    # set the variable for the position number to 1
-    p = 1
-
-    # iterate through the coordinates to check and the voxels to find the voxels that contain the coordinates
-    for coordinate in coordinates_to_check:
-        for voxel in voxels:
-            # if the atom is inside a specific voxel, add the voxel and the atom information to the structure_voxels dictionary
-            if helpers.is_coordinate_inside_voxel(coordinate[0],coordinate[1],coordinate[2], voxels[voxel]['start'], voxel_size):
-                structure_voxels[str(p)] = {
-                    'position': p,
-                    'voxel_label': voxel,
-                    'atom_name': 'CA',
-                    'atom_coordinates': coordinate,
-                    'voxel_start': voxels[voxel]['start'],
-                    'voxel_centre': voxels[voxel]['centre'],
-                    'residue': sequence[p-1]
-                }
-        p += 1
-    # return the structure_voxels dictionary
-    return structure_voxels
+from functions.helpers import load_config
+from functions.pipeline import run_incremental_voxel_pipeline, run_voxel_pipeline
+from functions.registry import register_voxel_grid, voxel_grid_from_config
 
 
 
 ### Body of the script ###
 
-# create the voxel grid, we only need to do this once, so it's outside the loop
-voxel_grid = helpers.create_voxel_grid(constants.centre_of_mass, constants.box_xyz, constants.voxel_size, range_offset=1, y_offset=8)
+# the body is guarded so that worker processes which import this module as __main__ (e.g. on macOS) do not run it again
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the voxel sets for the structures in output/structure_information/all.json')
+    parser.add_argument('--workers', type=int, default=1, help='the number of processes used to parse and voxelize the structures')
+    parser.add_argument('--incremental', action='store_true', help='only voxelize structures which are not yet in the voxel set, and remove those which are no longer in the structure list')
+    parser.add_argument('--store-only', action='store_true', help='only write the voxel store, not a JSON file for each structure')
+    args = parser.parse_args()
 
+    config = load_config()
 
-voxel_grid_hash = hashlib.md5(str(voxel_grid).encode()).hexdigest()
+    # create the voxel grid, we only need to do this once, so it's outside the loop
+    voxel_grid = voxel_grid_from_config(config)
 
-voxel_set_filepath = f"output/voxel_sets/{voxel_grid_hash}"
 
-if not os.path.exists(voxel_set_filepath):
-    os.mkdir(voxel_set_filepath)
+    # the output directory for the grid is found from the grid's parameters in the registry, new grids are added to it
+    voxel_set_filepath = register_voxel_grid(voxel_grid)
 
+    if not os.path.exists(voxel_set_filepath):
+        os.makedirs(voxel_set_filepath)
 
-with open(f"{voxel_set_filepath}/voxel_set.json", 'w') as filehandle:
-    json.dump(voxel_grid, filehandle, indent=4)
-    
 
-with open("output/structure_information/all.json", 'r') as filehandle:
-    structure_info = json.load(filehandle)
+    with open(f"{voxel_set_filepath}/voxel_set.json", 'w') as filehandle:
+        json.dump(voxel_grid.to_dict(), filehandle, indent=4)
 
 
-# iterate through the test PDB codes
-for pdb_code in structure_info['structures']:
+    with open("output/structure_information/all.json", 'r') as filehandle:
+        structure_info = json.load(filehandle)
 
-    # load the peptide dataframe for the PDB code
-    dataframe = load_pdb_file_to_dataframe(pdb_code, 'peptide')
-    
-    if dataframe:
-    # if the dataframe is not None, find the voxels for the structure and write them to a file
-        structure_voxels = find_voxels_for_structure(dataframe, voxel_grid['voxels'], voxel_size=constants.voxel_size)
-
-        voxel_data = {
-            'voxel_grid_hash': voxel_grid_hash,
-            'structure_voxels': structure_voxels
-        }
-
-        filename = f"{voxel_set_filepath}/{pdb_code}.json"
-
-        with open(filename, 'w') as filehandle:
-            json.dump(voxel_data, filehandle, indent=4)
-        print (f"Voxels for {pdb_code} have been written to {filename}")
 
+    # fetch, parse, voxelize and write each structure in turn, then write the voxel usage for the whole set
+    if args.incremental:
+        counts = run_incremental_voxel_pipeline(structure_info['structures'], voxel_grid, config, voxel_set_filepath, workers=args.workers, write_json=not args.store_only)
+        print (f"{counts['added']} structures added, {counts['removed']} removed and {counts['unchanged']} unchanged. {counts['downloaded']} downloaded, {counts['cached']} previously downloaded, {counts['errors']} errors")
+    else:
+        counts = run_voxel_pipeline(structure_info['structures'], voxel_grid, config, voxel_set_filepath, workers=args.workers, write_json=not args.store_only)
+        print (f"{counts['voxelized']} structures voxelized. {counts['downloaded']} downloaded, {counts['cached']} previously downloaded, {counts['errors']} errors")
+    print (f"Voxel usage has been written to {voxel_set_filepath}/used_voxels.json and {voxel_set_filepath}/position_voxels.json")
+    print (f"The voxel store has been written to {voxel_set_filepath}/voxel_store")
@@ -1,37 +1,26 @@
 import json
 
-voxel_grid_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+from functions.helpers import load_config
+from functions.occupancy import PositionOccupancy
+from functions.pipeline import load_structure_voxels, aggregate_voxel_usage, write_voxel_usage
+from functions.registry import resolve_voxel_set, voxel_grid_from_config
+from functions.voxel_store import has_voxel_store, load_voxel_store
 
-voxel_set_filepath = f"output/voxel_sets/{voxel_grid_hash}"
+# find the voxel set for the grid described in the config file
+config = load_config()
+voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(config)
 
 structure_info = json.load(open("output/structure_information/all.json", 'r'))
 
-used_voxel_set = {}
-position_voxel_set = {}
+# if the voxel store exists the usage is counted from its voxel index matrix in one pass, otherwise the voxel files are read one at a time and aggregated as they are read
+if has_voxel_store(voxel_set_filepath):
+    occupancy = PositionOccupancy.from_voxel_store(load_voxel_store(voxel_set_filepath), voxel_grid_from_config(config), pdb_codes=list(structure_info['structures']))
+    used_voxel_set = occupancy.to_used_voxel_set()
+    position_voxel_set = occupancy.to_position_voxel_set()
+else:
+    structure_voxels = load_structure_voxels(structure_info['structures'], voxel_set_filepath)
+    used_voxel_set, position_voxel_set = aggregate_voxel_usage(structure_voxels)
 
-for pdb_code in structure_info['structures']:
-    filename = f"{voxel_set_filepath}/{pdb_code}.json"
-    voxels = json.load(open(filename, 'r'))['structure_voxels']
+write_voxel_usage(used_voxel_set, position_voxel_set, voxel_set_filepath)
 
-
-    used_voxels = [voxels[position]['voxel_label'] for position in voxels]
-    used_voxel_set[pdb_code] = used_voxels
-
-    position = 1
-    for voxel_label in used_voxels:
-        if position not in position_voxel_set:
-            position_voxel_set[position] = {}
-        if voxel_label not in position_voxel_set[position]:
-            position_voxel_set[position][voxel_label] = {'count':0,'members':[]}
-        if pdb_code not in position_voxel_set[position][voxel_label]['members']:
-            position_voxel_set[position][voxel_label]['members'].append(pdb_code)
-        position_voxel_set[position][voxel_label]['count'] += 1
-        position += 1
-
-with open(f"{voxel_set_filepath}/used_voxels.json", 'w') as filehandle:
-    json.dump(used_voxel_set, filehandle, indent=4)
-
-with open(f"{voxel_set_filepath}/position_voxels.json", 'w') as filehandle:
-    json.dump(position_voxel_set, filehandle, indent=4)
-
-print (f"Voxel usage for {voxel_grid_hash} has been written to {voxel_set_filepath}/used_voxels.json and {voxel_set_filepath}/position_voxels.json")
\ No newline at end of file
+print (f"Voxel usage for {voxel_grid_hash} has been written to {voxel_set_filepath}/used_voxels.json and {voxel_set_filepath}/position_voxels.json")
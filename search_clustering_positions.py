@@ -0,0 +1,41 @@
+import argparse
+import json
+
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+from functions.subset_search import SCORING_FUNCTIONS, search_position_subsets, subset_search_filepath
+
+
+
+### Body of the script ###
+
+# the body is guarded so that worker processes which import this module as __main__ (e.g. on macOS) do not run it again
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster the structures of the voxel set for the grid in the config file on every subset of the peptide positions, and rank the subsets')
+    parser.add_argument('--workers', type=int, default=1, help='the number of processes used to cluster the subsets')
+    parser.add_argument('--min-cluster-size', type=int, default=3, help='the minimum cluster size for HDBSCAN')
+    parser.add_argument('--min-size', type=int, default=1, help='the smallest number of positions in a subset')
+    parser.add_argument('--max-size', type=int, default=None, help='the largest number of positions in a subset')
+    parser.add_argument('--score', choices=sorted(SCORING_FUNCTIONS), default='noise_rmsd', help='the score the subsets are ranked by, lower is better')
+    parser.add_argument('--max-noise-fraction', type=float, default=None, help='skip supersets of subsets which leave more than this fraction of the structures as noise')
+    parser.add_argument('--prune-dominated', action='store_true', help='skip supersets all of whose subsets with one position fewer are dominated by a subset already scored')
+    parser.add_argument('--distance-cache', action='store_true', help='cluster on distances summed from a cache of per-position squared distances, which gives the clusters of HDBSCAN\'s generic algorithm rather than those of the notebook')
+    parser.add_argument('--superpose', action='store_true', help='superpose the members of each cluster onto its first member before the maximum RMSDs are calculated')
+    parser.add_argument('--restart', action='store_true', help='cluster every subset again rather than reusing the records already written')
+    parser.add_argument('--top', type=int, default=20, help='the number of subsets to print')
+    args = parser.parse_args()
+
+    # find the voxel set for the grid described in the config file, the clustering uses its voxel store
+    voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(load_config())
+
+    ranked = search_position_subsets(voxel_set_filepath, min_size=args.min_size, max_size=args.max_size, min_cluster_size=args.min_cluster_size, score=SCORING_FUNCTIONS[args.score], max_noise_fraction=args.max_noise_fraction, prune_dominated=args.prune_dominated, workers=args.workers, use_distance_cache=args.distance_cache, superpose=args.superpose, resume=not args.restart)
+
+    filename = f"{subset_search_filepath(voxel_grid_hash, args.min_cluster_size, superpose=args.superpose)}/subset_search_{args.score}.json"
+    with open(filename, 'w') as filehandle:
+        json.dump(ranked, filehandle, indent=4)
+
+    print (f"\n{'Rank':>4} {'Positions':<20} {'Score':>8} {'Clusters':>8} {'Noise':>6} {'Max RMSD':>8}")
+    for row in ranked[:args.top]:
+        print (f"{row['rank']:>4} {row['positions'].replace('_', ', '):<20} {row['score'] if row['score'] is not None else '-':>8} {row['cluster_count']:>8} {row['noise_cluster_size']:>6} {row['max_rmsd'] if row['max_rmsd'] is not None else '-':>8}{' (dominated)' if row['dominated'] else ''}")
+
+    print (f"\nThe ranked table for {len(ranked)} subsets has been written to {filename}")
@@ -0,0 +1,33 @@
+import argparse
+
+from functions.clustering import clustering_sweep_filepath, run_clustering_sweep
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
+
+
+### Body of the script ###
+
+# the position sets clustered on in the notebook
+possible_clustering_positions = [[4,5], [4,6], [4,7], [5,6] ,[5,7], [6,7], [4,5,6], [5,6,7], [4,5,6,7], [1,2,3,4,5,6,7,8,9]]
+
+# the body is guarded so that worker processes which import this module as __main__ (e.g. on macOS) do not run it again
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster the structures of the voxel set for the grid in the config file on each of a list of position sets')
+    parser.add_argument('--workers', type=int, default=1, help='the number of processes used to cluster the position sets')
+    parser.add_argument('--min-cluster-size', type=int, default=3, help='the minimum cluster size for HDBSCAN')
+    parser.add_argument('--distance-cache', action='store_true', help='cluster on distances summed from a cache of per-position squared distances, which gives the clusters of HDBSCAN\'s generic algorithm rather than those of the notebook')
+    parser.add_argument('--superpose', action='store_true', help='superpose the members of each cluster onto its first member before the maximum RMSDs are calculated')
+    parser.add_argument('--positions', nargs='+', help='the position sets to cluster on, e.g. 4,5 4,5,6 (by default the position sets from the notebook)')
+    args = parser.parse_args()
+
+    if args.positions:
+        possible_clustering_positions = [[int(position) for position in position_set.split(',')] for position_set in args.positions]
+
+    # find the voxel set for the grid described in the config file, the clustering uses its voxel store
+    voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(load_config())
+
+    clustering_collection = run_clustering_sweep(possible_clustering_positions, voxel_set_filepath, min_cluster_size=args.min_cluster_size, workers=args.workers, use_distance_cache=args.distance_cache, superpose=args.superpose)
+
+    print (f"{len(clustering_collection['clusters'])} position sets clustered for {clustering_collection['structure_count']} structures")
+    print (f"The clustering records have been written to {clustering_sweep_filepath(voxel_grid_hash, args.min_cluster_size, superpose=args.superpose)}")
@@ -0,0 +1,40 @@
+import json
+import os
+
+from functions.helpers import load_config
+from functions.structures import stack_peptide_coordinates
+from functions.sweep import offset_lattice, sweep_grid_parameters
+
+
+config = load_config()
+
+with open("output/structure_information/all.json", 'r') as filehandle:
+    structure_info = json.load(filehandle)
+
+# parse the peptide coordinates once, every setting in the sweep reuses them
+structure_set = stack_peptide_coordinates(structure_info, config)
+
+print (f"Loaded coordinates for {len(structure_set['pdb_codes'])} structures, {len(structure_set['errors'])} errors")
+
+voxel_sizes = [0.5, 1, 1.5, 2]
+
+# sweep sub-voxel shifts around the offsets in the config file
+x_offsets = [config['offsets']['x'] + shift for shift in [0, 0.25, 0.5, 0.75]]
+y_offsets = [config['offsets']['y'] + shift for shift in [0, 0.25, 0.5, 0.75]]
+z_offsets = [config['offsets']['z'] + shift for shift in [0, 0.25, 0.5, 0.75]]
+
+results = sweep_grid_parameters(structure_set['coordinates'], config['centre_of_mass'], config['box_xyz'], voxel_sizes, offset_lattice(x_offsets, y_offsets, z_offsets), range_offset=config['range_offset'])
+
+if not os.path.exists('output/grid_sweeps'):
+    os.makedirs('output/grid_sweeps')
+
+filename = 'output/grid_sweeps/sweep.json'
+
+with open(filename, 'w') as filehandle:
+    json.dump(results, filehandle, indent=4)
+
+for result in results:
+    statistics = result['statistics']
+    print (f"{result['voxel_size']}Å {result['offsets']}: {statistics['voxels_used']} voxels used, {round(statistics['inside_fraction'] * 100, 1)}% inside, {round(statistics['boundary_fraction'] * 100, 1)}% near a boundary")
+
+print (f"The results of the sweep have been written to {filename}")
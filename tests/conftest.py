@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+# the scripts and the functions package are run from the root of the repository, so the tests import them from there
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_PATH)
+
+FIXTURES_PATH = os.path.join(REPOSITORY_PATH, 'tests', 'fixtures')
+
+# the voxel set committed for the grid in config.json, which was made by the notebook
+LEGACY_VOXEL_SET_PATH = os.path.join(REPOSITORY_PATH, 'output', 'voxel_sets', 'e91d9bdc62da8457549cfbeed4c2b0aa')
+
+
+@pytest.fixture
+def repository_config():
+    with open(os.path.join(REPOSITORY_PATH, 'config.json'), 'r') as filehandle:
+        return json.load(filehandle)
+
+
+@pytest.fixture
+def structures_directory(tmp_path, monkeypatch):
+    # the peptide structures are read from structures/ in the working directory, so the fixture structures are copied there
+    shutil.copytree(os.path.join(FIXTURES_PATH, 'structures'), tmp_path / 'structures')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / 'structures'
+
+
+@pytest.fixture
+def legacy_voxel_set_path():
+    return LEGACY_VOXEL_SET_PATH
+
+
+@pytest.fixture
+def repository_directory(monkeypatch):
+    # the committed registry and voxel sets are found by paths relative to the root of the repository
+    monkeypatch.chdir(REPOSITORY_PATH)
+    return REPOSITORY_PATH
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+hdbscan = pytest.importorskip('hdbscan')
+
+from functions.clustering import cluster_position_set, position_distance_cache, position_set_features, voxel_xyz_features
+
+
+SHAPE = (37, 21, 21)
+
+
+@pytest.fixture
+def structures():
+    # voxels drawn from a few per-position neighbourhoods, so that many structures share identical voxels, as the real ones do
+    rng = np.random.default_rng(21)
+    centres = rng.integers(5, 15, size=(3, 9, 3))
+    xyz = centres[rng.integers(0, 3, size=60)] + rng.integers(0, 2, size=(60, 9, 3))
+    voxel_indices = xyz[..., 0] + SHAPE[0] * (xyz[..., 1] + SHAPE[1] * xyz[..., 2])
+    features = voxel_xyz_features(voxel_indices, SHAPE)
+    coordinates = xyz + rng.random((60, 9, 3))
+    structure_labels = [f'{row:04d}' for row in range(60)]
+    return features, coordinates, structure_labels
+
+
+def cluster_labels(record, structure_labels):
+    labels = dict.fromkeys(structure_labels, -1)
+    for cluster_number, members in record['clusters'].items():
+        for pdb_code in members:
+            labels[pdb_code] = int(cluster_number) - 1
+    return [labels[pdb_code] for pdb_code in structure_labels]
+
+
+@pytest.mark.parametrize('clustering_positions', [[4, 7], [5, 7], [1, 2, 3, 4, 5, 6, 7, 8, 9]])
+def test_features_path_uses_the_default_algorithm(structures, clustering_positions):
+    features, coordinates, structure_labels = structures
+
+    record = cluster_position_set(features, coordinates, structure_labels, clustering_positions, 3)
+
+    expected = hdbscan.HDBSCAN(min_cluster_size=3).fit(position_set_features(features, clustering_positions)).labels_
+    assert cluster_labels(record, structure_labels) == expected.tolist()
+
+
+@pytest.mark.parametrize('clustering_positions', [[4, 7], [5, 7], [1, 2, 3, 4, 5, 6, 7, 8, 9]])
+def test_distance_cache_path_matches_the_generic_algorithm(structures, clustering_positions):
+    features, coordinates, structure_labels = structures
+
+    record = cluster_position_set(features, coordinates, structure_labels, clustering_positions, 3, distance_cache=position_distance_cache(features))
+
+    expected = hdbscan.HDBSCAN(min_cluster_size=3, algorithm='generic').fit(position_set_features(features, clustering_positions)).labels_
+    assert cluster_labels(record, structure_labels) == expected.tolist()
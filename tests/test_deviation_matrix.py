@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from functions.deviation_matrix import DeviationMatrix, write_deviation_matrix
+from functions.voxel_store import load_voxel_store
+
+
+@pytest.fixture
+def coordinates(legacy_voxel_set_path):
+    # the committed coordinates, with a few positions missing so that some pairs have fewer positions in common
+    coordinates = np.round(load_voxel_store(legacy_voxel_set_path)['coordinates'].astype(float), 3)
+    coordinates[::9, 0] = np.nan
+    coordinates[4::13, 8] = np.nan
+    return coordinates
+
+
+def dense_deviations(coordinates):
+    """
+    Calculates the full (structures, structures) per-position and whole-peptide deviations at once, the way calculate_max_rmsd does for one pair at a time, and condenses them.
+    """
+    squared_differences = (coordinates[:, np.newaxis] - coordinates[np.newaxis, :]) ** 2
+    positions = np.sqrt(squared_differences.mean(axis=-1))
+    whole_peptide = np.sqrt(np.nanmean(squared_differences.reshape(len(coordinates), len(coordinates), -1), axis=-1))
+    rows, columns = np.triu_indices(len(coordinates), k=1)
+    return positions[rows, columns].T, whole_peptide[rows, columns]
+
+
+def write_and_load(coordinates, deviations_filepath, memory_budget):
+    pdb_codes = [f'{row:04d}' for row in range(len(coordinates))]
+    return DeviationMatrix(write_deviation_matrix(coordinates, pdb_codes, str(deviations_filepath), memory_budget=memory_budget))
+
+
+@pytest.mark.parametrize('memory_budget', [1, 64 * 1024, 256 * 1024 * 1024])
+def test_blocked_matrix_matches_the_dense_matrix(coordinates, tmp_path, memory_budget):
+    coordinates = coordinates[:120]
+
+    deviations = write_and_load(coordinates, tmp_path, memory_budget)
+
+    expected_positions, expected_whole_peptide = dense_deviations(coordinates)
+    assert np.allclose(deviations.positions, expected_positions, equal_nan=True, rtol=1e-6)
+    assert np.allclose(deviations.whole_peptide, expected_whole_peptide, equal_nan=True, rtol=1e-6)
+
+
+def test_matrix_matches_pdist(coordinates, tmp_path):
+    distance = pytest.importorskip('scipy.spatial.distance')
+    complete = coordinates[~np.isnan(coordinates).any(axis=(1, 2))]
+
+    deviations = write_and_load(complete, tmp_path, 64 * 1024)
+
+    # the deviation at a position is the euclidean distance scaled by the root of the three axes, and over the whole peptide by the root of all of the coordinates
+    for position in range(complete.shape[1]):
+        assert np.allclose(deviations.condensed(position + 1), distance.pdist(complete[:, position]) / np.sqrt(3), rtol=1e-6)
+    assert np.allclose(deviations.condensed(), distance.pdist(complete.reshape(len(complete), -1)) / np.sqrt(complete.shape[1] * 3), rtol=1e-6)
+
+
+def test_queries_read_the_right_pairs(coordinates, tmp_path):
+    coordinates = coordinates[:60]
+    deviations = write_and_load(coordinates, tmp_path, 64 * 1024)
+    squared_differences = (coordinates[:, np.newaxis] - coordinates[np.newaxis, :]) ** 2
+    dense_whole_peptide = np.sqrt(np.nanmean(squared_differences.reshape(60, 60, -1), axis=-1))
+
+    assert np.allclose(deviations.row('0007'), dense_whole_peptide[7], rtol=1e-6)
+    assert deviations.deviation('0031', '0005', position=2) == pytest.approx(np.sqrt(squared_differences[5, 31, 1].mean()), rel=1e-6)
+    members = ['0040', '0002', '0017', '0033']
+    rows = [40, 2, 17, 33]
+    assert deviations.cluster_diameter(members) == pytest.approx(dense_whole_peptide[np.ix_(rows, rows)].max(), rel=1e-6)
+    neighbours = deviations.nearest_neighbours('0010', k=3)
+    others = np.delete(np.arange(60), 10)
+    assert [pdb_code for pdb_code, deviation in neighbours] == [f'{row:04d}' for row in others[np.argsort(dense_whole_peptide[10, others], kind='stable')[:3]]]
+
+
+@pytest.mark.parametrize('structure_count', [0, 1])
+def test_fewer_than_two_structures_have_no_pairs(coordinates, tmp_path, structure_count):
+    deviations = write_and_load(coordinates[:structure_count], tmp_path, 64 * 1024)
+
+    assert deviations.whole_peptide.shape == (0,)
+    assert deviations.positions.shape == (coordinates.shape[1], 0)
+    assert deviations.metadata['pair_count'] == 0
+    if structure_count == 1:
+        assert deviations.row('0000').tolist() == [0.0]
+        assert deviations.nearest_neighbours('0000') == []
+        assert deviations.cluster_diameter(['0000']) is None
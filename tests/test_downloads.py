@@ -0,0 +1,125 @@
+import hashlib
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from functions import downloads
+from functions.downloads import download_structures, load_manifest, refresh_structures
+
+
+# the files served by the stand-in server, keyed by path, and the ETag of each, which changes with its content
+SERVED_FILES = {}
+
+
+def serve(path:str, content:bytes):
+    SERVED_FILES[path] = {'content': content, 'etag': f'"{hashlib.sha256(content).hexdigest()[:16]}"'}
+
+
+class StructureHandler(BaseHTTPRequestHandler):
+    """
+    Serves SERVED_FILES, answering 304 when If-None-Match matches the ETag of a file.
+    """
+    def do_GET(self):
+        served = SERVED_FILES.get(self.path)
+        if served is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == served['etag']:
+            self.send_response(304)
+            self.send_header('ETag', served['etag'])
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', served['etag'])
+        self.send_header('Content-Length', str(len(served['content'])))
+        self.end_headers()
+        self.wfile.write(served['content'])
+
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    # the downloads are written to structures/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    SERVED_FILES.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StructureHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield {'base_url': f"http://127.0.0.1:{server.server_port}"}
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_records_manifest_entries(config):
+    serve('/1abc_1_peptide.pdb', b'ATOM      1  CA  GLY C   1\n')
+
+    results = download_structures(['1abc', '2xyz'], config, concurrency=2, retries=0)
+
+    assert results['downloaded'] == ['1abc']
+    assert '2xyz' in results['errors']
+    manifest = load_manifest()
+    assert list(manifest) == ['structures/1abc_peptide.pdb']
+    assert manifest['structures/1abc_peptide.pdb']['etag'] == SERVED_FILES['/1abc_1_peptide.pdb']['etag']
+    assert manifest['structures/1abc_peptide.pdb']['checksum'] == hashlib.sha256(b'ATOM      1  CA  GLY C   1\n').hexdigest()
+
+
+def test_refresh_after_download_is_not_modified(config):
+    serve('/1abc_1_peptide.pdb', b'ATOM      1  CA  GLY C   1\n')
+    download_structures(['1abc'], config, retries=0)
+
+    results = refresh_structures(['1abc'], config, retries=0)
+
+    assert results['unchanged'] == ['1abc']
+    assert results['updated'] == []
+
+
+def test_refresh_transfers_changed_files(config):
+    serve('/1abc_1_peptide.pdb', b'ATOM      1  CA  GLY C   1\n')
+    download_structures(['1abc'], config, retries=0)
+    serve('/1abc_1_peptide.pdb', b'ATOM      1  CA  ALA C   1\n')
+
+    results = refresh_structures(['1abc'], config, retries=0)
+
+    assert results['updated'] == ['1abc']
+    with open('structures/1abc_peptide.pdb', 'rb') as filehandle:
+        assert filehandle.read() == b'ATOM      1  CA  ALA C   1\n'
+    assert load_manifest()['structures/1abc_peptide.pdb']['etag'] == SERVED_FILES['/1abc_1_peptide.pdb']['etag']
+
+
+def test_refresh_replaces_files_which_do_not_match_their_checksum(config):
+    serve('/1abc_1_peptide.pdb', b'ATOM      1  CA  GLY C   1\n')
+    download_structures(['1abc'], config, retries=0)
+    # a local edit means the validators no longer describe the file, so the request is not conditional
+    with open('structures/1abc_peptide.pdb', 'wb') as filehandle:
+        filehandle.write(b'corrupted\n')
+
+    results = refresh_structures(['1abc'], config, retries=0)
+
+    assert results['updated'] == ['1abc']
+    with open('structures/1abc_peptide.pdb', 'rb') as filehandle:
+        assert filehandle.read() == b'ATOM      1  CA  GLY C   1\n'
+
+
+def test_refresh_saves_the_manifest_as_it_goes(config, monkeypatch):
+    for pdb_code in ['1abc', '2abc', '3abc']:
+        serve(f'/{pdb_code}_1_peptide.pdb', f'ATOM {pdb_code}\n'.encode())
+    monkeypatch.setattr(downloads, 'MANIFEST_SAVE_INTERVAL', 1)
+
+    saved_manifests = []
+    save_manifest = downloads.save_manifest
+    def recording_save_manifest(manifest, manifest_filename):
+        save_manifest(manifest, manifest_filename)
+        with open(manifest_filename, 'r') as filehandle:
+            saved_manifests.append(json.load(filehandle))
+    monkeypatch.setattr(downloads, 'save_manifest', recording_save_manifest)
+
+    refresh_structures(['1abc', '2abc', '3abc'], config, concurrency=1, retries=0)
+
+    assert [len(manifest) for manifest in saved_manifests] == [1, 2, 3]
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from functions.occupancy import PositionOccupancy
+from functions.pipeline import aggregate_voxel_usage, write_voxel_usage
+from functions.registry import voxel_grid_from_config
+from functions.voxel_store import load_voxel_store, store_structure_voxels
+
+
+@pytest.fixture
+def voxel_grid(repository_config):
+    return voxel_grid_from_config(repository_config)
+
+
+@pytest.fixture
+def legacy_voxel_store(legacy_voxel_set_path):
+    return load_voxel_store(legacy_voxel_set_path)
+
+
+def read_text(filename):
+    with open(filename, 'r') as filehandle:
+        return filehandle.read()
+
+
+def test_occupancy_writes_the_committed_voxel_usage(legacy_voxel_store, legacy_voxel_set_path, voxel_grid, tmp_path):
+    occupancy = PositionOccupancy.from_voxel_store(legacy_voxel_store, voxel_grid)
+
+    write_voxel_usage(occupancy.to_used_voxel_set(), occupancy.to_position_voxel_set(), str(tmp_path))
+
+    for filename in ['used_voxels.json', 'position_voxels.json']:
+        assert read_text(tmp_path / filename) == read_text(os.path.join(legacy_voxel_set_path, filename))
+
+
+def test_occupancy_matches_the_streamed_aggregation(legacy_voxel_store, voxel_grid):
+    # positions are knocked out of some structures, so that voxels are first occupied in a different order
+    voxel_indices = np.array(legacy_voxel_store['voxel_indices'])
+    voxel_indices[::7, 0] = -1
+    voxel_indices[3::11, 4] = -1
+    voxel_store = dict(legacy_voxel_store, voxel_indices=voxel_indices)
+
+    occupancy = PositionOccupancy.from_voxel_store(voxel_store, voxel_grid)
+    used_voxel_set, position_voxel_set = aggregate_voxel_usage(store_structure_voxels(voxel_store, voxel_grid))
+
+    assert occupancy.to_used_voxel_set() == used_voxel_set
+    assert json.dumps(occupancy.to_position_voxel_set()) == json.dumps(position_voxel_set)
+
+
+def test_members_and_counts_agree_with_the_committed_position_voxels(legacy_voxel_store, legacy_voxel_set_path, voxel_grid):
+    occupancy = PositionOccupancy.from_voxel_store(legacy_voxel_store, voxel_grid)
+    with open(os.path.join(legacy_voxel_set_path, 'position_voxels.json'), 'r') as filehandle:
+        position_voxel_set = json.load(filehandle)
+
+    for position, voxels in position_voxel_set.items():
+        for voxel_label, voxel in voxels.items():
+            assert occupancy.members(int(position), voxel_label) == voxel['members']
+            assert occupancy.counts[int(position) - 1, voxel_grid.label_to_index(voxel_label)] == voxel['count']
+    assert occupancy.occupied_voxel_count().tolist() == [len(position_voxel_set[str(position)]) for position in range(1, 10)]
+
+
+def test_top_voxels_are_the_most_occupied(legacy_voxel_store, voxel_grid):
+    occupancy = PositionOccupancy.from_voxel_store(legacy_voxel_store, voxel_grid)
+
+    top_indices, top_counts = occupancy.top_voxels(5)
+    modal_indices, modal_counts = occupancy.modal_voxels()
+
+    assert np.array_equal(top_indices[:, 0], modal_indices)
+    assert np.array_equal(top_counts[:, 0], modal_counts)
+    for position in range(occupancy.peptide_length):
+        # ties are broken by the lowest voxel index, as a stable sort of the counts would
+        expected = np.argsort(-occupancy.counts[position], kind='stable')[:5]
+        assert top_indices[position].tolist() == expected.tolist()
+
+
+def test_a_subset_of_structures_keeps_their_order(legacy_voxel_store, voxel_grid):
+    pdb_codes = legacy_voxel_store['pdb_codes'].tolist()[::-5]
+
+    occupancy = PositionOccupancy.from_voxel_store(legacy_voxel_store, voxel_grid, pdb_codes=pdb_codes)
+
+    assert list(occupancy.to_used_voxel_set()) == pdb_codes
+    assert occupancy.counts.sum() == np.count_nonzero(np.asarray(occupancy.voxel_indices) >= 0)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from functions.pdb import first_atom_per_residue, parse_pdb_atoms, read_pdb_atoms
+
+
+# a peptide with an alternate location for residue 2, a modified residue and a water as HETATM records, and no residue 4
+PEPTIDE_TEXT = """\
+ATOM      1  N   LEU C   1     -52.379  61.256  63.616  1.00 20.00           N  
+ATOM      2  CA  LEU C   1     -51.179  60.956  63.616  1.00 20.00           C  
+ATOM      3  N  ALEU C   2     -48.568  61.517  63.207  0.60 20.00           N  
+ATOM      4  CA ALEU C   2     -47.368  61.217  63.207  0.60 20.00           C  
+ATOM      5  N  BLEU C   2     -48.468  61.417  63.107  0.40 20.00           N  
+ATOM      6  CA BLEU C   2     -47.268  61.117  63.107  0.40 20.00           C  
+HETATM    7  N   MSE C   3     -46.063  62.400  64.100  1.00 20.00           N  
+HETATM    8  CA  MSE C   3     -44.863  62.100  64.100  1.00 20.00           C  
+ATOM      9  N   VAL C   5     -42.641  66.593  65.163  1.00 20.00           N  
+ATOM     10  CA  VAL C   5     -41.441  66.293  65.163  1.00 20.00           C  
+ATOM     11  CA  VAL C   5     -41.441  66.293  65.163              
+TER      12      VAL C   5
+HETATM   13  O   HOH C 101     -30.000  50.000  60.000  1.00 30.00           O  
+END
+"""
+
+
+def test_alternate_locations_keep_the_first_atom_of_each_residue():
+    atoms = parse_pdb_atoms(PEPTIDE_TEXT)
+
+    coordinates, sequence = first_atom_per_residue(atoms)
+
+    assert coordinates == [(-51.179, 60.956, 63.616), (-47.368, 61.217, 63.207), (-41.441, 66.293, 65.163)]
+    assert sequence == ['LEU', 'LEU', 'VAL']
+    assert atoms['alt_loc'].tolist() == ['', '', 'A', 'A', 'B', 'B', '', '', '']
+
+
+def test_hetatm_records_are_only_read_when_asked_for():
+    atoms = parse_pdb_atoms(PEPTIDE_TEXT, record_names=('ATOM', 'HETATM'))
+
+    coordinates, sequence = first_atom_per_residue(atoms)
+
+    assert sequence == ['LEU', 'LEU', 'MSE', 'VAL']
+    assert atoms['residue_name'].tolist()[-1] == 'HOH'
+    assert atoms['atom_name'].tolist()[-1] == 'O'
+    # the water has no alpha carbon, so it is not a residue of the peptide
+    assert len(coordinates) == 4
+
+
+def test_missing_residues_are_not_filled_in():
+    atoms = parse_pdb_atoms(PEPTIDE_TEXT, atom_names=['CA'], record_names=('ATOM', 'HETATM'))
+
+    assert atoms['residue_number'].tolist() == [1, 2, 2, 3, 5, 5]
+    assert atoms['atom_name'].tolist() == ['CA'] * 6
+
+
+def test_blank_columns_are_given_defaults():
+    atoms = parse_pdb_atoms(PEPTIDE_TEXT, atom_names=['CA'])
+
+    # the last alpha carbon has no occupancy, b factor or element
+    assert atoms['occupancy'][-1] == 1.0
+    assert atoms['b_factor'][-1] == 0.0
+    assert atoms['element_symbol'][-1] == 'C'
+
+
+def assert_first_atoms_match_biopandas(filename:str):
+    PandasPdb = pytest.importorskip('biopandas.pdb').PandasPdb
+
+    coordinates, sequence = first_atom_per_residue(read_pdb_atoms(filename))
+
+    # the first alpha carbon of each residue of the ATOM records, as the notebook selected them
+    atom_df = PandasPdb().read_pdb(filename).df['ATOM']
+    alpha_carbons = atom_df[atom_df['atom_name'] == 'CA'].drop_duplicates(subset='residue_number', keep='first')
+    assert np.array_equal(np.array(coordinates), alpha_carbons[['x_coord', 'y_coord', 'z_coord']].values)
+    assert sequence == alpha_carbons['residue_name'].tolist()
+
+
+def test_first_atom_per_residue_matches_biopandas_for_a_fixture_structure(structures_directory):
+    assert_first_atoms_match_biopandas(str(structures_directory / '1hhk_peptide.pdb'))
+
+
+def test_first_atom_per_residue_matches_biopandas_with_alternate_locations(tmp_path):
+    filename = tmp_path / 'peptide.pdb'
+    filename.write_text(PEPTIDE_TEXT)
+
+    assert_first_atoms_match_biopandas(str(filename))
@@ -0,0 +1,117 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from functions.pipeline import load_voxel_usage, run_incremental_voxel_pipeline, run_voxel_pipeline, voxelize_structures_in_parallel, voxelize_structures_serially
+from functions.registry import voxel_grid_from_config
+from functions.voxel_store import STORE_ARRAYS, load_voxel_store
+
+
+FIXTURE_PDB_CODES = ['1hhk', '1a1m', '1a1o', '1a9b']
+
+
+@pytest.fixture
+def pdb_codes(structures_directory):
+    # a structure with an unreadable coordinate fails in the middle of the run
+    with open(structures_directory / '9bad_peptide.pdb', 'w') as filehandle:
+        filehandle.write('ATOM      1  CA  GLY C   1     -51.179  xx.xxx  63.616  1.00 20.00           C  \n')
+    return FIXTURE_PDB_CODES[:2] + ['9bad'] + FIXTURE_PDB_CODES[2:]
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 8])
+def test_parallel_voxelization_matches_serial(pdb_codes, repository_config, batch_size):
+    voxel_grid = voxel_grid_from_config(repository_config)
+
+    serial_errors = []
+    serial = list(voxelize_structures_serially(pdb_codes, voxel_grid, repository_config, errors=serial_errors))
+    parallel_errors = []
+    parallel = list(voxelize_structures_in_parallel(pdb_codes, voxel_grid, repository_config, workers=2, errors=parallel_errors, batch_size=batch_size))
+
+    assert [pdb_code for pdb_code, structure_voxels in serial] == FIXTURE_PDB_CODES
+    assert parallel == serial
+    assert [pdb_code for pdb_code, error in serial_errors] == ['9bad']
+    assert parallel_errors == serial_errors
+
+
+def test_voxelization_matches_the_committed_voxel_set(pdb_codes, repository_config, legacy_voxel_set_path):
+    voxel_grid = voxel_grid_from_config(repository_config)
+
+    voxelized = dict(voxelize_structures_serially(pdb_codes, voxel_grid, repository_config))
+
+    # the fixture structures were made from the alpha carbons of the committed voxel set, so they fall in the same voxels
+    for pdb_code in FIXTURE_PDB_CODES:
+        with open(os.path.join(legacy_voxel_set_path, f'{pdb_code}.json'), 'r') as filehandle:
+            committed = json.load(filehandle)['structure_voxels']
+        # the voxels are compared as they are written, where the coordinates are lists
+        assert json.loads(json.dumps(voxelized[pdb_code])) == committed
+
+
+def read_voxel_set(voxel_set_filepath):
+    voxel_store = load_voxel_store(voxel_set_filepath, mmap=False)
+    used_voxel_set, position_voxel_set = load_voxel_usage(voxel_set_filepath)
+    return voxel_store, used_voxel_set, position_voxel_set
+
+
+def assert_voxel_sets_equal(voxel_set_filepath, expected_filepath):
+    voxel_store, used_voxel_set, position_voxel_set = read_voxel_set(voxel_set_filepath)
+    expected_store, expected_used_voxel_set, expected_position_voxel_set = read_voxel_set(expected_filepath)
+
+    for name in STORE_ARRAYS:
+        assert np.array_equal(voxel_store[name], expected_store[name], equal_nan=name == 'coordinates')
+    assert voxel_store['metadata']['structure_count'] == expected_store['metadata']['structure_count']
+    assert used_voxel_set == expected_used_voxel_set
+    # the incremental usage appends new members, so only the members, not their order, have to match
+    assert list(position_voxel_set) == list(expected_position_voxel_set)
+    for position, voxels in expected_position_voxel_set.items():
+        assert sorted(position_voxel_set[position]) == sorted(voxels)
+        for voxel_label, voxel in voxels.items():
+            assert position_voxel_set[position][voxel_label]['count'] == voxel['count']
+            assert sorted(position_voxel_set[position][voxel_label]['members']) == sorted(voxel['members'])
+
+
+def test_incremental_update_matches_a_full_rebuild(structures_directory, repository_config):
+    voxel_grid = voxel_grid_from_config(repository_config)
+    voxel_set_filepath = str(structures_directory.parent / 'incremental' / 'e91d9bdc62da8457549cfbeed4c2b0aa')
+    expected_filepath = str(structures_directory.parent / 'full' / 'e91d9bdc62da8457549cfbeed4c2b0aa')
+
+    first_counts = run_incremental_voxel_pipeline(['1hhk', '1a1m', '1a1o'], voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+    # one structure is removed and another added, so the voxels of both have to be updated
+    counts = run_incremental_voxel_pipeline(['1a1m', '1a1o', '1a9b'], voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+    run_voxel_pipeline(['1a1m', '1a1o', '1a9b'], voxel_grid, repository_config, expected_filepath, verbose=False)
+
+    assert first_counts['added'] == 3
+    assert (counts['added'], counts['removed'], counts['unchanged']) == (1, 1, 2)
+    assert_voxel_sets_equal(voxel_set_filepath, expected_filepath)
+    assert sorted(os.listdir(voxel_set_filepath)) == sorted(os.listdir(expected_filepath))
+
+
+def test_adding_structures_at_the_end_gives_the_same_files_as_a_full_rebuild(structures_directory, repository_config):
+    voxel_grid = voxel_grid_from_config(repository_config)
+    voxel_set_filepath = str(structures_directory.parent / 'incremental' / 'e91d9bdc62da8457549cfbeed4c2b0aa')
+    expected_filepath = str(structures_directory.parent / 'full' / 'e91d9bdc62da8457549cfbeed4c2b0aa')
+
+    run_voxel_pipeline(FIXTURE_PDB_CODES[:2], voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+    counts = run_incremental_voxel_pipeline(FIXTURE_PDB_CODES, voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+    run_voxel_pipeline(FIXTURE_PDB_CODES, voxel_grid, repository_config, expected_filepath, verbose=False)
+
+    assert (counts['added'], counts['removed'], counts['unchanged']) == (2, 0, 2)
+    for filename in ['used_voxels.json', 'position_voxels.json'] + [f'{pdb_code}.json' for pdb_code in FIXTURE_PDB_CODES]:
+        with open(os.path.join(voxel_set_filepath, filename), 'r') as filehandle, open(os.path.join(expected_filepath, filename), 'r') as expected_filehandle:
+            assert filehandle.read() == expected_filehandle.read()
+    assert_voxel_sets_equal(voxel_set_filepath, expected_filepath)
+
+
+def test_unchanged_structures_are_not_voxelized_again(structures_directory, repository_config):
+    voxel_grid = voxel_grid_from_config(repository_config)
+    voxel_set_filepath = str(structures_directory.parent / 'incremental' / 'e91d9bdc62da8457549cfbeed4c2b0aa')
+    run_voxel_pipeline(FIXTURE_PDB_CODES, voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+    # the structure files are no longer needed once the structures are in the voxel set
+    for pdb_code in FIXTURE_PDB_CODES:
+        os.remove(structures_directory / f'{pdb_code}_peptide.pdb')
+
+    counts = run_incremental_voxel_pipeline(FIXTURE_PDB_CODES[1:], voxel_grid, repository_config, voxel_set_filepath, verbose=False)
+
+    assert (counts['added'], counts['removed'], counts['unchanged'], counts['errors']) == (0, 1, 3, 0)
+    assert read_voxel_set(voxel_set_filepath)[0]['pdb_codes'].tolist() == FIXTURE_PDB_CODES[1:]
@@ -0,0 +1,47 @@
+import json
+
+from functions.registry import load_registry, resolve_voxel_set, voxel_grid_from_config, voxel_grid_from_descriptor
+from functions.voxels import create_voxel_grid
+
+
+LEGACY_DIGEST = '0bf10eb7d54cbd4dffd110576f39a7e4'
+
+
+def test_descriptor_round_trips_to_the_same_digest():
+    voxel_grid = create_voxel_grid([-42.365, 56.031, 63.670], [36, 20, 20], 1, range_offset=1, x_offset=-3, y_offset=8, z_offset=2)
+
+    rebuilt = voxel_grid_from_descriptor(json.loads(json.dumps(voxel_grid.descriptor)))
+
+    assert rebuilt.digest == voxel_grid.digest
+    assert rebuilt.descriptor == voxel_grid.descriptor
+
+
+def test_descriptor_offsets_take_precedence_over_params():
+    voxel_grid = create_voxel_grid([-42.365, 56.031, 63.670], [36, 20, 20], 1, y_offset=8)
+
+    rebuilt = voxel_grid_from_descriptor(voxel_grid.descriptor, params={'y_offset': 0})
+
+    assert rebuilt.digest == voxel_grid.digest
+
+
+def test_committed_config_has_the_registered_digest(repository_config):
+    voxel_grid = voxel_grid_from_config(repository_config)
+
+    assert voxel_grid.digest == LEGACY_DIGEST
+
+
+def test_committed_registry_descriptor_round_trips(repository_config, repository_directory):
+    entry = load_registry()[LEGACY_DIGEST]
+
+    rebuilt = voxel_grid_from_descriptor(entry['descriptor'], params=entry['params'])
+
+    assert rebuilt.digest == LEGACY_DIGEST
+    assert rebuilt.descriptor == voxel_grid_from_config(repository_config).descriptor
+
+
+def test_committed_config_resolves_to_the_legacy_voxel_set(repository_config, repository_directory):
+
+    voxel_set_filepath, voxel_grid_hash = resolve_voxel_set(repository_config)
+
+    assert voxel_set_filepath == 'output/voxel_sets/e91d9bdc62da8457549cfbeed4c2b0aa'
+    assert voxel_grid_hash == 'e91d9bdc62da8457549cfbeed4c2b0aa'
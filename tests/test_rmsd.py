@@ -0,0 +1,155 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+from functions import structures
+from functions.rmsd import cluster_max_rmsds, max_rmsds_for_clusters, position_deviations, superpose_pairs
+from functions.voxel_store import load_voxel_store
+
+
+@pytest.fixture
+def legacy_voxel_store(legacy_voxel_set_path):
+    return load_voxel_store(legacy_voxel_set_path)
+
+
+@pytest.fixture
+def legacy_coordinates(legacy_voxel_store):
+    # the store holds float32 coordinates, which are rounded back to the three decimal places of the PDB format
+    return np.round(legacy_voxel_store['coordinates'].astype(float), 3)
+
+
+@pytest.fixture
+def legacy_records(legacy_voxel_set_path):
+    # the clustering records written by the notebook for the committed voxel set
+    voxel_grid_hash = os.path.basename(legacy_voxel_set_path)
+    records = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(legacy_voxel_set_path)), 'clusters', voxel_grid_hash, 'cluster_size_3', 'clustering_*.json'))):
+        with open(filename, 'r') as filehandle:
+            records.append(json.load(filehandle))
+    assert records
+    return records
+
+
+@pytest.fixture
+def legacy_mean_squared_error(monkeypatch):
+    # calculate_max_rmsd uses mean_squared_error(squared=False), which newer versions of scikit-learn replace with root_mean_squared_error
+    metrics = pytest.importorskip('sklearn.metrics')
+    try:
+        metrics.mean_squared_error([0.0], [1.0], squared=False)
+    except TypeError:
+        def mean_squared_error(y_true, y_pred, squared=True):
+            if squared:
+                return metrics.mean_squared_error(y_true, y_pred)
+            return metrics.root_mean_squared_error(y_true, y_pred)
+        monkeypatch.setattr(structures, 'mean_squared_error', mean_squared_error, raising=False)
+
+
+def test_max_rmsds_match_the_committed_records(legacy_records, legacy_voxel_store, legacy_coordinates):
+    pdb_codes = legacy_voxel_store['pdb_codes'].tolist()
+    for record in legacy_records:
+        max_rmsds = max_rmsds_for_clusters(dict(record['clusters'], noise=record['noise_cluster']), pdb_codes, legacy_coordinates)
+
+        assert [max_rmsds[cluster_number] for cluster_number in record['clusters']] == record['cluster_max_rmsds']
+        assert max_rmsds['noise'] == record['noise_cluster_max_rmsd']
+
+
+def test_cluster_max_rmsds_match_the_committed_records(legacy_records, legacy_voxel_store, legacy_coordinates):
+    rows = {pdb_code: row for row, pdb_code in enumerate(legacy_voxel_store['pdb_codes'].tolist())}
+    for record in legacy_records:
+        # the records list the members of each cluster in store order, so the labels put the same member first
+        cluster_labels = np.full(len(rows), -1)
+        for cluster_number, members in record['clusters'].items():
+            cluster_labels[[rows[pdb_code] for pdb_code in members]] = int(cluster_number) - 1
+
+        max_rmsds, max_overall_rmsds = cluster_max_rmsds(legacy_coordinates, cluster_labels)
+
+        assert [max_rmsds[int(cluster_number) - 1] for cluster_number in record['clusters']] == record['cluster_max_rmsds']
+        assert max_rmsds[-1] == record['noise_cluster_max_rmsd']
+
+
+def test_max_rmsds_match_calculate_max_rmsd(legacy_mean_squared_error, legacy_records, legacy_voxel_set_path, legacy_voxel_store, legacy_coordinates):
+    pdb_codes = legacy_voxel_store['pdb_codes'].tolist()
+    record = legacy_records[0]
+    structure_voxel_collection = {}
+    for pdb_code in pdb_codes:
+        with open(os.path.join(legacy_voxel_set_path, f'{pdb_code}.json'), 'r') as filehandle:
+            structure_voxel_collection[pdb_code] = json.load(filehandle)['structure_voxels']
+
+    max_rmsds = max_rmsds_for_clusters(record['clusters'], pdb_codes, legacy_coordinates)
+
+    for cluster_number, members in record['clusters'].items():
+        assert max_rmsds[cluster_number] == pytest.approx(structures.calculate_max_rmsd_for_cluster(members, structure_voxel_collection), abs=1e-12)
+
+
+def random_rotation(rng) -> np.ndarray:
+    # the Q of a QR decomposition is orthogonal, and its determinant is made positive so that it is a rotation rather than a reflection
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+    return q
+
+
+def test_rotated_and_translated_copies_superpose_onto_the_original(legacy_coordinates):
+    rng = np.random.default_rng(25)
+    references = legacy_coordinates[:20]
+    moved = np.stack([peptide @ random_rotation(rng).T + rng.normal(scale=20, size=3) for peptide in references])
+
+    superposed = superpose_pairs(moved, references)
+
+    assert np.allclose(superposed, references, atol=1e-9)
+    # without superposition the copies are far from the originals
+    assert np.nanmin(position_deviations(np.concatenate([references, moved]), np.arange(20), np.arange(20, 40))) > 0.1
+
+
+def test_superposed_deviations_of_moved_copies_are_zero(legacy_coordinates):
+    rng = np.random.default_rng(26)
+    coordinates = np.concatenate([legacy_coordinates[:1], legacy_coordinates[:1] @ random_rotation(rng).T + [5.0, -3.0, 12.0]])
+
+    deviations = position_deviations(coordinates, [0], [1], superpose=True)
+
+    assert np.allclose(deviations, 0, atol=1e-9)
+
+
+def test_missing_positions_are_left_out_of_the_alignment(legacy_coordinates):
+    rng = np.random.default_rng(27)
+    references = legacy_coordinates[:2].copy()
+    moved = np.stack([peptide @ random_rotation(rng).T + [1.0, 2.0, 3.0] for peptide in references])
+    # a missing position in either peptide of the pair
+    references[0, 8] = np.nan
+    moved[1, 0] = np.nan
+
+    superposed = superpose_pairs(moved, references)
+
+    assert np.isnan(superposed[0, 8]).all() and np.isnan(superposed[1, 0]).all()
+    assert np.allclose(superposed[0, :8], references[0, :8], atol=1e-9)
+    assert np.allclose(superposed[1, 1:], references[1, 1:], atol=1e-9)
+
+
+def test_mirror_images_are_not_superposed_by_a_reflection(legacy_coordinates):
+    references = legacy_coordinates[:1]
+    mirrored = references * [-1.0, 1.0, 1.0]
+
+    superposed = superpose_pairs(mirrored, references)
+
+    assert np.nanmax(np.abs(superposed - references)) > 0.1
+
+
+def test_superposed_cluster_max_rmsds_of_moved_copies_are_zero(legacy_coordinates):
+    rng = np.random.default_rng(28)
+    # each cluster is a structure and two moved copies of it, and the noise is two unrelated structures
+    coordinates = np.concatenate([np.stack([peptide] + [peptide @ random_rotation(rng).T + rng.normal(scale=5, size=3) for copy in range(2)]) for peptide in legacy_coordinates[:3]] + [legacy_coordinates[3:5]])
+    cluster_labels = np.array([0, 0, 0, 1, 1, 1, 2, 2, 2, -1, -1])
+
+    max_rmsds, max_overall_rmsds = cluster_max_rmsds(coordinates, cluster_labels, superpose=True)
+    unsuperposed_max_rmsds, _ = cluster_max_rmsds(coordinates, cluster_labels)
+
+    for cluster_label in [0, 1, 2]:
+        assert max_rmsds[cluster_label] == pytest.approx(0, abs=1e-9)
+        assert max_overall_rmsds[cluster_label] == pytest.approx(0, abs=1e-9)
+        assert unsuperposed_max_rmsds[cluster_label] > 0.1
+    assert max_rmsds[-1] > 0.1
+    assert max_overall_rmsds[-1] <= max_rmsds[-1]
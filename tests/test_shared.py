@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from functions.shared import SharedDataset, attach_shared_dataset, detach_shared_dataset, share_voxel_store
+from functions.voxel_store import STORE_ARRAYS, load_voxel_store
+
+
+def copy_attached_arrays(handle):
+    # runs in a worker process, and copies the arrays out before the blocks are detached
+    dataset = attach_shared_dataset(handle)
+    arrays = {name: np.array(dataset[name]) for name in handle['arrays']}
+    metadata = dataset['metadata']
+    del dataset
+    detach_shared_dataset(handle)
+    return arrays, metadata
+
+
+def attach_and_count_structures(handle):
+    dataset = attach_shared_dataset(handle)
+    structure_count = len(dataset['pdb_codes'])
+    del dataset
+    detach_shared_dataset(handle)
+    return structure_count
+
+
+@pytest.mark.parametrize('use_shared_memory', [True, False])
+def test_workers_attach_the_voxel_store(legacy_voxel_set_path, use_shared_memory):
+    voxel_store = load_voxel_store(legacy_voxel_set_path)
+
+    with share_voxel_store(legacy_voxel_set_path, use_shared_memory=use_shared_memory) as dataset:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            arrays, metadata = executor.submit(copy_attached_arrays, dataset.handle()).result()
+            # attaching again in the same worker, after detaching, gives the same arrays
+            structure_counts = list(executor.map(attach_and_count_structures, [dataset.handle()] * 4))
+
+    for name in STORE_ARRAYS:
+        assert np.array_equal(arrays[name], voxel_store[name], equal_nan=name == 'coordinates')
+    assert metadata == voxel_store['metadata']
+    assert structure_counts == [len(voxel_store['pdb_codes'])] * 4
+
+
+def test_arrays_filled_in_place_are_seen_by_workers():
+    with SharedDataset.allocate({'values': (3, 4)}, {'values': 'float32'}, metadata={'filled': True}) as dataset:
+        dataset.arrays()['values'][...] = np.arange(12).reshape(3, 4)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            arrays, metadata = executor.submit(copy_attached_arrays, dataset.handle()).result()
+
+    assert np.array_equal(arrays['values'], np.arange(12, dtype=np.float32).reshape(3, 4))
+    assert metadata == {'filled': True}
+
+
+def test_empty_arrays_can_be_shared():
+    with SharedDataset.from_arrays({'pdb_codes': np.array([], dtype=str), 'metadata': {}}) as dataset:
+        assert dataset.arrays()['pdb_codes'].shape == (0,)
+
+
+def test_closing_releases_the_shared_memory():
+    dataset = SharedDataset.from_arrays({'values': np.arange(5)})
+    block_name = dataset.handle()['arrays']['values']['name']
+
+    dataset.close()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block_name)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from functions.registry import voxel_grid_from_config
+from functions.structures import voxelize_structure_set
+from functions.voxels import create_voxel_grid, find_voxels_for_coordinates
+
+
+FIXTURE_PDB_CODES = ['1hhk', '1a1m', '1a1o', '1a9b']
+
+
+def write_alpha_carbons(filename, coordinates):
+    lines = [f"ATOM  {serial:5d}  CA  GLY C{serial:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00 20.00           C  " for serial, (x, y, z) in enumerate(coordinates, start=1)]
+    filename.write_text('\n'.join(lines + ['END']) + '\n')
+
+
+@pytest.fixture(params=['config', 'negative_offset'])
+def voxel_grid(request, repository_config):
+    if request.param == 'config':
+        return voxel_grid_from_config(repository_config)
+    return create_voxel_grid([-42.365, 56.031, 63.670], [36, 20, 20], 1, range_offset=1, x_offset=-5, y_offset=-2, z_offset=-3)
+
+
+@pytest.fixture
+def structure_info(structures_directory, voxel_grid):
+    # a short peptide with alpha carbons on the near edge of the grid, on a voxel edge, on the far edge and beyond it, all to the three decimal places of the PDB format
+    origin = np.round(voxel_grid.origin, 3)
+    far_edge = np.round(np.asarray(voxel_grid.origin) + np.asarray(voxel_grid.shape) * voxel_grid.voxel_size, 3)
+    write_alpha_carbons(structures_directory / '9edg_peptide.pdb', [origin, origin + [3, 4, 5], far_edge - 0.001, far_edge, origin - [0.001, 0, 0]])
+    return {'structures': {pdb_code: {'pdb_code': pdb_code} for pdb_code in FIXTURE_PDB_CODES + ['9edg']}}
+
+
+def test_structure_set_matches_scan_for_each_structure(structure_info, voxel_grid, repository_config):
+    structure_set = voxelize_structure_set(structure_info, voxel_grid, repository_config, peptide_length=9)
+
+    voxels = voxel_grid.to_dict()['voxels']
+    assert structure_set['pdb_codes'] == list(structure_info['structures'])
+    for row, pdb_code in enumerate(structure_set['pdb_codes']):
+        coordinates = [tuple(coordinate) for coordinate in structure_set['coordinates'][row] if not np.isnan(coordinate).any()]
+        scan = find_voxels_for_coordinates(coordinates, ['GLY'] * len(coordinates), voxels, voxel_size=voxel_grid.voxel_size, lookup='scan')
+        expected = [voxel_grid.label_to_index(scan[str(position)]['voxel_label']) if str(position) in scan else -1 for position in range(1, 10)]
+        assert structure_set['voxel_indices'][row].tolist() == expected
+        assert structure_set['valid'][row].tolist() == [voxel_index >= 0 for voxel_index in expected]
+
+
+def test_short_peptides_are_padded_outside_the_grid(structure_info, voxel_grid, repository_config):
+    structure_set = voxelize_structure_set(structure_info, voxel_grid, repository_config, peptide_length=9)
+
+    row = structure_set['pdb_codes'].index('9edg')
+    assert structure_set['valid'][row].tolist() == [True, True, True, False, False, False, False, False, False]
+    assert np.isnan(structure_set['coordinates'][row, 5:]).all()
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from functions import subset_search
+from functions.subset_search import dominated_keys, is_dominated_by_subsets, is_pruned, load_checkpointed_record, max_rmsd_score, noise_rmsd_score, positions_key, search_settings
+
+
+def record(noise_cluster_size, max_rmsd, **fields):
+    return dict({'noise_cluster_size': noise_cluster_size, 'max_rmsd': max_rmsd, 'cluster_count': 3}, **fields)
+
+
+def row(positions, noise_cluster_size, max_rmsd):
+    return {'positions': positions, 'noise_cluster_size': noise_cluster_size, 'max_rmsd': max_rmsd}
+
+
+def test_a_missing_max_rmsd_scores_worst():
+    assert noise_rmsd_score(record(0, None)) == float('inf')
+    assert max_rmsd_score(record(0, None)) == float('inf')
+    assert noise_rmsd_score(record(300, 9.5)) < noise_rmsd_score(record(0, None))
+    assert noise_rmsd_score(record(12, 1.2345)) == 14.81
+
+
+def test_supersets_of_noisy_subsets_are_pruned():
+    records = {'4': record(10, 1.0), '5': record(60, 1.0), '6': record(10, 1.0)}
+
+    assert not is_pruned((4, 6), records, set(), None, 100)
+    assert not is_pruned((5,), records, set(), 0.5, 100)
+    assert is_pruned((4, 5), records, set(), 0.5, 100)
+    assert not is_pruned((4, 6), records, set(), 0.5, 100)
+    # a subset which was itself pruned prunes its supersets
+    assert is_pruned((4, 6, 7), records, {'6_7'}, 0.5, 100)
+
+
+def test_supersets_are_only_dominated_if_every_searched_subset_is():
+    records = {'4': record(10, 1.0), '5': record(20, 2.0), '6': record(5, 0.5)}
+
+    assert is_dominated_by_subsets((4, 5), records, set(), {'4', '5'})
+    assert not is_dominated_by_subsets((4, 6), records, set(), {'4', '5'})
+    # pruned subsets count as dominated, and subsets which were never searched are left out
+    assert is_dominated_by_subsets((4, 5, 7), {'4_5': record(10, 1.0)}, {'5_7'}, {'4_5'})
+    assert not is_dominated_by_subsets((4, 5), {}, set(), set())
+    assert not is_dominated_by_subsets((4,), records, set(), {'4'})
+
+
+def test_dominated_keys_treat_a_missing_max_rmsd_as_worst():
+    rows = [row('4', 10, 1.0), row('5', 20, 2.0), row('6', 5, 3.0), row('7', 5, None), row('8', 10, 1.0)]
+
+    # 5 is beaten on both counts by 4, 7 by 6 on its missing RMSD, and the equal 4 and 8 do not dominate each other
+    assert dominated_keys(rows) == {'5', '7'}
+    assert dominated_keys([row('4', 10, None), row('5', 10, None)]) == set()
+
+
+def test_search_settings_fingerprint_the_structures():
+    settings = search_settings(['1hhk', '1a1m'], 3, False, False)
+
+    assert settings['method'] == 'features'
+    assert settings['structure_count'] == 2
+    assert search_settings(['1a1m', '1hhk'], 3, False, False)['structure_set_hash'] != settings['structure_set_hash']
+    assert search_settings(['1hhk', '1a1m'], 3, True, False)['method'] == 'distance_cache'
+
+
+@pytest.mark.parametrize('changed_setting', ['method', 'min_cluster_size', 'superpose', 'structure_count', 'structure_set_hash'])
+def test_records_with_other_settings_are_not_resumed(tmp_path, changed_setting):
+    settings = search_settings(['1hhk', '1a1m', '1a1o'], 3, False, False)
+    with open(tmp_path / 'clustering_4_5.json', 'w') as filehandle:
+        json.dump(record(1, 1.0, search_settings=settings), filehandle)
+
+    other_settings = dict(settings, **{changed_setting: 'changed'})
+
+    assert load_checkpointed_record(str(tmp_path), (4, 5), settings)['noise_cluster_size'] == 1
+    assert load_checkpointed_record(str(tmp_path), (4, 5), other_settings) is None
+    assert load_checkpointed_record(str(tmp_path), (4, 6), settings) is None
+
+
+def test_records_without_settings_are_not_resumed(tmp_path):
+    # e.g. a record written by the notebook or a sweep
+    with open(tmp_path / 'clustering_4_5.json', 'w') as filehandle:
+        json.dump(record(1, 1.0), filehandle)
+
+    assert load_checkpointed_record(str(tmp_path), (4, 5), search_settings(['1hhk'], 3, False, False)) is None
+
+
+def test_an_interrupted_search_resumes_where_it_stopped(legacy_voxel_set_path, tmp_path, monkeypatch):
+    pytest.importorskip('hdbscan')
+    # the search records are written to output/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    clustered = []
+    write_clustering_records = subset_search.write_clustering_records
+    def recording_write_clustering_records(sweep, possible_clustering_positions, **kwargs):
+        clustered.extend(positions_key(positions) for positions in possible_clustering_positions)
+        return write_clustering_records(sweep, possible_clustering_positions, **kwargs)
+    monkeypatch.setattr(subset_search, 'write_clustering_records', recording_write_clustering_records)
+
+    ranked = subset_search.search_position_subsets(legacy_voxel_set_path, min_size=1, max_size=1)
+    assert sorted(clustered) == [str(position) for position in range(1, 10)]
+
+    # a record made with other settings, and one which was never written, are clustered again
+    search_path = subset_search.subset_search_filepath('e91d9bdc62da8457549cfbeed4c2b0aa', 3)
+    with open(f'{search_path}/clustering_4.json', 'r') as filehandle:
+        stale_record = json.load(filehandle)
+    stale_record['search_settings']['min_cluster_size'] = 5
+    with open(f'{search_path}/clustering_4.json', 'w') as filehandle:
+        json.dump(stale_record, filehandle)
+    (tmp_path / search_path / 'clustering_7.json').unlink()
+    clustered.clear()
+
+    resumed = subset_search.search_position_subsets(legacy_voxel_set_path, min_size=1, max_size=1)
+
+    assert sorted(clustered) == ['4', '7']
+    assert resumed == ranked
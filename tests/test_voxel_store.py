@@ -0,0 +1,53 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from functions.registry import voxel_grid_from_config
+from functions.voxel_store import STORE_ARRAYS, VoxelStoreBuilder, load_voxel_store, store_structure_voxels, voxel_store_from_json, write_voxel_store
+
+
+@pytest.fixture
+def voxel_grid(repository_config):
+    return voxel_grid_from_config(repository_config)
+
+
+@pytest.fixture
+def legacy_voxel_store(legacy_voxel_set_path):
+    return load_voxel_store(legacy_voxel_set_path)
+
+
+def assert_stores_equal(voxel_store, expected):
+    for name in STORE_ARRAYS:
+        assert voxel_store[name].dtype == expected[name].dtype
+        assert np.array_equal(voxel_store[name], expected[name], equal_nan=name == 'coordinates')
+    assert voxel_store['metadata'] == expected['metadata']
+
+
+def test_store_built_from_the_committed_json_matches_the_committed_store(legacy_voxel_store, legacy_voxel_set_path, voxel_grid):
+    voxel_store = voxel_store_from_json(legacy_voxel_store['pdb_codes'].tolist(), voxel_grid, legacy_voxel_set_path)
+
+    assert_stores_equal(voxel_store, legacy_voxel_store)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_store_round_trips_through_its_files(legacy_voxel_store, tmp_path, mmap):
+    write_voxel_store(legacy_voxel_store, str(tmp_path))
+
+    assert_stores_equal(load_voxel_store(str(tmp_path), mmap=mmap), legacy_voxel_store)
+
+
+def test_store_rebuilds_the_committed_json(legacy_voxel_store, legacy_voxel_set_path, voxel_grid):
+    for pdb_code, structure_voxels in store_structure_voxels(legacy_voxel_store, voxel_grid):
+        with open(os.path.join(legacy_voxel_set_path, f'{pdb_code}.json'), 'r') as filehandle:
+            assert json.load(filehandle)['structure_voxels'] == structure_voxels
+
+
+def test_builder_grows_to_fit_the_structures(legacy_voxel_store, voxel_grid):
+    # starting with room for one short peptide means both the rows and the columns have to grow
+    builder = VoxelStoreBuilder(voxel_grid, legacy_voxel_store['metadata']['voxel_grid_hash'], structure_count=1, peptide_length=2)
+    for pdb_code, structure_voxels in store_structure_voxels(legacy_voxel_store, voxel_grid):
+        builder.add(pdb_code, structure_voxels)
+
+    assert_stores_equal(builder.build(), legacy_voxel_store)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from functions.registry import voxel_grid_from_config
+from functions.voxels import create_voxel_grid, find_voxels_for_coordinates
+
+
+@pytest.fixture(params=['config', 'negative_offset', 'half_angstrom'])
+def voxel_grid(request, repository_config):
+    if request.param == 'config':
+        return voxel_grid_from_config(repository_config)
+    elif request.param == 'negative_offset':
+        return create_voxel_grid([-42.365, 56.031, 63.670], [6, 4, 4], 1, range_offset=1, x_offset=-3, y_offset=-8, z_offset=-1)
+    return create_voxel_grid([0.1, -0.2, 0.3], [3, 2, 2], 0.5, range_offset=1, x_offset=-1)
+
+
+def boundary_coordinates(voxel_grid) -> list:
+    """
+    Builds coordinates on and either side of voxel edges along each axis, at the near and far edges of the grid, just beyond them and in the middle, with the other two axes in the middle of the grid.
+    """
+    middle = [axis_start + (axis_length // 2 + 0.5) * voxel_grid.voxel_size for axis_start, axis_length in zip(voxel_grid.origin, voxel_grid.shape)]
+    coordinates = []
+    for axis, (axis_start, axis_length) in enumerate(zip(voxel_grid.origin, voxel_grid.shape)):
+        for index in sorted({-1, 0, 1, axis_length // 2, axis_length - 1, axis_length, axis_length + 1}):
+            edge = axis_start + index * voxel_grid.voxel_size
+            for value in [np.nextafter(edge, -np.inf), edge, np.nextafter(edge, np.inf)]:
+                coordinate = list(middle)
+                coordinate[axis] = float(value)
+                coordinates.append(tuple(coordinate))
+    return coordinates
+
+
+def test_analytic_lookup_matches_scan_on_voxel_edges(voxel_grid):
+    coordinates = boundary_coordinates(voxel_grid)
+    sequence = ['GLY'] * len(coordinates)
+
+    analytic = find_voxels_for_coordinates(coordinates, sequence, voxel_grid['voxels'], voxel_size=voxel_grid.voxel_size, lookup='analytic')
+    # the scan is made over the voxels dictionary, as the notebook built it
+    scan = find_voxels_for_coordinates(coordinates, sequence, voxel_grid.to_dict()['voxels'], voxel_size=voxel_grid.voxel_size, lookup='scan')
+
+    assert analytic == scan
+    # the points beyond the grid on each side of each axis are left out
+    assert 0 < len(analytic) < len(coordinates)
+
+
+def test_coordinates_outside_the_grid_have_no_voxel(voxel_grid):
+    below = [axis_start - voxel_grid.voxel_size / 2 for axis_start in voxel_grid.origin]
+    beyond = [axis_start + axis_length * voxel_grid.voxel_size for axis_start, axis_length in zip(voxel_grid.origin, voxel_grid.shape)]
+    first = list(voxel_grid.origin)
+
+    structure_voxels = find_voxels_for_coordinates([below, beyond, first], ['GLY', 'ALA', 'LEU'], voxel_grid['voxels'], voxel_size=voxel_grid.voxel_size)
+
+    assert list(structure_voxels) == ['3']
+    assert structure_voxels['3']['voxel_label'] == '0_0_0'
+    assert structure_voxels['3']['residue'] == 'LEU'
+
+
+def test_voxel_grid_lookup_matches_scan_on_voxel_edges(voxel_grid):
+    coordinates = boundary_coordinates(voxel_grid)
+    scan = find_voxels_for_coordinates(coordinates, ['GLY'] * len(coordinates), voxel_grid.to_dict()['voxels'], voxel_size=voxel_grid.voxel_size, lookup='scan')
+
+    voxel_indices, valid = voxel_grid.find_voxel_indices(np.array(coordinates))
+
+    expected = [scan[str(position)]['voxel_label'] if str(position) in scan else None for position in range(1, len(coordinates) + 1)]
+    assert [voxel_grid.index_to_label(voxel_index) if voxel_index >= 0 else None for voxel_index in voxel_indices] == expected
+    assert valid.tolist() == [voxel_label is not None for voxel_label in expected]
+
+
+def test_voxel_grid_lookup_keeps_the_shape_of_the_coordinates(voxel_grid):
+    coordinates = np.array(boundary_coordinates(voxel_grid)[:6]).reshape(2, 3, 3)
+    coordinates[1, 2] = np.nan
+
+    voxel_indices, valid = voxel_grid.find_voxel_indices(coordinates)
+
+    assert voxel_indices.shape == valid.shape == (2, 3)
+    # missing coordinates are outside the grid
+    assert voxel_indices[1, 2] == -1
+    assert not valid[1, 2]
+    assert np.array_equal(voxel_indices.ravel(), voxel_grid.find_voxel_indices(coordinates.reshape(-1, 3))[0])
+
+
+def test_voxel_labels_and_indices_round_trip(voxel_grid):
+    voxel_labels = list(voxel_grid.iter_labels())
+
+    assert [voxel_grid.label_to_index(voxel_label) for voxel_label in voxel_labels] == list(range(voxel_grid.voxel_count))
+    assert [voxel_grid.index_to_label(voxel_index) for voxel_index in range(voxel_grid.voxel_count)] == voxel_labels
+    with pytest.raises(KeyError):
+        voxel_grid.index_to_label(voxel_grid.voxel_count)
+    with pytest.raises(KeyError):
+        voxel_grid.label_to_index(f"{voxel_grid.shape[0]}_0_0")
+
+
+def test_voxel_grid_matches_the_voxels_dictionary(voxel_grid):
+    voxels = voxel_grid.to_dict()['voxels']
+
+    assert list(voxels) == voxel_grid.labels
+    assert np.array_equal(voxel_grid.starts, [voxel['start'] for voxel in voxels.values()])
+    assert np.array_equal(voxel_grid.centres, [voxel['centre'] for voxel in voxels.values()])
+    assert voxel_grid['voxels']['0_0_0']['start'] == voxel_grid.origin
@@ -10,6 +10,9 @@ import json
 from pymol import cmd, cgo
 from colorsys import hls_to_rgb
 
+from functions.helpers import load_config
+from functions.registry import resolve_voxel_set
+
 '''
 Includes the cgo_cube and ammended cubes function from the cubes pymol extension by Thomas Holder
 
@@ -270,9 +273,9 @@ def rainbow_color_steps(steps:int, end=6/8):
 
 ### Main function below ###
 
-voxel_map_hash = 'e91d9bdc62da8457549cfbeed4c2b0aa'
+voxel_set_filepath, voxel_map_hash = resolve_voxel_set(load_config())
 
-voxel_grid = json.load(open(f"output/voxel_sets/{voxel_map_hash}/voxel_set.json", 'r'))
+voxel_grid = json.load(open(f"{voxel_set_filepath}/voxel_set.json", 'r'))
 
 cmd.set_view("""\
      0.712135971,    0.638299167,   -0.292294502,\
@@ -298,8 +301,8 @@ display_reference_planes(voxel_grid['params']['centre_of_mass'])
 display_cleft_bounding_box(voxel_grid['params']['centre_of_mass'], voxel_grid['params']['box_xyz'], y_offset=voxel_grid['params']['y_offset'], show_spheres=False)
 
 # Load the file containing the position of the used voxels and their frequency
-position_voxels = json.load(open(f"output/voxel_sets/{voxel_map_hash}/position_voxels.json", 'r'))
-voxel_grid = json.load(open(f"output/voxel_sets/{voxel_map_hash}/voxel_set.json", 'r'))
+position_voxels = json.load(open(f"{voxel_set_filepath}/position_voxels.json", 'r'))
+voxel_grid = json.load(open(f"{voxel_set_filepath}/voxel_set.json", 'r'))
 
 # we'll now make the cubes method available as an extension in Pymol
 cmd.extend('cubes', cubes)